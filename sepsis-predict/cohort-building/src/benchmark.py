@@ -0,0 +1,439 @@
+"""
+benchmark.py
+
+This file contains a benchmark suite for the public cohort-building functions in
+cohort.py, sirs.py, icd9_processing.py, note_processing.py, features.py and
+trewscore.py, run on synthetic data (see synthetic.py).
+
+Each function is timed (best of <repeat> runs) and then run once more under
+tracemalloc to record its peak memory. The results are saved as JSON so that
+runs can be compared across changes.
+
+Run from the cohort-building directory:
+    python -m src.benchmark --patients 1000 10000 1000000 --output bench.json
+
+There are two suites per cohort size:
+    - run_suite() holds the whole synthetic cohort in memory and feeds every
+        in-memory function with the output of the previous stage. It is only
+        run up to --max-in-memory patients (100k by default).
+    - run_streamed_suite() streams the cohort to CSV files with
+        synthetic.write_cohort() and runs the chunked, cached (loaders.py) and
+        DuckDB paths on them, so it scales to 1M patients and more.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Dict, List, Tuple
+from src.cohort import (
+    filter_df,
+    get_dev_cohort_list,
+    join_infections,
+    build_table_index,
+    range_positions,
+    filter_indexed,
+    get_dev_cohort_list_chunked,
+    hash_subject_ids,
+    in_dev_sample,
+    sample_dev_cohort_list,
+)
+from src.features import (
+    summarize_by_mean,
+    pivot_wide,
+    merge_dataframes,
+    impute_missing,
+    summarize_pivot_chunked,
+    summarize_by_bucket,
+    align_labs_asof,
+)
+from src.icd9_processing import (
+    parse_prefix,
+    create_prefix_dict,
+    summarize_icd9,
+    get_compiled_prefixes,
+    summarize_icd9_compiled,
+    summarize_icd9_categories,
+    INFECTION_ICD9_PREFIX,
+)
+from src.note_processing import summarize_notes, summarize_note_keywords, summarize_notes_chunked
+from src.sirs import (
+    summarize_sirs,
+    summarize_sirs_packed,
+    summarize_sirs_windowed,
+    sirs_criteria_mask,
+    sirs_count,
+    rolling_criteria_mask,
+    get_criteria_1,
+    get_criteria_2,
+    get_criteria_3,
+    get_criteria_4,
+)
+from src.imputation import segment_start_positions
+from src.loaders import build_cache, load_table
+from src.synthetic import generate_cohort, write_cohort
+from src import duckdb_engine, trewscore
+
+STAY_KEYS = ["subject_id", "hadm_id", "icustay_id", "charttime"]
+
+
+def measure(func: Callable[[], Any], repeat: int = 3) -> Tuple[Any, Dict[str, float]]:
+    """
+    Runs <func> <repeat> times to measure its wall time, and once more under
+    tracemalloc to measure its peak memory.
+
+    Parameters:
+        func (Callable[[], Any]): The function to measure (without arguments).
+        repeat (int): The number of timed runs.
+
+    Returns:
+        result (Any): The return value of the last run.
+        stats (Dict[str, float]): The best and mean wall time in seconds and the
+            peak traced memory in MB.
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = {
+        "best_seconds": min(times),
+        "mean_seconds": sum(times) / len(times),
+        "peak_memory_mb": peak / 2**20,
+    }
+
+    return result, stats
+
+
+def _rows(result: Any) -> int:
+    if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray, list, dict)):
+        return len(result)
+    return -1
+
+
+def _make_bench(
+    results: List[Dict[str, Any]], n_patients: int, repeat: int
+) -> Callable[[str, Callable[[], Any], int], Any]:
+    """
+    Returns a function bench(name, func, rows_in) that measures <func> (see
+    measure()), appends its record to <results> and returns its result.
+    """
+
+    def bench(name: str, func: Callable[[], Any], rows_in: int) -> Any:
+        result, stats = measure(func, repeat)
+        results.append(
+            {
+                "n_patients": n_patients,
+                "function": name,
+                "rows_in": rows_in,
+                "rows_out": _rows(result),
+                **stats,
+            }
+        )
+        return result
+
+    return bench
+
+
+def run_suite(n_patients: int, repeat: int = 3, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Generates a synthetic cohort of <n_patients> patients in memory and
+    benchmarks every in-memory function of the A3 pipeline on it, feeding each
+    stage with the output of the previous one (as in the A3 notebook). The
+    chunked and cached functions are benchmarked by run_streamed_suite().
+
+    Parameters:
+        n_patients (int): The number of synthetic patients.
+        repeat (int): The number of timed runs per function.
+        seed (int): The random seed of the synthetic cohort.
+
+    Returns:
+        results (List[Dict[str, Any]]): One record per benchmarked function.
+    """
+
+    tables = generate_cohort(n_patients, seed)
+    labs = tables["labs_cohort"]
+    vitals = tables["vitals_cohort_sirs"]
+    diagnoses = tables["diagnoses"]
+    notes = tables["notes"]
+    hypotension_labels = tables["hypotension_labels"]
+    fluids_all = tables["fluids_all"].drop(
+        ["amount_24h", "current_amount", "relative_amount"], axis=1
+    )
+
+    results = []
+    bench = _make_bench(results, n_patients, repeat)
+
+    lab_keys = STAY_KEYS + ["lab_id"]
+    vital_keys = STAY_KEYS + ["vital_id"]
+
+    # cohort.py
+    cohort_list = bench("cohort.get_dev_cohort_list", lambda: get_dev_cohort_list(labs, n_patients), len(labs))
+    bench("cohort.hash_subject_ids", lambda: hash_subject_ids(labs["subject_id"].to_numpy()), len(labs))
+    bench("cohort.in_dev_sample", lambda: in_dev_sample(labs["subject_id"], 0.5), len(labs))
+    dev_vitals = bench("cohort.filter_df", lambda: filter_df(vitals, "subject_id", cohort_list), len(vitals))
+    indexed_vitals = bench("cohort.build_table_index", lambda: build_table_index(vitals, "subject_id"), len(vitals))
+    bench(
+        "cohort.range_positions",
+        lambda: range_positions(indexed_vitals.offsets[:-1], np.diff(indexed_vitals.offsets)),
+        len(vitals),
+    )
+    bench("cohort.filter_indexed", lambda: filter_indexed(indexed_vitals, cohort_list), len(vitals))
+    dev_labs = filter_df(labs, "subject_id", cohort_list)
+
+    # features.py
+    labs_mean = bench("features.summarize_by_mean", lambda: summarize_by_mean(dev_labs, lab_keys), len(dev_labs))
+    vitals_mean = summarize_by_mean(dev_vitals, vital_keys)
+    labs_wide = bench("features.pivot_wide", lambda: pivot_wide(labs_mean, STAY_KEYS, "lab_id"), len(labs_mean))
+    vitals_wide = pivot_wide(vitals_mean, STAY_KEYS, "vital_id")
+    merged = bench("features.merge_dataframes", lambda: merge_dataframes(labs_wide, vitals_wide), len(labs_wide) + len(vitals_wide))
+    imputed = bench("features.impute_missing", lambda: impute_missing(merged), len(merged))
+    bench("trewscore.impute_missing", lambda: trewscore.impute_missing(merged), len(merged))
+    bench("features.summarize_by_bucket", lambda: summarize_by_bucket(dev_vitals), len(dev_vitals))
+    bench("features.align_labs_asof", lambda: align_labs_asof(vitals_wide, labs_wide), len(labs_wide) + len(vitals_wide))
+
+    # sirs.py
+    dev_sirs = bench("sirs.summarize_sirs", lambda: summarize_sirs(imputed), len(imputed))
+    bench("sirs.summarize_sirs_packed", lambda: summarize_sirs_packed(imputed), len(imputed))
+    bench("sirs.summarize_sirs_windowed", lambda: summarize_sirs_windowed(imputed), len(imputed))
+    criteria_mask = bench("sirs.sirs_criteria_mask", lambda: sirs_criteria_mask(imputed), len(imputed))
+    bench("sirs.sirs_count", lambda: sirs_count(criteria_mask), len(criteria_mask))
+    # rolling_criteria_mask() expects rows sorted by stay and chart time
+    sorted_imputed = imputed.sort_values(STAY_KEYS, kind="mergesort")
+    sorted_mask = sirs_criteria_mask(sorted_imputed)
+    segment_start = segment_start_positions(sorted_imputed, STAY_KEYS[:3])
+    sorted_times = pd.to_datetime(sorted_imputed["charttime"]).to_numpy()
+    bench(
+        "sirs.rolling_criteria_mask",
+        lambda: rolling_criteria_mask(sorted_mask, segment_start, sorted_times, np.timedelta64(24, "h")),
+        len(sorted_imputed),
+    )
+    # The get_criteria_* functions add their column in place
+    criteria_df = imputed.copy()
+    for get_criteria in [get_criteria_1, get_criteria_2, get_criteria_3, get_criteria_4]:
+        bench(f"sirs.{get_criteria.__name__}", lambda: get_criteria(criteria_df), len(criteria_df))
+
+    # icd9_processing.py
+    bench("icd9_processing.parse_prefix", lambda: parse_prefix(INFECTION_ICD9_PREFIX), 0)
+    bench("icd9_processing.create_prefix_dict", create_prefix_dict, 0)
+    icd9_infections = bench(
+        "icd9_processing.summarize_icd9",
+        lambda: summarize_icd9(diagnoses, cohort_list, "has_icd9_infection", "infection"),
+        len(diagnoses),
+    )
+    organ_dys = summarize_icd9(diagnoses, cohort_list, "has_organ_dysfunction", "organ_disfunction")
+    # Compiled once per session, so this mostly times the cache lookup
+    infection_prefixes = bench("icd9_processing.get_compiled_prefixes", lambda: get_compiled_prefixes("infection"), 0)
+    bench(
+        "icd9_processing.summarize_icd9_compiled",
+        lambda: summarize_icd9_compiled(diagnoses, cohort_list, "has_icd9_infection", infection_prefixes),
+        len(diagnoses),
+    )
+    bench("icd9_processing.summarize_icd9_categories", lambda: summarize_icd9_categories(diagnoses, cohort_list), len(diagnoses))
+
+    # note_processing.py
+    note_infections = bench("note_processing.summarize_notes", lambda: summarize_notes(notes, "has_note_infection"), len(notes))
+    bench("note_processing.summarize_note_keywords", lambda: summarize_note_keywords(notes, "has_note_infection"), len(notes))
+
+    # cohort.py / trewscore.py
+    all_infections = bench("cohort.join_infections", lambda: join_infections(icd9_infections, note_infections), len(icd9_infections) + len(note_infections))
+    dev_sepsis = bench("trewscore.summarize_sepsis", lambda: trewscore.summarize_sepsis(dev_sirs, all_infections), len(dev_sirs))
+    # get_sepsis_status() adds its column in place
+    sepsis_summary = dev_sepsis.copy()
+    bench("trewscore.get_sepsis_status", lambda: trewscore.get_sepsis_status(sepsis_summary), len(sepsis_summary))
+    dev_severe_sepsis = bench("trewscore.summarize_severe_sepsis", lambda: trewscore.summarize_severe_sepsis(dev_sepsis, organ_dys), len(dev_sepsis))
+    bench(
+        "trewscore.summarize_septic_shock",
+        lambda: trewscore.summarize_septic_shock(dev_severe_sepsis, hypotension_labels, fluids_all),
+        len(dev_severe_sepsis) + len(hypotension_labels) + len(fluids_all),
+    )
+
+    return results
+
+
+def _concat_csv_parts(part_directory: str, csv_path: str) -> int:
+    """
+    Concatenates the CSV part files that write_cohort() wrote to <part_directory>
+    into one CSV file (keeping the header of the first part only), one line at a
+    time, and returns the number of data rows.
+    """
+
+    n_rows = 0
+    with open(csv_path, "w") as out:
+        for i, part_name in enumerate(sorted(os.listdir(part_directory))):
+            with open(os.path.join(part_directory, part_name)) as part:
+                header = part.readline()
+                if i == 0:
+                    out.write(header)
+                for line in part:
+                    out.write(line)
+                    n_rows += 1
+
+    return n_rows
+
+
+def run_streamed_suite(
+    n_patients: int,
+    repeat: int = 3,
+    seed: int = 0,
+    dev_patients: int = 1000,
+    chunk_patients: int = 10_000,
+) -> List[Dict[str, Any]]:
+    """
+    Streams a synthetic cohort of <n_patients> patients to CSV files with
+    write_cohort() (holding <chunk_patients> patients in memory at a time) and
+    benchmarks the functions that read the A3 files without loading them whole:
+    the chunked functions, the typed Parquet cache of loaders.py and, if DuckDB
+    is installed, the DuckDB backend. The development cohort holds the
+    <dev_patients> smallest subject_ids, as in the A3 notebook.
+
+    Parameters:
+        n_patients (int): The number of synthetic patients.
+        repeat (int): The number of timed runs per function.
+        seed (int): The random seed of the synthetic cohort.
+        dev_patients (int): The number of patients in the development cohort.
+        chunk_patients (int): The number of patients generated at a time (10k
+            patients hold about 4M vitals rows in memory).
+
+    Returns:
+        results (List[Dict[str, Any]]): One record per benchmarked function.
+    """
+
+    results = []
+    bench = _make_bench(results, n_patients, repeat)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        part_directories = write_cohort(
+            os.path.join(tmp_dir, "parts"), n_patients, seed, chunk_patients, file_format="csv"
+        )
+        paths = {}
+        n_rows = {}
+        for name, part_directory in part_directories.items():
+            paths[name] = os.path.join(tmp_dir, f"{name}.csv")
+            n_rows[name] = _concat_csv_parts(part_directory, paths[name])
+            shutil.rmtree(part_directory)
+
+        # cohort.py
+        cohort_list = bench(
+            "cohort.get_dev_cohort_list_chunked",
+            lambda: get_dev_cohort_list_chunked(paths["labs_cohort"], dev_patients),
+            n_rows["labs_cohort"],
+        )
+        bench(
+            "cohort.sample_dev_cohort_list",
+            lambda: sample_dev_cohort_list(paths["labs_cohort"], dev_patients / n_patients),
+            n_rows["labs_cohort"],
+        )
+
+        # loaders.py: the first load parses the CSV file and writes the cache,
+        # later loads only read the requested columns from the cache. The
+        # loaders return whole tables, so they are timed on fluids_all (about 25
+        # rows per patient) rather than on the vitals
+        cache_dir = os.path.join(tmp_dir, ".cache")
+        bench(
+            "loaders.build_cache",
+            lambda: build_cache(paths["fluids_all"], cache_dir),
+            n_rows["fluids_all"],
+        )
+        fluid_columns = STAY_KEYS + ["adequate_fluid"]
+        bench(
+            "loaders.load_table",
+            lambda: load_table(tmp_dir, "fluids_all.csv", fluid_columns, cache_dir),
+            n_rows["fluids_all"],
+        )
+        bench(
+            "loaders.load_table(parse_dates=True)",
+            lambda: load_table(tmp_dir, "fluids_all.csv", fluid_columns, cache_dir, parse_dates=True),
+            n_rows["fluids_all"],
+        )
+
+        # features.py / note_processing.py
+        bench(
+            "features.summarize_pivot_chunked",
+            lambda: summarize_pivot_chunked(paths["vitals_cohort_sirs"], columns="vital_id", subject_ids=cohort_list),
+            n_rows["vitals_cohort_sirs"],
+        )
+        bench(
+            "note_processing.summarize_notes_chunked",
+            lambda: summarize_notes_chunked(paths["notes"], "has_note_infection"),
+            n_rows["notes"],
+        )
+
+        # duckdb_engine.py scans the CSV file directly
+        if duckdb_engine.has_duckdb():
+            con = duckdb_engine.connect()
+            bench(
+                "duckdb_engine.filter_df",
+                lambda: duckdb_engine.filter_df(paths["vitals_cohort_sirs"], "subject_id", cohort_list, con=con),
+                n_rows["vitals_cohort_sirs"],
+            )
+            con.close()
+
+    return results
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    """
+    Formats benchmark results as a plain text table.
+    """
+
+    table = pd.DataFrame(results)[
+        ["n_patients", "function", "rows_in", "rows_out", "best_seconds", "peak_memory_mb"]
+    ]
+
+    return table.to_string(index=False, float_format=lambda x: f"{x:.3f}")
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the A3 cohort-building functions.")
+    parser.add_argument("--patients", type=int, nargs="+", default=[1000], help="cohort sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per function")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic data seed")
+    parser.add_argument(
+        "--max-in-memory",
+        type=int,
+        default=100_000,
+        help="largest cohort size for the in-memory suite (larger sizes are only streamed)",
+    )
+    parser.add_argument("--dev-patients", type=int, default=1000, help="development cohort size of the streamed suite")
+    parser.add_argument("--chunk-patients", type=int, default=10_000, help="patients generated at a time by the streamed suite")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON output path")
+    parsed = parser.parse_args(args)
+
+    results = []
+    for n_patients in parsed.patients:
+        if n_patients <= parsed.max_in_memory:
+            results += run_suite(n_patients, parsed.repeat, parsed.seed)
+        results += run_streamed_suite(
+            n_patients, parsed.repeat, parsed.seed, parsed.dev_patients, parsed.chunk_patients
+        )
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "results": results,
+    }
+    with open(parsed.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
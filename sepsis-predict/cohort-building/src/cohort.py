@@ -14,9 +14,12 @@ IMPORTANT INSTRUCTIONS:
 # Imports - Do not modify
 import numpy as np
 import pandas as pd
-from typing import List, Any
+from typing import List, Any, Iterable, NamedTuple, Union
+from src.dtype_policy import compact_dtypes, fill_flags
+from src.instrumentation import instrumented
 
 
+@instrumented
 def filter_df(df: pd.DataFrame, filter_col: str, value_list: List[Any]) -> pd.DataFrame:
     """
     Returns a filtered version of the input DataFrame where only rows that have
@@ -69,6 +72,101 @@ def filter_df(df: pd.DataFrame, filter_col: str, value_list: List[Any]) -> pd.Da
     # ==================== YOUR CODE HERE ====================
 
 
+class IndexedTable(NamedTuple):
+    """
+    A table indexed on one column for repeated filter_df() calls (see
+    build_table_index()).
+
+    Attributes:
+        df (pd.DataFrame): The original table.
+        filter_col (str): The indexed column.
+        keys (pd.Index): The distinct non-null values of <filter_col>.
+        order (np.ndarray): The row positions of <df> sorted by <filter_col>.
+        offsets (np.ndarray): CSR-style offsets, the rows of keys[i] are
+            order[offsets[i]:offsets[i + 1]].
+    """
+
+    df: pd.DataFrame
+    filter_col: str
+    keys: pd.Index
+    order: np.ndarray
+    offsets: np.ndarray
+
+
+def build_table_index(df: pd.DataFrame, filter_col: str) -> IndexedTable:
+    """
+    Sorts the rows of <df> once by <filter_col> and stores the row range of each
+    distinct value, so that filter_indexed() only has to gather the ranges of the
+    requested values instead of scanning the whole table.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame to be indexed
+        filter_col (str): The column to index
+
+    Returns:
+        indexed (IndexedTable): The indexed table.
+    """
+
+    if filter_col not in df.columns:
+        raise ValueError(f'{filter_col} is not in df columns.')
+
+    codes, keys = pd.factorize(df[filter_col], sort=True)
+    order = np.argsort(codes, kind="stable")
+    # Null values have code -1 and sort first, they can never be selected
+    order = order[np.count_nonzero(codes < 0):]
+    counts = np.bincount(codes[codes >= 0], minlength=len(keys))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    return IndexedTable(df, filter_col, pd.Index(keys), order, offsets)
+
+
+def range_positions(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Returns the positions of the row ranges [starts[i], starts[i] + lengths[i]),
+    concatenated in order, without a Python loop over the ranges.
+    """
+
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(
+        lengths.sum()
+    )
+
+
+def filter_indexed(indexed: IndexedTable, value_list: List[Any]) -> pd.DataFrame:
+    """
+    Same as filter_df(), but on an indexed table: the rows of each requested value
+    are gathered from its row range, so the cost depends on the number of values
+    and matching rows, not on the size of the table. The rows are returned in
+    their original order, with their original index. Unlike isin(), a null value
+    in <value_list> never matches.
+
+    EXAMPLE:
+        indexed_labs = build_table_index(labs_cohort, "subject_id")
+        dev_labs = filter_indexed(indexed_labs, cohort_list)
+
+    Parameters:
+        indexed (IndexedTable): A table created by build_table_index().
+        value_list (List[Any]): The list of values to filter on
+
+    Returns:
+        filtered_df (pd.DataFrame): The rows of the table whose <filter_col> value
+            is in <value_list>.
+    """
+
+    if len(value_list) == 0:
+        return indexed.df.iloc[:0, :].copy()
+
+    key_positions = indexed.keys.get_indexer(pd.unique(pd.Series(value_list)))
+    key_positions = key_positions[key_positions >= 0]
+
+    starts = indexed.offsets[key_positions]
+    ranges = range_positions(starts, indexed.offsets[key_positions + 1] - starts)
+    row_positions = np.sort(indexed.order[ranges])
+
+    filtered_df = indexed.df.iloc[row_positions]
+
+    return filtered_df
+
+
 def get_dev_cohort_list(df: pd.DataFrame, num_subject_ids: int = 1000):
     """
     Returns a list of the smallest <num_subject_ids> subject_ids in the DataFrame.
@@ -128,6 +226,146 @@ def get_dev_cohort_list(df: pd.DataFrame, num_subject_ids: int = 1000):
     # ==================== YOUR CODE HERE ====================
 
 
+def _subject_id_chunks(
+    source: Union[str, Iterable[pd.DataFrame]], chunksize: int
+) -> Iterable[np.ndarray]:
+    """
+    Yields the `subject_id` values of each chunk of <source>, which is either the
+    path to a CSV file (only its `subject_id` column is read) or an iterable of
+    DataFrame chunks.
+    """
+
+    if isinstance(source, str):
+        source = pd.read_csv(source, usecols=["subject_id"], chunksize=chunksize)
+    for chunk in source:
+        yield chunk["subject_id"].dropna().to_numpy().astype("int64")
+
+
+def get_dev_cohort_list_chunked(
+    source: Union[str, Iterable[pd.DataFrame]],
+    num_subject_ids: int = 1000,
+    chunksize: int = 1_000_000,
+) -> List[int]:
+    """
+    Streaming version of get_dev_cohort_list(): returns the smallest
+    <num_subject_ids> distinct subject_ids of a table that is read in chunks.
+
+    Only a bounded candidate set of at most <num_subject_ids> ids is kept. Each
+    chunk's distinct ids are merged into it and everything above the
+    <num_subject_ids> smallest is dropped, so memory does not depend on the
+    number of subjects in the table.
+
+    Parameters:
+        source (Union[str, Iterable[pd.DataFrame]]): Either the path to a CSV file
+            or an iterable of DataFrame chunks with a `subject_id` column.
+        num_subject_ids (int): The number of subject_ids to return
+        chunksize (int): The number of rows per chunk when reading a CSV file.
+
+    Returns:
+        subject_ids (List[int]): The smallest <num_subject_ids> subject_ids, in
+            ascending order.
+    """
+
+    if num_subject_ids <= 0:
+        return []
+
+    smallest = np.array([], dtype="int64")
+    for chunk_ids in _subject_id_chunks(source, chunksize):
+        smallest = np.unique(np.concatenate([smallest, chunk_ids]))[:num_subject_ids]
+
+    subject_ids = [int(subject_id) for subject_id in smallest]
+
+    return subject_ids
+
+
+def hash_subject_ids(subject_ids: np.ndarray, seed: int = 0) -> np.ndarray:
+    """
+    Maps each subject_id to a reproducible pseudo-random number in [0, 1), using
+    the splitmix64 mixing function on the id and the seed. The value only depends
+    on (subject_id, seed), so it is the same for every table and every run.
+
+    Parameters:
+        subject_ids (np.ndarray): The subject_ids to hash.
+        seed (int): The sampling seed.
+
+    Returns:
+        hashes (np.ndarray): A float array with one value per subject_id.
+    """
+
+    with np.errstate(over="ignore"):
+        x = np.asarray(subject_ids).astype(np.uint64) + np.uint64(seed) * np.uint64(
+            0x9E3779B97F4A7C15
+        )
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+
+    # The top 53 bits give an exactly representable float in [0, 1)
+    hashes = (x >> np.uint64(11)).astype(np.float64) / float(2**53)
+
+    return hashes
+
+
+def in_dev_sample(subject_ids: pd.Series, fraction: float, seed: int = 0) -> pd.Series:
+    """
+    Returns a boolean Series that is True for the subject_ids that belong to the
+    reproducible random development sample (hash(subject_id, seed) < fraction).
+    Can be applied to any table (or chunk) directly, without collecting its ids.
+
+    EXAMPLE:
+        dev_vitals = vitals_cohort_sirs[in_dev_sample(vitals_cohort_sirs["subject_id"], 0.02)]
+
+    Parameters:
+        subject_ids (pd.Series): The subject_id column of a table.
+        fraction (float): The expected fraction of subjects in the sample.
+        seed (int): The sampling seed.
+
+    Returns:
+        mask (pd.Series): A boolean Series with the same index as <subject_ids>.
+    """
+
+    mask = pd.Series(
+        hash_subject_ids(subject_ids.to_numpy(), seed) < fraction,
+        index=subject_ids.index,
+    )
+
+    return mask
+
+
+def sample_dev_cohort_list(
+    source: Union[str, Iterable[pd.DataFrame]],
+    fraction: float,
+    seed: int = 0,
+    chunksize: int = 1_000_000,
+) -> List[int]:
+    """
+    Returns the subject_ids of a table (read in chunks) that belong to the
+    reproducible random development sample (see in_dev_sample()). Only the
+    sampled ids are kept in memory.
+
+    Parameters:
+        source (Union[str, Iterable[pd.DataFrame]]): Either the path to a CSV file
+            or an iterable of DataFrame chunks with a `subject_id` column.
+        fraction (float): The expected fraction of subjects in the sample.
+        seed (int): The sampling seed.
+        chunksize (int): The number of rows per chunk when reading a CSV file.
+
+    Returns:
+        subject_ids (List[int]): The sampled subject_ids, in ascending order.
+    """
+
+    sampled = np.array([], dtype="int64")
+    for chunk_ids in _subject_id_chunks(source, chunksize):
+        chunk_ids = np.unique(chunk_ids)
+        chunk_ids = chunk_ids[hash_subject_ids(chunk_ids, seed) < fraction]
+        sampled = np.union1d(sampled, chunk_ids)
+
+    subject_ids = [int(subject_id) for subject_id in sampled]
+
+    return subject_ids
+
+
+@instrumented
 def join_infections(df_1: pd.DataFrame, df_2: pd.DataFrame):
     """
     Joins the two infection DataFrames on admission events (`subject_id` and `hadm_id`).
@@ -171,7 +409,10 @@ def join_infections(df_1: pd.DataFrame, df_2: pd.DataFrame):
     # ==================== YOUR CODE HERE ====================
     
     joined_df = pd.merge(df_1, df_2, how='outer', on=['subject_id','hadm_id'])
-    joined_df.fillna(0, inplace=True)
+    ## fill the unmatched flags with 0 as uint8 instead of leaving them float64
+    flag_cols = [col for col in joined_df.columns if col not in ['subject_id','hadm_id']]
+    fill_flags(joined_df, flag_cols)
+    joined_df = compact_dtypes(joined_df)
     
     # ==================== YOUR CODE HERE ====================
     
@@ -0,0 +1,190 @@
+"""
+dtype_policy.py
+
+This file contains the dtype policy for the outputs of the cohort-building
+functions, and a helper to report the memory saved by it.
+
+The policy:
+    - id columns (`subject_id`, `hadm_id`, `icustay_id`) are stored as int32
+    - 0/1 indicator flags are stored as uint8 (bool columns stay bool), and
+        are filled with 0 after outer joins instead of being upcast to float64
+    - low-cardinality string columns (`vital_id`, `lab_id`, `icd9_code`,
+        `category`) are stored as categoricals
+
+Columns with missing values are left as they are, so the policy never changes
+which rows are null.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+
+ID_COLUMNS = ["subject_id", "hadm_id", "icustay_id"]
+
+FLAG_COLUMNS = [
+    "has_icd9_infection",
+    "has_note_infection",
+    "has_organ_dysfunction",
+    "criteria_1",
+    "criteria_2",
+    "criteria_3",
+    "criteria_4",
+    "sepsis_status",
+    "severe_sepsis_status",
+    "hypotension",
+    "adequate_fluid",
+    "septic_shock",
+]
+
+CATEGORY_COLUMNS = ["vital_id", "lab_id", "icd9_code", "category"]
+
+_INT32_INFO = np.iinfo(np.int32)
+
+
+def _compact_id(col: pd.Series) -> pd.Series:
+    """
+    Returns <col> as int32 if it is numeric, has no nulls and fits in int32.
+    """
+
+    if not pd.api.types.is_numeric_dtype(col.dtype) or col.dtype == np.int32:
+        return col
+    if col.empty:
+        return col.astype(np.int32)
+    if col.isna().any():
+        return col
+
+    values = col.to_numpy()
+    if values.dtype.kind == "f" and (values != np.round(values)).any():
+        return col
+    if values.min() < _INT32_INFO.min or values.max() > _INT32_INFO.max:
+        return col
+
+    return col.astype(np.int32)
+
+
+def _compact_flag(col: pd.Series) -> pd.Series:
+    """
+    Returns <col> as bool if it is an object column of booleans, or as uint8 if
+    it only contains 0 and 1 (including object columns that mix 0/1 numbers and
+    booleans after fillna(False)).
+    """
+
+    if col.dtype == bool or col.dtype == np.uint8:
+        return col
+    if col.isna().any():
+        return col
+    if col.dtype == object and pd.api.types.infer_dtype(col, skipna=False) == "boolean":
+        return col.astype(bool)
+    if (col.dtype == object or pd.api.types.is_numeric_dtype(col.dtype)) and col.isin([0, 1]).all():
+        return col.astype(np.uint8)
+
+    return col
+
+
+def _compact_category(col: pd.Series) -> pd.Series:
+    """
+    Returns <col> as a categorical if it is a string column.
+    """
+
+    if col.dtype == object or pd.api.types.is_string_dtype(col.dtype):
+        return col.astype("category")
+
+    return col
+
+
+def fill_flags(df: pd.DataFrame, columns: List[str]) -> None:
+    """
+    Fills the missing values of the flag <columns> with 0 and stores them as
+    uint8. This is an inplace operation on <df>, for use after an outer join.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame to modify.
+        columns (List[str]): The 0/1 flag columns.
+    """
+
+    for col in columns:
+        df[col] = df[col].fillna(0).astype(np.uint8)
+
+
+def compact_dtypes(
+    df: pd.DataFrame,
+    id_columns: Optional[List[str]] = None,
+    flag_columns: Optional[List[str]] = None,
+    category_columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Applies the dtype policy (see the top of this file) to <df>. Columns that are
+    not listed, or that do not qualify, are kept as they are. The input
+    DataFrame is not modified.
+
+    EXAMPLE:
+        joined_df = compact_dtypes(joined_df)
+        print(memory_report(original_df, joined_df))
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame to compact.
+        id_columns (List[str]): The id columns. Defaults to ID_COLUMNS.
+        flag_columns (List[str]): The 0/1 flag columns. Defaults to FLAG_COLUMNS.
+        category_columns (List[str]): The string columns to store as
+            categoricals. Defaults to CATEGORY_COLUMNS.
+
+    Returns:
+        compact_df (pd.DataFrame): A shallow copy of <df> with compact dtypes.
+    """
+
+    if id_columns is None:
+        id_columns = ID_COLUMNS
+    if flag_columns is None:
+        flag_columns = FLAG_COLUMNS
+    if category_columns is None:
+        category_columns = CATEGORY_COLUMNS
+
+    compact_df = df.copy(deep=False)
+    for columns, compact in [
+        (id_columns, _compact_id),
+        (flag_columns, _compact_flag),
+        (category_columns, _compact_category),
+    ]:
+        for col in columns:
+            if col in compact_df.columns:
+                compact_df[col] = compact(compact_df[col])
+
+    return compact_df
+
+
+def memory_report(before: pd.DataFrame, after: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    Reports the dtype and memory usage (in bytes, including the contents of
+    object columns) of every column, before and after compaction.
+
+    Parameters:
+        before (pd.DataFrame): The original DataFrame.
+        after (pd.DataFrame): The compacted DataFrame. Defaults to
+            compact_dtypes(<before>).
+
+    Returns:
+        report (pd.DataFrame): One row per column plus a "total" row, with the
+            columns `dtype_before`, `bytes_before`, `dtype_after`, `bytes_after`
+            and `ratio` (bytes before / bytes after).
+    """
+
+    if after is None:
+        after = compact_dtypes(before)
+
+    report = pd.DataFrame(
+        {
+            "dtype_before": before.dtypes.astype(str),
+            "bytes_before": before.memory_usage(index=False, deep=True),
+            "dtype_after": after.dtypes.astype(str),
+            "bytes_after": after.memory_usage(index=False, deep=True),
+        }
+    )
+    report.loc["total"] = [
+        "",
+        report["bytes_before"].sum(),
+        "",
+        report["bytes_after"].sum(),
+    ]
+    report["ratio"] = report["bytes_before"] / report["bytes_after"]
+
+    return report
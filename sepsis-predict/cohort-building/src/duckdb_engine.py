@@ -0,0 +1,328 @@
+"""
+duckdb_engine.py
+
+This file contains an optional DuckDB backend for the relational steps of the
+cohort build: filter_df(), join_infections(), merge_dataframes() and the
+trewscore stages (summarize_sepsis(), summarize_severe_sepsis() and
+summarize_septic_shock()).
+
+The functions have the same names and return the same columns and values as
+the pandas implementations, with rows sorted by the join keys (and charttime).
+Every table argument can be a DataFrame or the path to a CSV or Parquet file,
+which DuckDB scans directly, so full-size inputs never have to be loaded into
+pandas first. The joins run in-process and in parallel (see connect()).
+
+DuckDB is not a hard requirement of the repository; it is imported on first
+use, and has_duckdb() tells whether it is available.
+
+EXAMPLE:
+    from src import duckdb_engine
+    con = duckdb_engine.connect(threads=8)
+    dev_vitals = duckdb_engine.filter_df("vitals_cohort_sirs.parquet",
+        "subject_id", cohort_list, con=con)
+    all_infections = duckdb_engine.join_infections(icd9_infections,
+        note_infections, con=con)
+"""
+
+import importlib
+import numpy as np
+import pandas as pd
+from typing import Any, List, Optional, Union
+from src.dtype_policy import compact_dtypes, fill_flags
+from src.imputation import STAY_COLUMNS
+
+Source = Union[str, pd.DataFrame]
+
+ADMISSION_KEYS = ["subject_id", "hadm_id"]
+TIMELINE_KEYS = STAY_COLUMNS + ["charttime"]
+
+
+def has_duckdb() -> bool:
+    """
+    Returns True if DuckDB can be imported.
+    """
+
+    try:
+        importlib.import_module("duckdb")
+        return True
+    except ImportError:
+        return False
+
+
+def connect(threads: Optional[int] = None):
+    """
+    Opens an in-memory DuckDB connection.
+
+    Parameters:
+        threads (int): The number of threads DuckDB may use. Defaults to DuckDB's
+            own default (the number of CPUs).
+
+    Returns:
+        con (duckdb.DuckDBPyConnection): The connection.
+    """
+
+    try:
+        duckdb = importlib.import_module("duckdb")
+    except ImportError as e:
+        raise ImportError(
+            "The DuckDB backend requires the duckdb package (pip install duckdb)."
+        ) from e
+
+    con = duckdb.connect()
+    if threads is not None:
+        con.execute(f"SET threads = {int(threads)}")
+
+    return con
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column_list(columns: List[str]) -> str:
+    return ", ".join(_quote(col) for col in columns)
+
+
+def _relation(con, source: Source, name: str) -> str:
+    """
+    Returns a SQL table expression for <source>: a registered view for a
+    DataFrame, or a scan of a Parquet or CSV file (charttime is read as text, as
+    with pd.read_csv).
+    """
+
+    if isinstance(source, pd.DataFrame):
+        con.register(name, source)
+        return name
+
+    path = source.replace("'", "''")
+    if source.endswith(".parquet"):
+        return f"read_parquet('{path}')"
+    if "charttime" in pd.read_csv(source, nrows=0).columns:
+        return f"read_csv_auto('{path}', header=true, types={{'charttime': 'VARCHAR'}})"
+
+    return f"read_csv_auto('{path}', header=true)"
+
+
+def _columns(con, relation: str) -> List[str]:
+    return list(con.execute(f"SELECT * FROM {relation} LIMIT 0").df().columns)
+
+
+def _join_query(
+    con,
+    left: str,
+    right: str,
+    keys: List[str],
+    how: str = "FULL OUTER",
+    extra_select: str = "",
+) -> str:
+    """
+    Returns a query that joins the relations <left> (alias l) and <right> (alias
+    r) on <keys> the way pd.merge() does: one copy of each key column (in the
+    order of <left>), then the other columns of <left>, then the other columns
+    of <right>. The query can be used as a relation in another join.
+    """
+
+    left_columns = _columns(con, left)
+    right_columns = _columns(con, right)
+    key_order = [col for col in left_columns if col in keys]
+
+    if how == "LEFT":
+        select = [f"l.{_quote(key)} AS {_quote(key)}" for key in key_order]
+    else:
+        select = [
+            f"COALESCE(l.{_quote(key)}, r.{_quote(key)}) AS {_quote(key)}"
+            for key in key_order
+        ]
+    select += [f"l.{_quote(col)}" for col in left_columns if col not in keys]
+    select += [f"r.{_quote(col)}" for col in right_columns if col not in keys]
+    on = " AND ".join(f"l.{_quote(key)} = r.{_quote(key)}" for key in keys)
+
+    return f"(SELECT {', '.join(select)}{extra_select} FROM {left} l {how} JOIN {right} r ON {on})"
+
+
+def _fetch(con, relation: str, order_by: List[str]) -> pd.DataFrame:
+    return con.execute(f"SELECT * FROM {relation} ORDER BY {_column_list(order_by)}").df()
+
+
+def filter_df(
+    source: Source, filter_col: str, value_list: List[Any], con=None
+) -> pd.DataFrame:
+    """
+    DuckDB version of cohort.filter_df(): the rows of <source> whose <filter_col>
+    value is in <value_list> (a semi-join against the value list).
+
+    As with the pandas version, the rows keep their original order and index:
+    for a DataFrame, only the positions of the matching rows are computed in
+    DuckDB, and a Parquet file is indexed by its row numbers (the index
+    pd.read_parquet() would give). A CSV file is scanned in order, but DuckDB
+    cannot number its rows, so the result has a fresh RangeIndex.
+
+    Parameters:
+        source (Source): A DataFrame or the path to a CSV or Parquet file.
+        filter_col (str): The column to filter on.
+        value_list (List[Any]): The values to keep.
+        con (duckdb.DuckDBPyConnection): The connection. Defaults to a new one.
+
+    Returns:
+        filtered_df (pd.DataFrame): The matching rows, in their original order.
+    """
+
+    con = con if con is not None else connect()
+
+    if isinstance(source, pd.DataFrame):
+        if filter_col not in source.columns:
+            raise ValueError(f"{filter_col} is not in df columns.")
+        keys = pd.DataFrame({"_position": np.arange(len(source)), "_key": source[filter_col].to_numpy()})
+        relation = _relation(con, keys, "_filter_source")
+        filter_col = "_key"
+    else:
+        relation = _relation(con, source, "_filter_source")
+        if filter_col not in _columns(con, relation):
+            raise ValueError(f"{filter_col} is not in df columns.")
+        if source.endswith(".parquet"):
+            relation = relation[:-1] + ", file_row_number=true)"
+
+    value_table = pd.DataFrame({"value": list(value_list)})
+    if len(value_list) == 0:
+        # An empty frame has no type, so no value can match it
+        value_table = value_table.astype(object)
+    con.register("_filter_values", value_table)
+    filtered_df = con.execute(
+        f"SELECT * FROM {relation} "
+        f"WHERE {_quote(filter_col)} IN (SELECT value FROM _filter_values)"
+    ).df()
+
+    if isinstance(source, pd.DataFrame):
+        return source.iloc[np.sort(filtered_df["_position"].to_numpy())]
+    if "file_row_number" in filtered_df.columns:
+        filtered_df = filtered_df.sort_values("file_row_number", kind="stable")
+        filtered_df = filtered_df.set_index("file_row_number").rename_axis(None)
+
+    return filtered_df
+
+
+def join_infections(df_1: Source, df_2: Source, con=None) -> pd.DataFrame:
+    """
+    DuckDB version of cohort.join_infections(): a full outer join on
+    (`subject_id`, `hadm_id`) with the missing flags filled with 0.
+    """
+
+    con = con if con is not None else connect()
+    query = _join_query(
+        con,
+        _relation(con, df_1, "_infections_1"),
+        _relation(con, df_2, "_infections_2"),
+        ADMISSION_KEYS,
+    )
+    joined_df = _fetch(con, query, ADMISSION_KEYS)
+    fill_flags(joined_df, [col for col in joined_df.columns if col not in ADMISSION_KEYS])
+
+    return compact_dtypes(joined_df)
+
+
+def merge_dataframes(dataframe_A: Source, dataframe_B: Source, con=None) -> pd.DataFrame:
+    """
+    DuckDB version of features.merge_dataframes(): a full outer join on all
+    columns the two tables have in common.
+    """
+
+    con = con if con is not None else connect()
+    left = _relation(con, dataframe_A, "_merge_a")
+    right = _relation(con, dataframe_B, "_merge_b")
+    right_columns = _columns(con, right)
+    keys = [col for col in _columns(con, left) if col in right_columns]
+
+    return _fetch(con, _join_query(con, left, right, keys), keys)
+
+
+def summarize_sepsis(dev_sirs: Source, all_infections: Source, con=None) -> pd.DataFrame:
+    """
+    DuckDB version of trewscore.summarize_sepsis(). The outer merge followed by
+    dropping the rows without a charttime is a left join from <dev_sirs>.
+    """
+
+    con = con if con is not None else connect()
+    query = _join_query(
+        con,
+        _relation(con, dev_sirs, "_sepsis_sirs"),
+        _relation(con, all_infections, "_sepsis_infections"),
+        ADMISSION_KEYS,
+        how="LEFT",
+        extra_select=(
+            ", (l.criteria_1::INT + l.criteria_2::INT + l.criteria_3::INT"
+            " + l.criteria_4::INT >= 2)"
+            " AND (COALESCE(r.has_icd9_infection = 1, FALSE)"
+            " OR COALESCE(r.has_note_infection = 1, FALSE)) AS sepsis_status"
+        ),
+    )
+
+    return compact_dtypes(_fetch(con, query, TIMELINE_KEYS))
+
+
+def summarize_severe_sepsis(dev_sepsis: Source, organ_dys: Source, con=None) -> pd.DataFrame:
+    """
+    DuckDB version of trewscore.summarize_severe_sepsis(), as a left join from
+    <dev_sepsis>.
+    """
+
+    con = con if con is not None else connect()
+    query = _join_query(
+        con,
+        _relation(con, dev_sepsis, "_severe_sepsis"),
+        _relation(con, organ_dys, "_severe_organ_dys"),
+        ADMISSION_KEYS,
+        how="LEFT",
+        extra_select=(
+            ", COALESCE(r.has_organ_dysfunction = 1, FALSE) AND l.sepsis_status"
+            " AS severe_sepsis_status"
+        ),
+    )
+
+    return compact_dtypes(_fetch(con, query, TIMELINE_KEYS))
+
+
+def summarize_septic_shock(
+    dev_severe_sepsis: Source,
+    hypotension_labels: Source,
+    fluids_all: Source,
+    con=None,
+) -> pd.DataFrame:
+    """
+    DuckDB version of trewscore.summarize_septic_shock(): full outer joins on the
+    ICU stay and charttime, last-observation-carried-forward per ICU stay with
+    a window function, and the remaining missing values filled with False.
+    """
+
+    con = con if con is not None else connect()
+    merged = _join_query(
+        con,
+        _relation(con, dev_severe_sepsis, "_shock_severe_sepsis"),
+        _relation(con, hypotension_labels, "_shock_hypotension"),
+        TIMELINE_KEYS,
+    )
+    merged = _join_query(
+        con, merged, _relation(con, fluids_all, "_shock_fluids"), TIMELINE_KEYS
+    )
+
+    # Rows with a null stay key are dropped, as in impute_missing()
+    window = (
+        f"OVER (PARTITION BY {_column_list(STAY_COLUMNS)} ORDER BY charttime"
+        " ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)"
+    )
+    fill_columns = [col for col in _columns(con, merged) if col not in TIMELINE_KEYS]
+    select = [_quote(col) for col in TIMELINE_KEYS] + [
+        f"last_value({_quote(col)} IGNORE NULLS) {window} AS {_quote(col)}"
+        for col in fill_columns
+    ]
+    not_null = " AND ".join(f"{_quote(col)} IS NOT NULL" for col in STAY_COLUMNS)
+    filled = f"(SELECT {', '.join(select)} FROM {merged} m WHERE {not_null})"
+    septic_shock_summary = _fetch(con, filled, TIMELINE_KEYS)
+
+    septic_shock_summary.fillna(False, inplace=True)
+    septic_shock_summary["septic_shock"] = (
+        septic_shock_summary["severe_sepsis_status"].astype(bool)
+        & septic_shock_summary["adequate_fluid"].astype(bool)
+        & septic_shock_summary["hypotension"].astype(bool)
+    )
+
+    return compact_dtypes(septic_shock_summary)
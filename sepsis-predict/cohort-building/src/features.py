@@ -12,10 +12,15 @@ IMPORTANT INSTRUCTIONS:
 """
 
 # Imports - Do not modify
+import numpy as np
 import pandas as pd
-from typing import List, Optional
+from typing import Any, Iterable, List, Optional, Union
+from src.imputation import grouped_ffill, STAY_COLUMNS
+from src.dtype_policy import compact_dtypes
+from src.instrumentation import instrumented
 
 
+@instrumented
 def summarize_by_mean(
     df: pd.DataFrame,
     columns_to_group_by: Optional[List[str]] = None,
@@ -85,6 +90,8 @@ def summarize_by_mean(
     
     # ==================== YOUR CODE HERE ====================
 
+
+@instrumented
 def pivot_wide(
     df: pd.DataFrame,
     index_columns: Optional[List[str]] = None,
@@ -148,6 +155,7 @@ def pivot_wide(
     return wide_df
 
 
+@instrumented
 def merge_dataframes(dataframe_A: pd.DataFrame, dataframe_B: pd.DataFrame):
     """
     Merges two dataframes by `subject_id`, `hadm_id`, `icustay_id`, `charttime`.
@@ -192,6 +200,7 @@ def merge_dataframes(dataframe_A: pd.DataFrame, dataframe_B: pd.DataFrame):
     return merged_df
 
 
+@instrumented
 def impute_missing(dataframe: pd.DataFrame):
     """
     Imputes missing values in the input DataFrame using a last-value-carried-forward
@@ -226,13 +235,284 @@ def impute_missing(dataframe: pd.DataFrame):
     imputed_df = None
 
     # ==================== YOUR CODE HERE ====================
-    imputed_df = dataframe.sort_values(['charttime'])
-    
-    imputed_df = imputed_df.groupby(["subject_id","hadm_id","icustay_id"], axis=0, as_index=False).apply(lambda x: x.fillna(method="ffill"))
-    ## https://stackoverflow.com/questions/67347586/pandas-groupby-fill-disappear-the-column 
+    ## sort once by stay and charttime, then forward fill every column per stay segment
+    imputed_df = grouped_ffill(dataframe, ["subject_id","hadm_id","icustay_id"], "charttime")
     return imputed_df
     
     # ==================== YOUR CODE HERE ====================
     
 
-    # Return the imputed DataFrame
\ No newline at end of file
+    # Return the imputed DataFrame
+
+
+def _add_cells(
+    cells: Optional[pd.DataFrame], pending: List[pd.DataFrame], cell_columns: List[str]
+) -> pd.DataFrame:
+    """
+    Returns the sum of the <cells> and <pending> partial sums and counts per cell.
+    """
+
+    parts = pending if cells is None else [cells] + pending
+    if len(parts) == 1:
+        return parts[0]
+
+    return pd.concat(parts).groupby(level=cell_columns, sort=False).sum()
+
+
+def summarize_pivot_chunked(
+    source: Union[str, Iterable[pd.DataFrame]],
+    index_columns: Optional[List[str]] = None,
+    columns: str = "vital_id",
+    values: str = "valuenum",
+    subject_ids: Optional[List[Any]] = None,
+    chunksize: int = 1_000_000,
+) -> pd.DataFrame:
+    """
+    Fused, streaming version of summarize_by_mean() followed by pivot_wide().
+
+    Rows are read in chunks and reduced to a running sum and count per
+    (<index_columns>, <columns>) cell (added up in batches, so each cell is only
+    re-grouped a few times however many chunks there are). The mean of each cell is only computed at
+    the end, when the cells are unstacked straight into the wide frame, so the
+    raw long table is never held in memory.
+
+    EXAMPLE:
+        summarize_pivot_chunked("vitals_cohort_sirs.csv", subject_ids=cohort_list)
+    returns the same frame as
+        pivot_wide(summarize_by_mean(filter_df(vitals, "subject_id", cohort_list),
+            ["subject_id", "hadm_id", "icustay_id", "charttime", "vital_id"]),
+            ["subject_id", "hadm_id", "icustay_id", "charttime"])
+
+    Parameters:
+        source (Union[str, Iterable[pd.DataFrame]]): Either the path to a CSV file
+            (read with pd.read_csv in chunks of <chunksize> rows), or an iterable
+            of DataFrame chunks.
+        index_columns (List[str]): The columns that identify a row of the wide
+            frame. Defaults to `subject_id`, `hadm_id`, `icustay_id`, `charttime`.
+        columns (str): The column whose values become the wide columns.
+        values (str): The column whose values are averaged.
+        subject_ids (List[Any]): If given, only rows of these subjects are kept.
+        chunksize (int): The number of rows per chunk when reading a CSV file.
+
+    Returns:
+        wide_df (pd.DataFrame): A wide DataFrame with the <index_columns> and one
+            column per unique value of <columns>, holding the mean of <values>
+            (NaN where there is no measurement).
+    """
+
+    if index_columns is None:
+        index_columns = ["subject_id", "hadm_id", "icustay_id", "charttime"]
+    cell_columns = list(index_columns) + [columns]
+
+    if isinstance(source, str):
+        source = pd.read_csv(source, usecols=cell_columns + [values], chunksize=chunksize)
+
+    # The partial sums and counts of the chunks are added to the running total
+    # in batches, once they add up to its size, rather than re-grouping the
+    # running total for every chunk
+    cells = None
+    pending = []
+    pending_rows = 0
+    for chunk in source:
+        if subject_ids is not None:
+            chunk = chunk[chunk["subject_id"].isin(subject_ids)]
+        chunk_cells = (
+            chunk.dropna(subset=[values])
+            .groupby(cell_columns, sort=False)[values]
+            .agg(["sum", "count"])
+        )
+        pending.append(chunk_cells)
+        pending_rows += len(chunk_cells)
+
+        if cells is None or pending_rows >= len(cells):
+            cells = _add_cells(cells, pending, cell_columns)
+            pending = []
+            pending_rows = 0
+
+    if pending:
+        cells = _add_cells(cells, pending, cell_columns)
+    if cells is None or cells.empty:
+        return pd.DataFrame(columns=list(index_columns))
+
+    wide_df = (cells["sum"] / cells["count"]).unstack(columns).sort_index()
+    wide_df = wide_df.sort_index(axis=1).reset_index()
+
+    return wide_df
+
+
+# The statistics supported by summarize_by_bucket()
+BUCKET_STATS = ["mean", "min", "max", "count", "last"]
+
+
+def summarize_by_bucket(
+    df: pd.DataFrame,
+    bucket: Union[str, pd.Timedelta] = "1h",
+    stats: Optional[List[str]] = None,
+    index_columns: Optional[List[str]] = None,
+    time_column: str = "charttime",
+    columns: str = "vital_id",
+    values: str = "valuenum",
+    primary_stat: Optional[str] = "mean",
+) -> pd.DataFrame:
+    """
+    Time-bucketed, multi-statistic version of summarize_by_mean() followed by
+    pivot_wide().
+
+    The <time_column> is floored to fixed windows of length <bucket>, and every
+    statistic in <stats> is computed for each (<index_columns>, bucket,
+    <columns>) cell in one grouped pass, then unstacked into a wide frame. The
+    columns of <primary_stat> keep the plain measurement name (e.g. `HeartRate`),
+    so the output can be passed to impute_missing() and summarize_sirs() as is;
+    the other statistics are named `<measurement>_<stat>` (e.g. `HeartRate_max`).
+
+    EXAMPLE:
+        hourly_vitals = summarize_by_bucket(vitals, "1h", columns="vital_id")
+    has one row per ICU stay and hour, with the columns `HeartRate`,
+    `HeartRate_min`, `HeartRate_max`, `HeartRate_count`, `HeartRate_last`, ...
+
+    Parameters:
+        df (pd.DataFrame): The long DataFrame (one row per measurement).
+        bucket (Union[str, pd.Timedelta]): The length of the time windows.
+        stats (List[str]): The statistics to compute, from BUCKET_STATS.
+            Defaults to all of them. `last` is the value with the latest
+            <time_column> in the bucket.
+        index_columns (List[str]): The columns that identify a stay. Defaults to
+            `subject_id`, `hadm_id`, `icustay_id`.
+        time_column (str): The chart time column. In the output it holds the start
+            of each bucket, in the same format as the input (strings stay
+            strings).
+        columns (str): The column whose values become the wide columns.
+        values (str): The column whose values are summarized.
+        primary_stat (str): The statistic whose columns keep the plain
+            measurement name. If None, every column gets a `_<stat>` suffix.
+
+    Returns:
+        wide_df (pd.DataFrame): A wide DataFrame sorted by stay and bucket, with
+            the <index_columns>, <time_column> and one column per measurement and
+            statistic (NaN where there is no measurement, 0 for `count`).
+    """
+
+    if stats is None:
+        stats = BUCKET_STATS
+    unknown_stats = [stat for stat in stats if stat not in BUCKET_STATS]
+    if unknown_stats:
+        raise ValueError(f"{unknown_stats} are not supported, use {BUCKET_STATS}.")
+    if primary_stat is not None and primary_stat not in stats:
+        raise ValueError(f'primary_stat "{primary_stat}" is not in {stats}.')
+    if values not in df.columns:
+        raise ValueError(f"{values} is not in df columns.")
+    if index_columns is None:
+        index_columns = STAY_COLUMNS
+
+    times = pd.to_datetime(df[time_column])
+    long_df = df[list(index_columns) + [columns, values]].copy()
+    long_df[time_column] = times.dt.floor(pd.Timedelta(bucket))
+    # By position, as the index of <df> may have duplicate labels
+    has_value = long_df[values].notna().to_numpy()
+    long_df = long_df[has_value]
+    if "last" in stats:
+        # Stable time order, so that last() is the latest value of each bucket
+        long_df = long_df.iloc[np.argsort(times.to_numpy()[has_value], kind="stable")]
+
+    cell_columns = list(index_columns) + [time_column, columns]
+    cells = long_df.groupby(cell_columns, sort=False)[values].agg(stats)
+    wide_df = cells.unstack(columns).sort_index()
+
+    # One block of statistics per measurement
+    measurements = sorted(wide_df.columns.get_level_values(1).unique())
+    wide_df = wide_df.reindex(
+        columns=[(stat, measurement) for measurement in measurements for stat in stats]
+    )
+    wide_df.columns = [
+        measurement if stat == primary_stat else f"{measurement}_{stat}"
+        for stat, measurement in wide_df.columns
+    ]
+    if "count" in stats:
+        count_columns = [
+            measurement if primary_stat == "count" else f"{measurement}_count"
+            for measurement in measurements
+        ]
+        wide_df[count_columns] = wide_df[count_columns].fillna(0).astype(np.int32)
+
+    wide_df = wide_df.reset_index()
+    if not pd.api.types.is_datetime64_any_dtype(df[time_column].dtype):
+        wide_df[time_column] = wide_df[time_column].dt.strftime("%Y-%m-%d %H:%M:%S")
+
+    return compact_dtypes(wide_df)
+
+
+def align_labs_asof(
+    vitals_wide: pd.DataFrame,
+    labs_wide: pd.DataFrame,
+    tolerance: Optional[Union[str, pd.Timedelta]] = None,
+    lab_columns: Optional[List[str]] = None,
+    impute_vitals: bool = True,
+) -> pd.DataFrame:
+    """
+    Attaches to each vitals row the most recent value of each lab of the same ICU
+    stay at or before its charttime (within <tolerance>), with a sorted as-of
+    join per stay.
+
+    This replaces merge_dataframes() followed by impute_missing() for the SIRS
+    inputs: the labs are charted far less often than the vitals, so the outer
+    merge adds a mostly empty row for every lab charttime and then fills it.
+    Here the output has exactly one row per vitals row, and only the vitals are
+    forward filled.
+
+    EXAMPLE:
+        sirs_input = align_labs_asof(vitals_wide, labs_wide, tolerance="24h")
+        dev_sirs = summarize_sirs(sirs_input)
+
+    Parameters:
+        vitals_wide (pd.DataFrame): The wide vitals (see pivot_wide()), with the
+            `subject_id`, `hadm_id`, `icustay_id`, `charttime` columns.
+        labs_wide (pd.DataFrame): The wide labs, with the same key columns.
+        tolerance (Union[str, pd.Timedelta]): Optional maximum age of an attached
+            lab value. Older values are left as NaN.
+        lab_columns (List[str]): The lab columns to attach. Defaults to all
+            non-key columns of <labs_wide>.
+        impute_vitals (bool): Whether to forward fill the vitals per ICU stay
+            (see impute_missing()) before attaching the labs.
+
+    Returns:
+        aligned_df (pd.DataFrame): The vitals with the lab columns added, sorted
+            by ICU stay and charttime. Rows with a null key are dropped.
+    """
+
+    key_columns = STAY_COLUMNS + ["charttime"]
+    if lab_columns is None:
+        lab_columns = [col for col in labs_wide.columns if col not in key_columns]
+    max_age = None
+    if tolerance is not None:
+        max_age = {col: tolerance for col in lab_columns}
+
+    # Both branches return the vitals sorted by stay and charttime
+    if impute_vitals:
+        vitals = impute_missing(vitals_wide)
+    else:
+        vitals = vitals_wide.sort_values(key_columns, kind="mergesort")
+    vitals = vitals.dropna(subset=key_columns).reset_index(drop=True)
+
+    def prepare_keys(df: pd.DataFrame) -> pd.DataFrame:
+        df = df.dropna(subset=key_columns).astype({col: "int64" for col in STAY_COLUMNS})
+        df["charttime"] = pd.to_datetime(df["charttime"])
+        return df
+
+    # Stack the lab rows and the vitals keys (labs first, so that a lab charted
+    # at the same time as a vitals row is attached to it), forward fill the labs
+    # per stay and keep the vitals rows
+    labs = prepare_keys(labs_wide[key_columns + lab_columns])
+    labs["_vitals_row"] = -1
+    vitals_keys = prepare_keys(vitals[key_columns])
+    vitals_keys["_vitals_row"] = np.arange(len(vitals_keys))
+    stacked = pd.concat([labs, vitals_keys], ignore_index=True)
+
+    filled = grouped_ffill(stacked, STAY_COLUMNS, "charttime", max_age)
+    filled = filled[filled["_vitals_row"].to_numpy() >= 0]
+    order = np.argsort(filled["_vitals_row"].to_numpy())
+
+    aligned_df = vitals.copy()
+    for col in lab_columns:
+        aligned_df[col] = filled[col].to_numpy()[order]
+
+    return compact_dtypes(aligned_df)
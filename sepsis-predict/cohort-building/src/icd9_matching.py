@@ -0,0 +1,118 @@
+"""
+icd9_matching.py
+
+This file contains helper functions for matching ICD-9 codes against lists of
+code prefixes.
+
+Prefix lists are compiled once into an index keyed by prefix length, so that
+checking a code only takes one set lookup per distinct prefix length instead of
+one `startswith` comparison per prefix. Matching is done once per unique code
+(using a categorical representation of the codes) and the result is mapped back
+onto the rows.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, FrozenSet, Iterable
+
+
+def compile_prefixes(icd9_prefixes: Iterable[str]) -> Dict[int, FrozenSet[str]]:
+    """
+    Compiles a list of ICD-9 code prefixes into a prefix index that maps each
+    prefix length to the set of prefixes of that length.
+
+    EXAMPLE: ["001", "002", "5695"] is compiled to
+        {3: frozenset({"001", "002"}), 4: frozenset({"5695"})}
+
+    Parameters:
+        icd9_prefixes (Iterable[str]): The ICD-9 code prefixes to compile.
+
+    Returns:
+        compiled_prefixes (Dict[int, FrozenSet[str]]): A dictionary that maps a
+            prefix length to the set of prefixes with that length.
+    """
+
+    by_length = {}
+    for prefix in icd9_prefixes:
+        prefix = str(prefix).strip()
+        if prefix:
+            by_length.setdefault(len(prefix), set()).add(prefix)
+
+    compiled_prefixes = {
+        length: frozenset(prefixes) for length, prefixes in sorted(by_length.items())
+    }
+
+    return compiled_prefixes
+
+
+def match_unique_codes(
+    unique_codes: pd.Index, compiled_prefixes: Dict[int, FrozenSet[str]]
+) -> np.ndarray:
+    """
+    Returns a boolean array that is True for every code in <unique_codes> that
+    starts with any of the prefixes in <compiled_prefixes>.
+
+    Parameters:
+        unique_codes (pd.Index): The distinct ICD-9 codes to check.
+        compiled_prefixes (Dict[int, FrozenSet[str]]): A prefix index created
+            by compile_prefixes().
+
+    Returns:
+        matched (np.ndarray): A boolean array aligned with <unique_codes>.
+    """
+
+    codes = pd.Series(unique_codes.astype(str), dtype=object)
+    matched = np.zeros(len(codes), dtype=bool)
+
+    for length, prefixes in compiled_prefixes.items():
+        # Codes shorter than <length> keep their full value, which can never be
+        # equal to a prefix of <length> characters.
+        matched |= codes.str[:length].isin(prefixes).to_numpy()
+
+    return matched
+
+
+def as_categorical(icd9_codes: pd.Series) -> pd.Categorical:
+    """
+    Returns <icd9_codes> as a pd.Categorical (the column's own array if it is
+    already categorical), so that per-code work can run once per category and be
+    gathered back onto the rows with the categorical codes (-1 for null codes).
+    """
+
+    if isinstance(icd9_codes.dtype, pd.CategoricalDtype):
+        return icd9_codes.array
+
+    return pd.Categorical(icd9_codes)
+
+
+def match_prefixes(
+    icd9_codes: pd.Series, compiled_prefixes: Dict[int, FrozenSet[str]]
+) -> pd.Series:
+    """
+    Returns a boolean Series that is True for every row of <icd9_codes> whose
+    code starts with any of the prefixes in <compiled_prefixes>. Null codes are
+    never considered a match.
+
+    The codes are converted to a categorical (if they are not one already) so
+    that the prefix check runs once per unique code, and the per-code result is
+    gathered back onto the rows using the categorical codes.
+
+    Parameters:
+        icd9_codes (pd.Series): The ICD-9 codes to check.
+        compiled_prefixes (Dict[int, FrozenSet[str]]): A prefix index created
+            by compile_prefixes().
+
+    Returns:
+        matches (pd.Series): A boolean Series with the same index as <icd9_codes>.
+    """
+
+    categorical = as_categorical(icd9_codes)
+    matched = match_unique_codes(categorical.categories, compiled_prefixes)
+
+    # Null codes have a categorical code of -1, which picks up the trailing False
+    lookup = np.append(matched, False)
+    matches = pd.Series(
+        lookup[categorical.codes], index=icd9_codes.index, name=icd9_codes.name
+    )
+
+    return matches
@@ -0,0 +1,161 @@
+"""
+imputation.py
+
+This file contains a vectorized grouped last-value-carried-forward imputation.
+
+Instead of calling `fillna(method="ffill")` once per group through
+`groupby(...).apply(...)`, the table is sorted once by the group columns and the
+time column, and every column is filled with NumPy operations over the group
+segments of the sorted table:
+    - the position of the last non-null value at or before each row is found
+        with a running maximum (np.maximum.accumulate)
+    - a value is only carried forward if that position is inside the row's own
+        group (and, optionally, if it is not older than a maximum age)
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Union
+
+STAY_COLUMNS = ["subject_id", "hadm_id", "icustay_id"]
+
+
+def segment_start_positions(sorted_df: pd.DataFrame, group_columns: List[str]) -> np.ndarray:
+    """
+    For a DataFrame sorted by <group_columns>, returns the position of the first
+    row of each row's group segment.
+
+    EXAMPLE: For group values [a, a, b, b, b, c], returns [0, 0, 2, 2, 2, 5].
+
+    Parameters:
+        sorted_df (pd.DataFrame): A DataFrame sorted by <group_columns>.
+        group_columns (List[str]): The columns that identify a group.
+
+    Returns:
+        segment_start (np.ndarray): An integer array with one position per row.
+    """
+
+    n_rows = len(sorted_df)
+    positions = np.arange(n_rows)
+
+    is_start = np.zeros(n_rows, dtype=bool)
+    if n_rows:
+        is_start[0] = True
+    for col in group_columns:
+        values = sorted_df[col].to_numpy()
+        is_start[1:] |= values[1:] != values[:-1]
+
+    segment_start = np.maximum.accumulate(np.where(is_start, positions, 0))
+
+    return segment_start
+
+
+def is_sortable_array(col: pd.Series) -> bool:
+    """
+    Returns whether <col> can be passed to np.lexsort as it is.
+    """
+
+    return pd.api.types.is_numeric_dtype(col.dtype) or pd.api.types.is_datetime64_any_dtype(col.dtype)
+
+
+def sort_key(col: pd.Series) -> np.ndarray:
+    """
+    Returns a NumPy array that sorts like <col> does with sort_values() (missing
+    values last). Numeric and datetime columns are used as they are; other
+    columns are replaced by the rank of their value, so that each distinct value
+    is only compared once.
+    """
+
+    if isinstance(col.dtype, pd.api.extensions.ExtensionDtype) and is_sortable_array(col):
+        # Nullable ints (e.g. Int32 ids from loaders.py), as floats with NaN last
+        return col.to_numpy(dtype=np.float64, na_value=np.nan)
+    if is_sortable_array(col):
+        return col.to_numpy()
+
+    codes, uniques = pd.factorize(col, sort=True)
+    codes[codes < 0] = len(uniques)
+
+    return codes
+
+
+def grouped_ffill(
+    df: pd.DataFrame,
+    group_columns: Optional[List[str]] = None,
+    time_column: str = "charttime",
+    max_age: Optional[Dict[str, Union[str, pd.Timedelta]]] = None,
+) -> pd.DataFrame:
+    """
+    Returns a copy of <df> sorted by <group_columns> and <time_column> in which
+    the missing values of every other column are filled with the last non-null
+    value of the same group (last-value-carried-forward).
+
+    Rows with a null value in any of the <group_columns> are dropped, the same as
+    `groupby(...).apply(lambda x: x.fillna(method="ffill"))`. Unlike that call,
+    which returns a (group number, original index) MultiIndex, the original
+    single-level index is kept.
+
+    EXAMPLE: With max_age={"WBC": "24h"}, a WBC value is only carried forward to
+    rows that are charted at most 24 hours after it. Rows further away keep their
+    missing value. Columns that are not in <max_age> are carried forward without
+    a limit.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame to be imputed.
+        group_columns (List[str]): The columns that identify a group. Defaults to
+            `subject_id`, `hadm_id`, `icustay_id`.
+        time_column (str): The column to sort by within each group.
+        max_age (Dict[str, Union[str, pd.Timedelta]]): Optional maximum
+            carry-forward age per column.
+
+    Returns:
+        imputed_df (pd.DataFrame): The sorted and imputed DataFrame.
+    """
+
+    if group_columns is None:
+        group_columns = STAY_COLUMNS
+    if max_age is None:
+        max_age = {}
+
+    missing_columns = [
+        col for col in list(group_columns) + [time_column] + list(max_age)
+        if col not in df.columns
+    ]
+    if missing_columns:
+        raise ValueError(f"{missing_columns} are not in df columns.")
+
+    imputed_df = df.dropna(subset=group_columns)
+    # A string time column (e.g. MIMIC `charttime`) is parsed once: its ISO
+    # format sorts the same as the datetimes, and parsing is much cheaper than
+    # sorting the strings
+    times = imputed_df[time_column]
+    if max_age or not is_sortable_array(times):
+        times = pd.to_datetime(times)
+    times = times.to_numpy()
+
+    # np.lexsort is stable, the same order as a mergesort sort_values()
+    keys = [sort_key(imputed_df[col]) for col in group_columns]
+    order = np.lexsort([times] + keys[::-1])
+    imputed_df = imputed_df.iloc[order]
+    times = times[order]
+
+    positions = np.arange(len(imputed_df))
+    segment_start = segment_start_positions(imputed_df, group_columns)
+
+    fill_columns = [col for col in imputed_df.columns if col not in group_columns]
+    for col in fill_columns:
+        column = imputed_df[col]
+        is_valid = column.notna().to_numpy()
+        if is_valid.all():
+            continue
+
+        last_valid = np.maximum.accumulate(np.where(is_valid, positions, -1))
+        can_fill = last_valid >= segment_start
+
+        if col in max_age:
+            age = times - times[np.maximum(last_valid, 0)]
+            can_fill &= age <= pd.Timedelta(max_age[col]).to_timedelta64()
+
+        source = np.where(can_fill, last_valid, -1)
+        imputed_df[col] = column.array.take(source, allow_fill=True)
+
+    return imputed_df
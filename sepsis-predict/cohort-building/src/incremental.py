@@ -0,0 +1,418 @@
+"""
+incremental.py
+
+This file contains helper functions for incrementally updating the sepsis
+staging when new chart rows arrive.
+
+The full chain (summarize_by_mean -> pivot_wide -> merge_dataframes ->
+impute_missing -> summarize_sirs -> sepsis staging) only depends on the rows of
+one admission at a time. When a delta of new rows arrives, only the admissions
+(`hadm_id`) it touches are recomputed, from all of their input rows, and their
+rows in the state table are replaced.
+
+Both the inputs and the state are partitioned into buckets of admissions
+(`hadm_id` modulo the number of buckets), so that the cost of an update depends
+on the size of the delta and of the buckets it touches, not on the size of the
+cohort:
+    - The input store maps a table name (see INPUT_TABLES) to its buckets, each
+        a list of segments sorted by `hadm_id`. A delta is added as a new
+        segment of the buckets it touches, a bucket with too many segments is
+        compacted on its own, and the rows of an admission are gathered from the
+        segments of its bucket with a binary search.
+    - The state keeps one partition per bucket, sorted by `hadm_id`, so the rows
+        of a recomputed admission are found with a binary search and only the
+        touched partitions are rebuilt. save_state() persists the state as a
+        Parquet dataset with one file per bucket (`hadm_bucket=<bucket>`) and
+        only rewrites the partitions that changed since the last save.
+"""
+
+import glob
+import os
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+from src.cohort import range_positions
+from src.features import summarize_pivot_chunked, merge_dataframes, impute_missing
+from src.sirs import summarize_sirs
+from src.staging import summarize_sepsis_stages, CRITERIA_COLUMNS, TIMELINE_COLUMNS
+
+InputStore = Dict[str, Dict[int, List[pd.DataFrame]]]
+
+# The state: its partitions by bucket, the buckets changed since the last save
+# and the path of the last save (see save_state())
+SepsisState = Dict[str, Any]
+
+# The input tables of the staging chain. Vitals and labs are in long format
+# (one row per measurement), the other tables as loaded in the A3 notebook.
+INPUT_TABLES = [
+    "vitals",
+    "labs",
+    "all_infections",
+    "organ_dys",
+    "hypotension_labels",
+    "fluids_all",
+]
+
+SIRS_INPUT_COLUMNS = ["TempC", "HeartRate", "RespRate", "PaCO2", "WBC", "BANDS"]
+
+# Compact a bucket's segments into one once it has more than this many segments
+MAX_SEGMENTS = 16
+
+# The number of admission buckets (partitions) of the inputs and the state
+N_BUCKETS = 64
+
+# The bucket of rows without a `hadm_id`, which are never recomputed
+_NO_ADMISSION_BUCKET = -1
+
+
+def _sort_by_admission(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns <df> sorted by `hadm_id`, with a fresh index.
+    """
+
+    return df.sort_values("hadm_id", kind="mergesort").reset_index(drop=True)
+
+
+def _admission_buckets(hadm_ids: np.ndarray) -> np.ndarray:
+    """
+    Returns the bucket of each `hadm_id` (_NO_ADMISSION_BUCKET if missing).
+    """
+
+    hadm_ids = pd.to_numeric(pd.Series(hadm_ids)).to_numpy(dtype=np.float64)
+    missing = np.isnan(hadm_ids)
+    buckets = np.full(len(hadm_ids), _NO_ADMISSION_BUCKET, dtype=np.int64)
+    buckets[~missing] = hadm_ids[~missing].astype(np.int64) % N_BUCKETS
+
+    return buckets
+
+
+def _split_by_bucket(df: pd.DataFrame) -> Dict[int, pd.DataFrame]:
+    """
+    Splits <df> into its admission buckets, each sorted by `hadm_id`.
+    """
+
+    df = _sort_by_admission(df)
+    buckets = _admission_buckets(df["hadm_id"].to_numpy())
+
+    return {
+        int(bucket): part.reset_index(drop=True)
+        for bucket, part in df.groupby(buckets, sort=True)
+    }
+
+
+def _gather_rows(df: pd.DataFrame, hadm_ids: np.ndarray) -> np.ndarray:
+    """
+    Returns the positions of the rows of the given admissions in <df>, which is
+    sorted by `hadm_id`.
+    """
+
+    df_ids = df["hadm_id"].to_numpy()
+    starts = np.searchsorted(df_ids, hadm_ids, side="left")
+    ends = np.searchsorted(df_ids, hadm_ids, side="right")
+
+    return range_positions(starts, ends - starts)
+
+
+def create_input_store(tables: Dict[str, pd.DataFrame]) -> InputStore:
+    """
+    Creates an input store from the full input tables.
+
+    Parameters:
+        tables (Dict[str, pd.DataFrame]): A mapping from each name in
+            INPUT_TABLES to its table.
+
+    Returns:
+        store (InputStore): The input store.
+    """
+
+    missing_tables = [name for name in INPUT_TABLES if name not in tables]
+    if missing_tables:
+        raise ValueError(f"{missing_tables} are missing from the input tables.")
+
+    store = {}
+    for name in INPUT_TABLES:
+        store[name] = {
+            bucket: [part] for bucket, part in _split_by_bucket(tables[name]).items()
+        }
+        # The bucket of rows without an admission always exists, to keep the
+        # columns of empty tables
+        store[name].setdefault(_NO_ADMISSION_BUCKET, [tables[name].iloc[:0]])
+
+    return store
+
+
+def add_delta(store: InputStore, deltas: Dict[str, pd.DataFrame]) -> None:
+    """
+    Adds new rows to the input store as new segments of the buckets they touch.
+    This is an inplace operation on <store>. Buckets with too many segments are
+    compacted, which only sorts the rows of that bucket.
+
+    Parameters:
+        store (InputStore): The input store.
+        deltas (Dict[str, pd.DataFrame]): A mapping from a table name to its new
+            rows. Tables that did not change can be omitted.
+    """
+
+    for name, delta in deltas.items():
+        if name not in store:
+            raise ValueError(f"{name} is not an input table.")
+        if delta.empty:
+            continue
+        for bucket, part in _split_by_bucket(delta).items():
+            segments = store[name].setdefault(bucket, [])
+            segments.append(part)
+            if len(segments) > MAX_SEGMENTS:
+                store[name][bucket] = [_sort_by_admission(pd.concat(segments))]
+
+
+def gather_admissions(store: InputStore, name: str, hadm_ids: np.ndarray) -> pd.DataFrame:
+    """
+    Returns all rows of table <name> for the given admissions, from the segments
+    of their buckets only.
+
+    Parameters:
+        store (InputStore): The input store.
+        name (str): The table name.
+        hadm_ids (np.ndarray): The sorted, unique `hadm_id` values to gather.
+
+    Returns:
+        rows (pd.DataFrame): The rows of those admissions.
+    """
+
+    buckets = _admission_buckets(hadm_ids)
+
+    parts = []
+    for bucket in np.unique(buckets):
+        bucket_ids = hadm_ids[buckets == bucket]
+        for segment in store[name].get(int(bucket), []):
+            parts.append(segment.iloc[_gather_rows(segment, bucket_ids)])
+
+    if not parts:
+        return store[name][_NO_ADMISSION_BUCKET][0].iloc[:0]
+
+    rows = pd.concat(parts, ignore_index=True)
+
+    return rows
+
+
+def touched_admissions(deltas: Dict[str, pd.DataFrame]) -> np.ndarray:
+    """
+    Returns the sorted, unique `hadm_id` values that appear in any of the deltas.
+
+    Parameters:
+        deltas (Dict[str, pd.DataFrame]): A mapping from a table name to its new
+            rows.
+
+    Returns:
+        hadm_ids (np.ndarray): The touched admissions.
+    """
+
+    ids = [delta["hadm_id"].dropna().to_numpy() for delta in deltas.values()]
+    if not ids:
+        return np.array([], dtype="int64")
+
+    hadm_ids = np.unique(np.concatenate(ids).astype("int64"))
+
+    return hadm_ids
+
+
+def compute_stages(tables: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Runs the full staging chain on the given input tables: the mean of the vitals
+    and labs per charttime, pivoted wide and merged, forward filled per ICU stay,
+    SIRS criteria and the TREWScore sepsis stages (see staging.py).
+
+    Parameters:
+        tables (Dict[str, pd.DataFrame]): A mapping from each name in
+            INPUT_TABLES to its rows.
+
+    Returns:
+        stages (pd.DataFrame): The output of summarize_sepsis_stages().
+    """
+
+    wide_frames = [
+        summarize_pivot_chunked([tables["labs"]], columns="lab_id"),
+        summarize_pivot_chunked([tables["vitals"]], columns="vital_id"),
+    ]
+    wide_frames = [frame for frame in wide_frames if not frame.empty]
+
+    if not wide_frames:
+        dev_sirs = pd.DataFrame(columns=TIMELINE_COLUMNS + CRITERIA_COLUMNS)
+    else:
+        merged = wide_frames[0]
+        if len(wide_frames) == 2:
+            merged = merge_dataframes(wide_frames[0], wide_frames[1])
+        for col in SIRS_INPUT_COLUMNS:
+            if col not in merged.columns:
+                merged[col] = np.nan
+        dev_sirs = summarize_sirs(impute_missing(merged))
+
+    stages = summarize_sepsis_stages(
+        dev_sirs,
+        tables["all_infections"],
+        tables["organ_dys"],
+        tables["hypotension_labels"],
+        tables["fluids_all"],
+    )
+
+    return stages
+
+
+def create_state(stages: pd.DataFrame) -> SepsisState:
+    """
+    Creates a state from the stages of all admissions (the output of
+    compute_stages()). All of its partitions are unsaved.
+    """
+
+    partitions = _split_by_bucket(stages)
+
+    return {"partitions": partitions, "dirty": set(partitions), "path": None}
+
+
+def state_frame(state: SepsisState) -> pd.DataFrame:
+    """
+    Returns the state as one table (the partitions in bucket order, each sorted
+    by `hadm_id`).
+    """
+
+    partitions = [state["partitions"][bucket] for bucket in sorted(state["partitions"])]
+    if not partitions:
+        return pd.DataFrame()
+
+    return pd.concat(partitions, ignore_index=True)
+
+
+def replace_admissions(
+    state: SepsisState, hadm_ids: np.ndarray, recomputed: pd.DataFrame
+) -> None:
+    """
+    Replaces the rows of the given admissions in the state by their recomputed
+    rows. This is an inplace operation on <state>. Only the partitions of the
+    touched buckets are rebuilt; the rows to drop are found with a binary search
+    in the sorted partitions.
+
+    Parameters:
+        state (SepsisState): The state.
+        hadm_ids (np.ndarray): The sorted, unique recomputed `hadm_id` values.
+        recomputed (pd.DataFrame): The recomputed rows of those admissions.
+    """
+
+    buckets = _admission_buckets(hadm_ids)
+    recomputed_parts = _split_by_bucket(recomputed) if not recomputed.empty else {}
+
+    for bucket in np.unique(buckets).tolist():
+        parts = []
+        partition = state["partitions"].get(bucket)
+        if partition is not None:
+            keep = np.ones(len(partition), dtype=bool)
+            keep[_gather_rows(partition, hadm_ids[buckets == bucket])] = False
+            parts.append(partition[keep])
+        if bucket in recomputed_parts:
+            parts.append(recomputed_parts[bucket])
+
+        if parts:
+            state["partitions"][bucket] = _sort_by_admission(pd.concat(parts))
+        state["dirty"].add(bucket)
+
+
+def update_sepsis_state(
+    state: Optional[SepsisState],
+    store: InputStore,
+    deltas: Dict[str, pd.DataFrame],
+) -> SepsisState:
+    """
+    Adds <deltas> to the input store and recomputes the sepsis stages of only the
+    admissions they touch. The rows of those admissions in <state> are replaced by
+    the recomputed rows; all other rows (and partitions) are kept as they are.
+
+    EXAMPLE:
+        store = create_input_store({"vitals": vitals, "labs": labs, ...})
+        state = update_sepsis_state(None, store, {})   # initial full build
+        save_state(state, "sepsis_state")
+        state = update_sepsis_state(state, store, {"vitals": new_vitals})
+        save_state(state, "sepsis_state")              # touched buckets only
+        stages = state_frame(state)
+
+    Parameters:
+        state (SepsisState): The current state (the output of a previous call or
+            of load_state()), updated inplace. If None, the stages of every
+            admission in the store are computed.
+        store (InputStore): The input store (updated inplace).
+        deltas (Dict[str, pd.DataFrame]): A mapping from a table name to its new
+            rows.
+
+    Returns:
+        state (SepsisState): The updated state.
+    """
+
+    add_delta(store, deltas)
+
+    if state is None:
+        tables = {
+            name: pd.concat(
+                [segment for segments in buckets.values() for segment in segments],
+                ignore_index=True,
+            )
+            for name, buckets in store.items()
+        }
+        return create_state(compute_stages(tables))
+
+    hadm_ids = touched_admissions(deltas)
+    if len(hadm_ids) == 0:
+        return state
+
+    tables = {name: gather_admissions(store, name, hadm_ids) for name in INPUT_TABLES}
+    replace_admissions(state, hadm_ids, compute_stages(tables))
+
+    return state
+
+
+def _partition_path(path: str, bucket: int) -> str:
+    return os.path.join(path, f"hadm_bucket={bucket}", "part-0.parquet")
+
+
+def save_state(state: SepsisState, path: str) -> None:
+    """
+    Persists the state as a Parquet dataset partitioned by admission bucket (one
+    directory `hadm_bucket=<bucket>` per bucket). Only the partitions that
+    changed since the state was last saved to (or loaded from) <path> are
+    written.
+
+    Parameters:
+        state (SepsisState): The state.
+        path (str): The directory of the dataset.
+    """
+
+    buckets = state["dirty"] if state["path"] == path else set(state["partitions"])
+
+    for bucket in buckets:
+        partition_path = _partition_path(path, bucket)
+        partition = state["partitions"].get(bucket)
+        if partition is None or partition.empty:
+            if os.path.exists(partition_path):
+                os.remove(partition_path)
+            continue
+        os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+        partition.to_parquet(partition_path, index=False)
+
+    state["dirty"] = set()
+    state["path"] = path
+
+
+def load_state(path: str) -> SepsisState:
+    """
+    Loads a state persisted with save_state().
+
+    Parameters:
+        path (str): The directory of the dataset.
+
+    Returns:
+        state (SepsisState): The state.
+    """
+
+    partitions = {}
+    for partition_path in glob.glob(_partition_path(path, "*")):
+        bucket = int(os.path.basename(os.path.dirname(partition_path)).split("=")[1])
+        partitions[bucket] = pd.read_parquet(partition_path)
+
+    return {"partitions": partitions, "dirty": set(), "path": path}
@@ -0,0 +1,215 @@
+"""
+instrumentation.py
+
+This file contains an opt-in instrumentation layer for the cohort build.
+
+The main stages of the pipeline (filter_df, summarize_icd9, summarize_notes,
+join_infections, summarize_sirs and the trewscore stages) are decorated with
+@instrumented. The decorator does nothing unless a StageRecorder is active, in
+which case every call records:
+    - the wall time and CPU time
+    - the rows in (all DataFrame arguments) and rows out
+    - the distinct `subject_id` and `hadm_id` values in the output
+    - the peak memory allocated during the call, above the memory in use at the
+        start of the call (with tracemalloc)
+
+EXAMPLE:
+    with StageRecorder() as recorder:
+        ... run the A3 notebook cells ...
+    print(recorder.format_summary())
+    recorder.save("cohort_run.json")
+"""
+
+import functools
+import json
+import time
+import tracemalloc
+import pandas as pd
+from typing import Any, Callable, Dict, List, Optional
+
+# The active recorder, if any (see StageRecorder)
+_ACTIVE_RECORDER: Optional["StageRecorder"] = None
+
+
+def _count_rows(values: List[Any]) -> int:
+    return sum(len(value) for value in values if isinstance(value, pd.DataFrame))
+
+
+def _count_distinct(result: Any, col: str) -> Optional[int]:
+    if isinstance(result, pd.DataFrame) and col in result.columns:
+        return int(result[col].nunique())
+    return None
+
+
+class StageRecorder:
+    """
+    Records the calls of @instrumented functions while it is active (as a
+    context manager, or between start() and stop()).
+
+    Attributes:
+        records (List[Dict[str, Any]]): One record per call, in call order.
+        trace_memory (bool): Whether to measure the peak memory with tracemalloc
+            (which slows down allocation-heavy code).
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self.records: List[Dict[str, Any]] = []
+        self.trace_memory = trace_memory
+        self._depth = 0
+        self._started_tracing = False
+
+    def start(self) -> "StageRecorder":
+        global _ACTIVE_RECORDER
+        if _ACTIVE_RECORDER is not None:
+            raise RuntimeError("Another StageRecorder is already active.")
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        _ACTIVE_RECORDER = self
+        return self
+
+    def stop(self) -> None:
+        global _ACTIVE_RECORDER
+        _ACTIVE_RECORDER = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self) -> "StageRecorder":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def call(self, stage: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        """
+        Calls <func> and records its metrics under the name <stage>.
+        """
+
+        # Nested stages share the tracemalloc peak with their caller, so only
+        # the outermost call resets and reads it
+        outermost = self._depth == 0
+        trace_memory = self.trace_memory and outermost and tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.reset_peak()
+            memory_start, _ = tracemalloc.get_traced_memory()
+
+        self._depth += 1
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            self._depth -= 1
+
+        peak_memory_mb = None
+        if trace_memory:
+            _, memory_peak = tracemalloc.get_traced_memory()
+            peak_memory_mb = (memory_peak - memory_start) / 2**20
+
+        rows_in = _count_rows(list(args) + list(kwargs.values()))
+        rows_out = len(result) if isinstance(result, (pd.DataFrame, list)) else None
+        self.records.append(
+            {
+                "stage": stage,
+                "depth": self._depth,
+                "wall_seconds": wall_seconds,
+                "cpu_seconds": cpu_seconds,
+                "rows_in": rows_in,
+                "rows_out": rows_out,
+                "row_ratio": rows_out / rows_in if rows_out is not None and rows_in else None,
+                "distinct_subject_ids": _count_distinct(result, "subject_id"),
+                "distinct_hadm_ids": _count_distinct(result, "hadm_id"),
+                "peak_memory_delta_mb": peak_memory_mb,
+            }
+        )
+
+        return result
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns the call records as a DataFrame (one row per call).
+        """
+
+        return pd.DataFrame(self.records)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Returns one row per stage with the number of calls, the total wall and
+        CPU time, the total rows in and out, the largest rows out / rows in ratio
+        of a single call and the largest peak memory delta, sorted by total wall
+        time.
+        """
+
+        calls = self.to_frame()
+        if calls.empty:
+            return calls
+
+        summary = (
+            calls.groupby("stage", sort=False)
+            .agg(
+                calls=("stage", "size"),
+                wall_seconds=("wall_seconds", "sum"),
+                cpu_seconds=("cpu_seconds", "sum"),
+                rows_in=("rows_in", "sum"),
+                rows_out=("rows_out", "sum"),
+                max_row_ratio=("row_ratio", "max"),
+                peak_memory_delta_mb=("peak_memory_delta_mb", "max"),
+            )
+            .sort_values("wall_seconds", ascending=False)
+        )
+
+        return summary.reset_index()
+
+    def format_summary(self) -> str:
+        """
+        Formats summary() as a plain text table.
+        """
+
+        summary = self.summary()
+        if summary.empty:
+            return "No instrumented calls were recorded."
+
+        return summary.to_string(index=False, float_format=lambda x: f"{x:.3f}")
+
+    def save(self, path: str) -> None:
+        """
+        Writes the run report: the call records and the per-stage summary as JSON
+        to <path>, and the summary table as text next to it (<path> with a .txt
+        extension).
+
+        Parameters:
+            path (str): The path of the JSON report.
+        """
+
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "calls": self.records,
+            "summary": self.summary().to_dict(orient="records"),
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+        table_path = path[: -len(".json")] if path.endswith(".json") else path
+        with open(table_path + ".txt", "w") as f:
+            f.write(self.format_summary() + "\n")
+
+
+def instrumented(func: Callable) -> Callable:
+    """
+    Decorator that records the calls of <func> in the active StageRecorder (see
+    the top of this file). Without an active recorder, <func> is called as is.
+    The stage is named `<module>.<function>`, e.g. `cohort.filter_df`.
+    """
+
+    stage = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _ACTIVE_RECORDER is None:
+            return func(*args, **kwargs)
+        return _ACTIVE_RECORDER.call(stage, func, args, kwargs)
+
+    return wrapper
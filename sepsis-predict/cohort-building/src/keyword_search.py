@@ -0,0 +1,172 @@
+"""
+keyword_search.py
+
+This file contains an Aho-Corasick multi-keyword matcher used to search note
+text for large keyword lists.
+
+The automaton is built once from the (lowercased) keywords and then scans each
+note in a single pass, regardless of how many keywords there are. Matching is
+case insensitive and finds keywords anywhere in the text (including inside
+other words), the same as `str.contains(..., case=False)` with a regex
+alternation of the keywords.
+
+The automaton is stored as a tuple of plain lists (see build_automaton()):
+    - goto: one dict per state mapping a character to the next state
+    - fail: the failure link of each state
+    - output: the indices of the keywords that end at each state (including
+        the ones reachable through failure links)
+"""
+
+import pandas as pd
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+Automaton = Tuple[List[Dict[str, int]], List[int], List[Tuple[int, ...]], List[str]]
+
+
+def build_automaton(keywords: List[str]) -> Automaton:
+    """
+    Builds an Aho-Corasick automaton for the given keywords.
+
+    Keywords are lowercased and de-duplicated (keeping the first occurrence).
+    Empty keywords are ignored.
+
+    Parameters:
+        keywords (List[str]): The keywords to search for.
+
+    Returns:
+        automaton (Automaton): A tuple of (goto, fail, output, keywords) where
+            <keywords> is the lowercased, de-duplicated keyword list that the
+            indices in <output> refer to.
+    """
+
+    unique_keywords = []
+    for keyword in keywords:
+        keyword = str(keyword).lower()
+        if keyword and keyword not in unique_keywords:
+            unique_keywords.append(keyword)
+
+    goto: List[Dict[str, int]] = [{}]
+    output: List[List[int]] = [[]]
+
+    # Build the trie of keywords
+    for index, keyword in enumerate(unique_keywords):
+        state = 0
+        for char in keyword:
+            if char not in goto[state]:
+                goto.append({})
+                output.append([])
+                goto[state][char] = len(goto) - 1
+            state = goto[state][char]
+        output[state].append(index)
+
+    # Breadth-first pass to set the failure links and merge outputs
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, next_state in goto[state].items():
+            queue.append(next_state)
+            fallback = fail[state]
+            while fallback and char not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(char, 0)
+            output[next_state].extend(output[fail[next_state]])
+
+    automaton = (goto, fail, [tuple(out) for out in output], unique_keywords)
+
+    return automaton
+
+
+def find_keywords(automaton: Automaton, text: Optional[str]) -> List[str]:
+    """
+    Returns every distinct keyword that occurs in <text>, in the order in which
+    they are first found. Null text never matches.
+
+    Parameters:
+        automaton (Automaton): An automaton created by build_automaton().
+        text (str): The text to search.
+
+    Returns:
+        matched_keywords (List[str]): The keywords found in the text.
+    """
+
+    if not isinstance(text, str):
+        return []
+
+    goto, fail, output, keywords = automaton
+    found = []
+    seen = set()
+    state = 0
+    for char in text.lower():
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        for index in output[state]:
+            if index not in seen:
+                seen.add(index)
+                found.append(index)
+
+    matched_keywords = [keywords[index] for index in found]
+
+    return matched_keywords
+
+
+def first_keyword(automaton: Automaton, text: Optional[str]) -> Optional[str]:
+    """
+    Returns the first keyword found while scanning <text>, or None if no keyword
+    occurs in the text. Stops scanning at the first match.
+
+    Parameters:
+        automaton (Automaton): An automaton created by build_automaton().
+        text (str): The text to search.
+
+    Returns:
+        keyword (str): The first matched keyword, or None.
+    """
+
+    if not isinstance(text, str):
+        return None
+
+    goto, fail, output, keywords = automaton
+    state = 0
+    for char in text.lower():
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        if output[state]:
+            return keywords[output[state][0]]
+
+    return None
+
+
+def search_series(
+    texts: pd.Series, keywords: List[str], all_matches: bool = False
+) -> pd.Series:
+    """
+    Searches every text in <texts> for the given keywords with a single
+    automaton.
+
+    Parameters:
+        texts (pd.Series): The texts to search.
+        keywords (List[str]): The keywords to search for.
+        all_matches (bool): If True, each value of the result is the list of all
+            keywords found in the text. If False, each value is the first keyword
+            found (or None), and scanning of a text stops at its first match.
+
+    Returns:
+        matches (pd.Series): The matched keyword(s) for each text, with the same
+            index as <texts>.
+    """
+
+    automaton = build_automaton(keywords)
+    search = find_keywords if all_matches else first_keyword
+
+    matches = pd.Series(
+        [search(automaton, text) for text in texts],
+        index=texts.index,
+        name=texts.name,
+        dtype=object,
+    )
+
+    return matches
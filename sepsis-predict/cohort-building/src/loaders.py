@@ -0,0 +1,284 @@
+"""
+loaders.py
+
+This file contains helper functions for loading the A3 input tables through a
+typed columnar (Parquet) cache.
+
+The first time a table is loaded, its CSV file is parsed once, converted to a
+fixed schema (int32 ids, categorical codes and pre-parsed datetimes) and written
+to a Parquet file in the cache directory. Later loads read the Parquet file, selecting only the
+requested columns. A small JSON sidecar stores the modification time and size of
+the source CSV file, and the cache is rebuilt whenever they change.
+
+Integer columns with missing values (e.g. a lab charted outside an ICU stay,
+without `icustay_id`) use the nullable pandas dtypes (Int32, Int64). The
+pipeline compares time columns as the "YYYY-MM-DD HH:MM:SS" strings of the CSV
+files, so load_table() formats the cached datetimes back to those strings
+(once per distinct value) unless it is called with parse_dates=True.
+
+Writing Parquet files requires pyarrow (or fastparquet). If neither is
+installed, the tables are read directly from the CSV files (with the same
+schema applied) and nothing is cached.
+"""
+
+import importlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+# Bump when the schemas below change, so existing caches are rebuilt
+CACHE_VERSION = 3
+
+ID_COLUMNS = {"subject_id": "int32", "hadm_id": "int32", "icustay_id": "int32"}
+
+# The CSV string format of the "datetime" and "date" columns of the schemas
+TIME_FORMATS = {"datetime": "%Y-%m-%d %H:%M:%S", "date": "%Y-%m-%d"}
+
+# Column dtypes per source file. "datetime" and "date" columns are parsed with
+# pd.to_datetime. Integer columns with missing values get the nullable dtype of
+# the same size. Columns that are not listed keep the dtype inferred by
+# pd.read_csv.
+TABLE_SCHEMAS: Dict[str, Dict[str, str]] = {
+    "diagnoses.csv": {
+        "row_id": "int64",
+        "subject_id": "int32",
+        "hadm_id": "int32",
+        "seq_num": "float32",
+        "icd9_code": "category",
+        "mimic_id": "int64",
+    },
+    "labs_cohort.csv": {
+        **ID_COLUMNS,
+        "charttime": "datetime",
+        "lab_id": "category",
+        "valuenum": "float64",
+    },
+    "vitals_cohort_sirs.csv": {
+        **ID_COLUMNS,
+        "charttime": "datetime",
+        "vital_id": "category",
+        "valuenum": "float64",
+    },
+    "fluids_all.csv": {**ID_COLUMNS, "charttime": "datetime"},
+    "hypotension_labels.csv": {**ID_COLUMNS, "charttime": "datetime"},
+    "notes_small_cohort_v2.csv": {
+        "subject_id": "int32",
+        "hadm_id": "Int32",
+        "chartdate": "date",
+        "charttime": "datetime",
+        "category": "category",
+        "description": "category",
+    },
+}
+
+
+def has_parquet_engine() -> bool:
+    """
+    Returns True if a Parquet engine (pyarrow or fastparquet) can be imported.
+    """
+
+    for engine in ["pyarrow", "fastparquet"]:
+        try:
+            importlib.import_module(engine)
+            return True
+        except ImportError:
+            continue
+
+    return False
+
+
+def _is_numpy_int(dtype: str) -> bool:
+    pandas_dtype = pd.api.types.pandas_dtype(dtype)
+    return isinstance(pandas_dtype, np.dtype) and pandas_dtype.kind == "i"
+
+
+def apply_schema(df: pd.DataFrame, schema: Dict[str, str]) -> pd.DataFrame:
+    """
+    Converts the columns of <df> that appear in <schema> to their schema dtype.
+    This is an inplace operation on <df>, which is also returned.
+
+    Integer columns with missing values are converted to the nullable dtype of
+    the same size (e.g. Int32 instead of int32, which cannot hold them).
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame to convert.
+        schema (Dict[str, str]): A mapping from a column name to a pandas dtype,
+            "datetime" or "date".
+
+    Returns:
+        df (pd.DataFrame): The converted DataFrame.
+    """
+
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype in TIME_FORMATS:
+            df[col] = pd.to_datetime(df[col], format=TIME_FORMATS[dtype])
+        elif dtype == "category":
+            df[col] = df[col].astype(str).where(df[col].notna()).astype("category")
+        elif _is_numpy_int(dtype) and df[col].isna().any():
+            df[col] = df[col].astype(dtype.capitalize())
+        else:
+            df[col] = df[col].astype(dtype)
+
+    return df
+
+
+def format_times(df: pd.DataFrame, schema: Dict[str, str]) -> pd.DataFrame:
+    """
+    Converts the parsed "datetime" and "date" columns of <df> back to the string
+    format of the CSV files (see TIME_FORMATS). Each distinct value is only
+    formatted once. This is an inplace operation on <df>, which is also returned.
+    """
+
+    for col, dtype in schema.items():
+        if dtype not in TIME_FORMATS or col not in df.columns:
+            continue
+        codes, uniques = pd.factorize(df[col])
+        # Missing values have code -1, which picks up the trailing NaN
+        formatted = np.append(uniques.strftime(TIME_FORMATS[dtype]).to_numpy(dtype=object), np.nan)
+        df[col] = formatted[codes]
+
+    return df
+
+
+def read_source_csv(csv_path: str, schema: Dict[str, str]) -> pd.DataFrame:
+    """
+    Reads one of the A3 CSV files. Categorical columns of the schema are read as
+    strings (so that codes such as "0389" keep their leading zeros), and all other
+    columns keep the dtype inferred by pd.read_csv.
+
+    The diagnoses extract has a broken header line that pandas reads as data
+    (see the A3 notebook). If the expected `subject_id` column is missing, the
+    file is re-read as strings and its first row is used as the header instead.
+
+    Parameters:
+        csv_path (str): Path to the CSV file.
+        schema (Dict[str, str]): The schema of the file (see TABLE_SCHEMAS).
+
+    Returns:
+        df (pd.DataFrame): The raw table.
+    """
+
+    string_columns = {col: str for col, dtype in schema.items() if dtype == "category"}
+    df = pd.read_csv(csv_path, dtype=string_columns)
+    if "subject_id" not in df.columns:
+        df = pd.read_csv(csv_path, dtype=str).reset_index()
+        df.columns = df.iloc[0]
+        df = df.iloc[1:].reset_index(drop=True)
+        df.columns.name = None
+
+    return df
+
+
+def _cache_paths(csv_path: str, cache_dir: str):
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return (
+        os.path.join(cache_dir, f"{stem}.parquet"),
+        os.path.join(cache_dir, f"{stem}.json"),
+    )
+
+
+def _source_signature(csv_path: str) -> Dict[str, float]:
+    stat = os.stat(csv_path)
+    return {"mtime": stat.st_mtime, "size": stat.st_size, "version": CACHE_VERSION}
+
+
+def is_cache_valid(csv_path: str, cache_dir: str) -> bool:
+    """
+    Returns True if the cached Parquet file for <csv_path> exists and was built
+    from the current version of the CSV file.
+
+    Parameters:
+        csv_path (str): Path to the source CSV file.
+        cache_dir (str): The cache directory.
+
+    Returns:
+        is_valid (bool): Whether the cache can be used.
+    """
+
+    parquet_path, meta_path = _cache_paths(csv_path, cache_dir)
+    if not (os.path.exists(parquet_path) and os.path.exists(meta_path)):
+        return False
+
+    with open(meta_path) as f:
+        cached_signature = json.load(f)
+
+    return cached_signature == _source_signature(csv_path)
+
+
+def build_cache(csv_path: str, cache_dir: str) -> pd.DataFrame:
+    """
+    Parses <csv_path> once, applies its schema from TABLE_SCHEMAS and writes the
+    result to the cache directory.
+
+    Parameters:
+        csv_path (str): Path to the source CSV file.
+        cache_dir (str): The cache directory (created if needed).
+
+    Returns:
+        df (pd.DataFrame): The converted table.
+    """
+
+    schema = TABLE_SCHEMAS.get(os.path.basename(csv_path), {})
+    df = apply_schema(read_source_csv(csv_path, schema), schema)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    parquet_path, meta_path = _cache_paths(csv_path, cache_dir)
+    df.to_parquet(parquet_path, index=False)
+    with open(meta_path, "w") as f:
+        json.dump(_source_signature(csv_path), f)
+
+    return df
+
+
+def load_table(
+    data_dir: str,
+    file_name: str,
+    columns: Optional[List[str]] = None,
+    cache_dir: Optional[str] = None,
+    refresh: bool = False,
+    parse_dates: bool = False,
+) -> pd.DataFrame:
+    """
+    Loads one of the A3 input tables through the typed Parquet cache.
+
+    EXAMPLE:
+        vitals = load_table(data_dir, "vitals_cohort_sirs.csv",
+            columns=["subject_id", "hadm_id", "icustay_id", "charttime",
+                     "vital_id", "valuenum"])
+
+    Parameters:
+        data_dir (str): The directory containing the source CSV files.
+        file_name (str): The name of the CSV file (e.g. "labs_cohort.csv").
+        columns (List[str]): The columns to load. If None, all columns are loaded.
+        cache_dir (str): The cache directory. Defaults to `<data_dir>/.cache`.
+        refresh (bool): If True, the cache is rebuilt even if it is valid.
+        parse_dates (bool): If True, the "datetime" and "date" columns of the
+            schema are returned as the cached datetime64 values instead of the
+            strings of the CSV file.
+
+    Returns:
+        df (pd.DataFrame): The typed table.
+    """
+
+    csv_path = os.path.join(data_dir, file_name)
+    if cache_dir is None:
+        cache_dir = os.path.join(data_dir, ".cache")
+    schema = TABLE_SCHEMAS.get(file_name, {})
+
+    if not has_parquet_engine():
+        df = apply_schema(read_source_csv(csv_path, schema), schema)
+    elif refresh or not is_cache_valid(csv_path, cache_dir):
+        df = build_cache(csv_path, cache_dir)
+    else:
+        df = pd.read_parquet(_cache_paths(csv_path, cache_dir)[0], columns=columns)
+
+    if columns is not None:
+        df = df[columns]
+    if not parse_dates:
+        df = format_times(df.copy(), schema)
+
+    return df
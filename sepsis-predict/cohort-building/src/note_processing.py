@@ -11,14 +11,19 @@ IMPORTANT INSTRUCTIONS:
 """
 
 # Imports - Do not modify
+import numpy as np
 import pandas as pd
-from typing import List
+from typing import List, Optional
 import re
+from src.keyword_search import search_series
+from src.dtype_policy import compact_dtypes
+from src.instrumentation import instrumented
 
 # ==================== CONSTANTS: DO NOT MODIFY ====================
 SEARCH_STRINGS = ["sepsis", "septic"]
 
 
+@instrumented
 def summarize_notes(notes: pd.DataFrame, indicator_column_name: str) -> pd.DataFrame:
     """
     Determines whether or not a patient has an infection utilizing the
@@ -73,16 +78,160 @@ def summarize_notes(notes: pd.DataFrame, indicator_column_name: str) -> pd.DataF
 
     # ==================== YOUR CODE HERE ====================
     
-    infection_df = notes[['subject_id', 'hadm_id', 'note_text']]
-    # infection_df[indicator_column_name] = (infection_df['note_text'].apply(lambda x: any(substring in x for substring in SEARCH_STRINGS)))
-    pattern = '|'.join(SEARCH_STRINGS)
-    infection_df[indicator_column_name]  = infection_df['note_text'].str.contains(pattern, case=False, na=False).astype(int)
-
-    infection_df[indicator_column_name] = infection_df.groupby(['subject_id', 'hadm_id'], as_index=False)[indicator_column_name].transform('max')
-    infection_df = infection_df[['subject_id', 'hadm_id', indicator_column_name]].drop_duplicates(subset=['subject_id', 'hadm_id'])
-    infection_df[indicator_column_name] = infection_df[indicator_column_name].astype(int)
+    infection_df = summarize_note_keywords(
+        notes, indicator_column_name, SEARCH_STRINGS, engine="regex"
+    )
     
     # ==================== YOUR CODE HERE ====================
     
 
     return infection_df
+
+
+def summarize_note_keywords(
+    notes: pd.DataFrame,
+    indicator_column_name: str,
+    keywords: Optional[List[str]] = None,
+    engine: str = "aho_corasick",
+    matched_column_name: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Same as summarize_notes(), but with a configurable keyword list and search
+    engine, and optionally reporting which keyword matched.
+
+    Engines:
+        - "regex": a case insensitive regex alternation of the keywords
+            (`str.contains`). Cheap for a handful of keywords.
+        - "aho_corasick": a single-pass Aho-Corasick scan of the lowercased text
+            (see keyword_search.py). Its cost does not grow with the number of
+            keywords, so it should be used for large synonym lists.
+
+    Parameters:
+        notes (pd.DataFrame): A DataFrame containing the columns `subject_id`,
+            `hadm_id`, and `note_text`.
+        indicator_column_name (str): The name of the indicator column.
+        keywords (List[str]): The keywords to search for. Defaults to
+            SEARCH_STRINGS.
+        engine (str): Either "regex" or "aho_corasick".
+        matched_column_name (str): If given (and engine is "aho_corasick"), adds a
+            column with this name holding the first keyword found for each
+            (`subject_id`, `hadm_id`) pair (None if there was no match).
+
+    Returns:
+        infection_df (pd.DataFrame): A DataFrame containing the columns
+            `subject_id`, `hadm_id`, <indicator_column_name> (1 if any note
+            contains a keyword and 0 otherwise), and optionally
+            <matched_column_name>.
+    """
+
+    if keywords is None:
+        keywords = SEARCH_STRINGS
+
+    keys = [notes["subject_id"], notes["hadm_id"]]
+
+    if engine == "regex":
+        pattern = "|".join(re.escape(keyword) for keyword in keywords)
+        has_keyword = notes["note_text"].str.contains(pattern, case=False, na=False)
+        matched = None
+    elif engine == "aho_corasick":
+        matched = search_series(notes["note_text"], keywords)
+        has_keyword = matched.notna()
+    else:
+        raise ValueError(f'Unknown engine "{engine}", use "regex" or "aho_corasick".')
+
+    infection_df = (
+        has_keyword.astype(np.uint8)
+        .groupby(keys, sort=False)
+        .max()
+        .rename(indicator_column_name)
+        .reset_index()
+    )
+
+    if matched_column_name is not None:
+        if matched is None:
+            raise ValueError("matched_column_name requires the aho_corasick engine.")
+        first_match = matched.groupby(keys, sort=False).first()
+        infection_df[matched_column_name] = first_match.reindex(
+            pd.MultiIndex.from_frame(infection_df[["subject_id", "hadm_id"]])
+        ).to_numpy()
+
+    return compact_dtypes(infection_df)
+
+
+def _merge_indicators(
+    running: Optional[pd.Series], pending: List[pd.Series], keys: List[str]
+) -> pd.Series:
+    """
+    Returns the OR (max) of the <running> and <pending> indicators per <keys>.
+    """
+
+    parts = pending if running is None else [running] + pending
+
+    return pd.concat(parts).groupby(level=keys, sort=False).max()
+
+
+def summarize_notes_chunked(
+    notes_path: str,
+    indicator_column_name: str,
+    keywords: Optional[List[str]] = None,
+    engine: str = "regex",
+    chunksize: int = 100_000,
+) -> pd.DataFrame:
+    """
+    Streaming version of summarize_note_keywords() that reads the notes CSV file
+    in chunks instead of loading the whole notes table into memory.
+
+    Each chunk is reduced to one row per (`subject_id`, `hadm_id`) pair and its
+    text is dropped right after scanning. The per-admission indicators are
+    combined into a running OR (max), so peak memory depends on the chunk size
+    and the number of admissions, not on the size of the notes corpus. The chunk
+    summaries are merged into the running OR in batches, once they add up to its
+    size, so each admission is only re-grouped a few times however many chunks
+    there are.
+
+    Parameters:
+        notes_path (str): Path to a notes CSV file containing (at least) the
+            columns `subject_id`, `hadm_id`, and `note_text`.
+        indicator_column_name (str): The name of the indicator column.
+        keywords (List[str]): The keywords to search for. Defaults to
+            SEARCH_STRINGS.
+        engine (str): Either "regex" or "aho_corasick" (see
+            summarize_note_keywords()).
+        chunksize (int): The number of notes to read per chunk.
+
+    Returns:
+        infection_df (pd.DataFrame): A DataFrame containing the columns
+            `subject_id`, `hadm_id`, and <indicator_column_name> (1 if any note
+            contains a keyword and 0 otherwise).
+    """
+
+    reader = pd.read_csv(
+        notes_path,
+        usecols=["subject_id", "hadm_id", "note_text"],
+        dtype={"note_text": str},
+        chunksize=chunksize,
+    )
+
+    keys = ["subject_id", "hadm_id"]
+    running = None
+    pending = []
+    pending_rows = 0
+    for chunk in reader:
+        summary = summarize_note_keywords(chunk, indicator_column_name, keywords, engine=engine)
+        pending.append(summary.set_index(keys)[indicator_column_name])
+        pending_rows += len(summary)
+
+        if running is None or pending_rows >= len(running):
+            running = _merge_indicators(running, pending, keys)
+            pending = []
+            pending_rows = 0
+
+    if pending:
+        running = _merge_indicators(running, pending, keys)
+    if running is None or running.empty:
+        return pd.DataFrame(columns=keys + [indicator_column_name])
+
+    infection_df = running.reset_index()
+    infection_df[indicator_column_name] = infection_df[indicator_column_name].astype(np.uint8)
+
+    return compact_dtypes(infection_df)
@@ -0,0 +1,141 @@
+"""
+sharding.py
+
+This file contains helper functions for running the A3 cohort pipeline in
+parallel, sharded by subject.
+
+Every stage of the pipeline (SIRS, sepsis, severe sepsis and septic shock) only
+combines rows of the same patient, so the input tables can be hash-partitioned
+by `subject_id` into independent shards. Each shard runs the whole chain in a
+worker process and the shard results are concatenated.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+from src.cohort import hash_subject_ids
+from src.sirs import summarize_sirs
+from src.trewscore import summarize_sepsis, summarize_severe_sepsis, summarize_septic_shock
+
+# The input tables of run_cohort_shard()
+SHARD_TABLES = [
+    "dev_imputed",
+    "all_infections",
+    "organ_dys",
+    "hypotension_labels",
+    "fluids_all",
+]
+
+
+def shard_tables(
+    tables: Dict[str, pd.DataFrame], n_shards: int, seed: int = 0
+) -> List[Dict[str, pd.DataFrame]]:
+    """
+    Hash-partitions every table by `subject_id` into <n_shards> shards. All rows of
+    a subject end up in the same shard, in every table.
+
+    Parameters:
+        tables (Dict[str, pd.DataFrame]): The tables to partition, each with a
+            `subject_id` column.
+        n_shards (int): The number of shards.
+        seed (int): The hashing seed.
+
+    Returns:
+        shards (List[Dict[str, pd.DataFrame]]): One dictionary of tables per
+            shard.
+    """
+
+    shards = [{} for _ in range(n_shards)]
+    for name, df in tables.items():
+        shard_ids = (hash_subject_ids(df["subject_id"].to_numpy(), seed) * n_shards).astype(int)
+        # Stable sort, so the rows keep their order within each shard
+        order = np.argsort(shard_ids, kind="stable")
+        bounds = np.searchsorted(shard_ids[order], np.arange(n_shards + 1))
+        for shard in range(n_shards):
+            shards[shard][name] = df.iloc[order[bounds[shard]:bounds[shard + 1]]]
+
+    return shards
+
+
+def run_cohort_shard(tables: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Runs summarize_sirs -> summarize_sepsis -> summarize_severe_sepsis ->
+    summarize_septic_shock on the tables of one shard.
+
+    Parameters:
+        tables (Dict[str, pd.DataFrame]): A mapping from each name in SHARD_TABLES
+            to the rows of the shard.
+
+    Returns:
+        septic_shock_summary (pd.DataFrame): The output of summarize_septic_shock()
+            for the shard.
+    """
+
+    dev_sirs = summarize_sirs(tables["dev_imputed"])
+    dev_sepsis = summarize_sepsis(dev_sirs, tables["all_infections"])
+    dev_severe_sepsis = summarize_severe_sepsis(dev_sepsis, tables["organ_dys"])
+    septic_shock_summary = summarize_septic_shock(
+        dev_severe_sepsis, tables["hypotension_labels"], tables["fluids_all"]
+    )
+
+    return septic_shock_summary
+
+
+def run_cohort_sharded(
+    dev_imputed: pd.DataFrame,
+    all_infections: pd.DataFrame,
+    organ_dys: pd.DataFrame,
+    hypotension_labels: pd.DataFrame,
+    fluids_all: pd.DataFrame,
+    n_workers: Optional[int] = None,
+    n_shards: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Runs the TREWScore staging chain (see run_cohort_shard()) on subject shards in
+    a process pool and concatenates the results.
+
+    EXAMPLE:
+        dev_septic_shock = run_cohort_sharded(dev_imputed, all_infections,
+            organ_dys, hypotension_labels, fluids_all, n_workers=8)
+
+    Parameters:
+        dev_imputed (pd.DataFrame): The imputed labs and vitals (see
+            impute_missing()).
+        all_infections (pd.DataFrame): The infection labels (see join_infections()).
+        organ_dys (pd.DataFrame): The organ dysfunction labels.
+        hypotension_labels (pd.DataFrame): The hypotension labels.
+        fluids_all (pd.DataFrame): The fluid resuscitation labels.
+        n_workers (int): The number of worker processes. Defaults to the number
+            of CPUs. With 1 worker, the shards run in the current process.
+        n_shards (int): The number of shards. Defaults to <n_workers>.
+
+    Returns:
+        septic_shock_summary (pd.DataFrame): The concatenated outputs of
+            summarize_septic_shock() for all shards.
+    """
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if n_shards is None:
+        n_shards = n_workers
+
+    tables = {
+        "dev_imputed": dev_imputed,
+        "all_infections": all_infections,
+        "organ_dys": organ_dys,
+        "hypotension_labels": hypotension_labels,
+        "fluids_all": fluids_all,
+    }
+    shards = shard_tables(tables, n_shards)
+
+    if n_workers == 1:
+        results = [run_cohort_shard(shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(run_cohort_shard, shards))
+
+    septic_shock_summary = pd.concat(results, ignore_index=True)
+
+    return septic_shock_summary
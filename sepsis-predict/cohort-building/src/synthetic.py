@@ -0,0 +1,303 @@
+"""
+synthetic.py
+
+This file contains a generator for synthetic MIMIC-III-like input tables for the
+A3 cohort-building pipeline. The tables have the same columns and formats as the
+A3 data files (see the A3 notebook), so that the pipeline can be run and
+benchmarked without access to MIMIC.
+
+The generated cohort is shaped after the real extracts:
+    - 1 to a few admissions per patient (mostly 1), one ICU stay per admission
+    - ICU stays of about 1 to 10 days (log-normal)
+    - vitals charted about hourly, labs every 8 to 12 hours
+    - about 9 diagnoses per admission, drawn from a long-tailed code list that
+        includes the infection and organ dysfunction prefixes
+    - about 10 notes per admission, some of them mentioning sepsis
+
+Cohorts that do not fit in memory can be generated in chunks of patients
+(iter_cohort_chunks()) and streamed to Parquet or CSV files (write_cohort()).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator
+
+VITALS = {
+    # vital_id: (mean, standard deviation)
+    "HeartRate": (88.0, 18.0),
+    "SysBP": (118.0, 22.0),
+    "RespRate": (19.0, 5.0),
+    "TempC": (37.0, 0.8),
+}
+
+LABS = {
+    "ALBUMIN": (3.0, 0.6),
+    "ANION GAP": (14.0, 4.0),
+    "BANDS": (5.0, 6.0),
+    "BICARBONATE": (24.0, 4.0),
+    "BILIRUBIN": (1.5, 2.0),
+    "BUN": (28.0, 20.0),
+    "CHLORIDE": (104.0, 6.0),
+    "CREATININE": (1.5, 1.2),
+    "GLUCOSE": (135.0, 45.0),
+    "HEMATOCRIT": (31.0, 5.0),
+    "HEMOGLOBIN": (10.5, 1.8),
+    "INR": (1.4, 0.5),
+    "LACTATE": (2.2, 1.5),
+    "PLATELET": (210.0, 100.0),
+    "POTASSIUM": (4.1, 0.6),
+    "PT": (15.0, 4.0),
+    "PTT": (35.0, 12.0),
+    "PaCO2": (40.0, 8.0),
+    "SODIUM": (139.0, 4.5),
+    "WBC": (11.0, 5.0),
+}
+
+ICD9_CODES = [
+    # Infection
+    "0389", "03811", "0380", "486", "5990", "68110", "99592", "11511",
+    # Organ dysfunction
+    "5849", "4589", "2930", "570", "78552", "2874", "34831",
+    # Other common codes
+    "4019", "4280", "42731", "41401", "5859", "25000", "2724", "51881",
+    "2449", "V5861", "53081", "2859", "311", "496", "V4581", "2761",
+    "2762", "41071", "4275", "78559", "2851", "3051", "V1582", "E8497",
+]
+
+NOTE_CATEGORIES = ["Nursing/other", "Radiology", "ECG", "Physician ", "Echo", "Discharge summary"]
+
+NOTE_SNIPPETS = [
+    "Patient resting comfortably, vitals stable.",
+    "No acute distress. Plan to continue current management.",
+    "Chest x-ray shows no acute cardiopulmonary process.",
+    "Sinus rhythm. Normal ECG.",
+    "Concern for Sepsis, blood cultures sent, started on broad spectrum antibiotics.",
+    "Septic shock requiring pressors.",
+    "Urinary tract infection, continue antibiotics.",
+    "Ejection fraction 55%. No valvular disease.",
+]
+
+BASE_TIME = np.datetime64("2100-01-01T00:00:00")
+
+
+def _format_times(times: np.ndarray) -> np.ndarray:
+    """
+    Formats datetime64 values as "YYYY-MM-DD HH:MM:SS" strings (as in the CSVs).
+    """
+
+    return pd.Series(times).dt.strftime("%Y-%m-%d %H:%M:%S").to_numpy()
+
+
+def _generate_events(
+    rng: np.random.Generator,
+    stays: pd.DataFrame,
+    ids: Dict[str, tuple],
+    id_column: str,
+    mean_interval_hours: float,
+) -> pd.DataFrame:
+    """
+    Generates long-format measurements for each ICU stay: for each measurement
+    type, charttimes spaced on average <mean_interval_hours> apart over the stay,
+    with normally distributed values.
+    """
+
+    hours = stays["los_hours"].to_numpy()
+    n_per_stay = np.maximum(1, rng.poisson(hours / mean_interval_hours))
+    stay_rows = np.repeat(np.arange(len(stays)), n_per_stay)
+
+    parts = []
+    for measurement, (mean, std) in ids.items():
+        offsets = rng.uniform(0, hours[stay_rows]) * 60
+        times = stays["intime"].to_numpy()[stay_rows] + offsets.astype("timedelta64[m]")
+        values = np.round(np.abs(rng.normal(mean, std, len(stay_rows))), 1)
+        part = stays[["subject_id", "hadm_id", "icustay_id"]].iloc[stay_rows].reset_index(drop=True)
+        part["charttime"] = times
+        part["valuenum"] = values
+        part[id_column] = measurement
+        parts.append(part)
+
+    events = pd.concat(parts, ignore_index=True)
+    events = events.sort_values(["subject_id", "hadm_id", "icustay_id", "charttime"], kind="mergesort")
+    events["charttime"] = _format_times(events["charttime"].to_numpy())
+
+    return events.reset_index(drop=True)
+
+
+def _generate_tables(
+    rng: np.random.Generator, subject_ids: np.ndarray, offsets: Dict[str, int]
+) -> Dict[str, pd.DataFrame]:
+    """
+    Generates the tables of the patients <subject_ids>. The `hadm_id`,
+    `icustay_id` and `row_id` values start after the given <offsets> (and the
+    offsets are advanced), so that the tables of consecutive calls can be
+    concatenated.
+    """
+
+    # Admissions, one ICU stay per admission
+    n_admissions = rng.geometric(0.75, len(subject_ids))
+    stays = pd.DataFrame({"subject_id": np.repeat(subject_ids, n_admissions)})
+    stays["hadm_id"] = 100000 + offsets["stays"] + rng.permutation(len(stays))
+    stays["icustay_id"] = 200000 + offsets["stays"] + rng.permutation(len(stays))
+    stays["intime"] = BASE_TIME + rng.integers(0, 10 * 365 * 24 * 60, len(stays)).astype(
+        "timedelta64[m]"
+    )
+    stays["los_hours"] = np.clip(rng.lognormal(np.log(60), 0.7, len(stays)), 6, 60 * 24)
+    offsets["stays"] += len(stays)
+
+    vitals = _generate_events(rng, stays, VITALS, "vital_id", 1.0)
+    labs = _generate_events(rng, stays, LABS, "lab_id", 10.0)
+    labs = labs[["subject_id", "hadm_id", "icustay_id", "charttime", "lab_id", "valuenum"]]
+
+    # Diagnoses: a long-tailed (Zipf-like) code distribution
+    n_dx = np.maximum(1, rng.poisson(9, len(stays)))
+    dx_rows = np.repeat(np.arange(len(stays)), n_dx)
+    weights = 1.0 / np.arange(1, len(ICD9_CODES) + 1)
+    diagnoses = stays[["subject_id", "hadm_id"]].iloc[dx_rows].reset_index(drop=True)
+    diagnoses.insert(0, "row_id", offsets["diagnoses"] + np.arange(1, len(diagnoses) + 1))
+    diagnoses["seq_num"] = np.arange(len(dx_rows)) - np.repeat(np.cumsum(n_dx) - n_dx, n_dx) + 1
+    diagnoses["icd9_code"] = rng.choice(ICD9_CODES, len(diagnoses), p=weights / weights.sum())
+    offsets["diagnoses"] += len(diagnoses)
+
+    # Hypotension and fluid labels, charted every few hours during the stay
+    label_tables = {}
+    for name, column, rate in [
+        ("hypotension_labels", "hypotension", 0.2),
+        ("fluids_all", "adequate_fluid", 0.3),
+    ]:
+        events = _generate_events(rng, stays, {column: (0.0, 1.0)}, "_label", 4.0)
+        events[column] = rng.random(len(events)) < rate
+        events = events.drop(columns=["valuenum", "_label"])
+        events = events.drop_duplicates(subset=["subject_id", "hadm_id", "icustay_id", "charttime"])
+        label_tables[name] = events.reset_index(drop=True)
+    fluids = label_tables["fluids_all"]
+    fluids["amount_24h"] = np.round(rng.gamma(2.0, 800.0, len(fluids)), 0)
+    fluids["current_amount"] = np.round(rng.gamma(1.5, 300.0, len(fluids)), 0)
+    fluids["relative_amount"] = np.round(fluids["amount_24h"] / 30.0, 1)
+
+    # Notes, dated during the admission
+    n_notes = np.maximum(1, rng.poisson(10, len(stays)))
+    note_rows = np.repeat(np.arange(len(stays)), n_notes)
+    notes = stays[["subject_id", "hadm_id"]].iloc[note_rows].reset_index(drop=True)
+    note_times = stays["intime"].to_numpy()[note_rows] + (
+        rng.uniform(0, stays["los_hours"].to_numpy()[note_rows]) * 60
+    ).astype("timedelta64[m]")
+    notes.insert(0, "row_id", offsets["notes"] + np.arange(1, len(notes) + 1))
+    notes["chartdate"] = pd.Series(note_times).dt.strftime("%Y-%m-%d").to_numpy()
+    notes["category"] = rng.choice(NOTE_CATEGORIES, len(notes))
+    notes["note_text"] = rng.choice(NOTE_SNIPPETS, len(notes), p=[0.3, 0.25, 0.15, 0.1, 0.04, 0.02, 0.04, 0.1])
+    offsets["notes"] += len(notes)
+
+    tables = {
+        "diagnoses": diagnoses,
+        "vitals_cohort_sirs": vitals,
+        "labs_cohort": labs,
+        "fluids_all": label_tables["fluids_all"],
+        "hypotension_labels": label_tables["hypotension_labels"],
+        "notes": notes,
+    }
+
+    return tables
+
+
+def iter_cohort_chunks(
+    n_patients: int = 1000, seed: int = 0, chunk_patients: int = 50_000
+) -> Iterator[Dict[str, pd.DataFrame]]:
+    """
+    Generates a synthetic cohort of <n_patients> patients in chunks of
+    <chunk_patients> patients, so that large cohorts never have to be held in
+    memory at once (1M patients is about 400M vitals rows).
+
+    The chunks hold disjoint, increasing `subject_id` values and disjoint
+    `hadm_id`, `icustay_id` and `row_id` values, so concatenating the tables of
+    all chunks gives one cohort (sorted the same way as generate_cohort()). With
+    a single chunk, the tables are those of generate_cohort().
+
+    Parameters:
+        n_patients (int): The number of patients.
+        seed (int): The random seed.
+        chunk_patients (int): The number of patients per chunk.
+
+    Yields:
+        tables (Dict[str, pd.DataFrame]): The tables of one chunk (see
+            generate_cohort()).
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # Patients (subject_ids are spread out, as in MIMIC)
+    subject_ids = np.sort(rng.choice(np.arange(1, 10 * n_patients + 1), n_patients, replace=False))
+
+    offsets = {"stays": 0, "diagnoses": 0, "notes": 0}
+    for start in range(0, n_patients, chunk_patients):
+        yield _generate_tables(rng, subject_ids[start:start + chunk_patients], offsets)
+
+
+def generate_cohort(n_patients: int = 1000, seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """
+    Generates a synthetic cohort of <n_patients> patients in memory. For large
+    cohorts, see iter_cohort_chunks() and write_cohort().
+
+    EXAMPLE:
+        tables = generate_cohort(10_000)
+        vitals_cohort_sirs = tables["vitals_cohort_sirs"]
+
+    Parameters:
+        n_patients (int): The number of patients (from 1k to about 100k).
+        seed (int): The random seed.
+
+    Returns:
+        tables (Dict[str, pd.DataFrame]): The tables "diagnoses",
+            "vitals_cohort_sirs", "labs_cohort", "fluids_all",
+            "hypotension_labels" and "notes", in the formats of the A3 data files
+            (string charttimes, string ICD-9 codes and note text).
+    """
+
+    return next(iter_cohort_chunks(n_patients, seed, chunk_patients=max(n_patients, 1)))
+
+
+def write_cohort(
+    directory: str,
+    n_patients: int,
+    seed: int = 0,
+    chunk_patients: int = 50_000,
+    file_format: str = "parquet",
+) -> Dict[str, str]:
+    """
+    Generates a synthetic cohort chunk by chunk (see iter_cohort_chunks()) and
+    streams it to disk, one file per table and chunk:
+    <directory>/<table>/part-<chunk>.<file_format>. A Parquet table directory can
+    be read back with pd.read_parquet(path) or duckdb_engine.
+
+    EXAMPLE:
+        paths = write_cohort("synthetic_1m", 1_000_000)
+        vitals = pd.read_parquet(paths["vitals_cohort_sirs"], columns=["valuenum"])
+
+    Parameters:
+        directory (str): The output directory.
+        n_patients (int): The number of patients.
+        seed (int): The random seed.
+        chunk_patients (int): The number of patients generated (and held in
+            memory) at a time.
+        file_format (str): Either "parquet" or "csv".
+
+    Returns:
+        paths (Dict[str, str]): The directory of each table.
+    """
+
+    if file_format not in ["parquet", "csv"]:
+        raise ValueError(f'file_format "{file_format}" is not supported, use "parquet" or "csv".')
+
+    paths = {}
+    for chunk, tables in enumerate(iter_cohort_chunks(n_patients, seed, chunk_patients)):
+        for name, table in tables.items():
+            paths[name] = os.path.join(directory, name)
+            os.makedirs(paths[name], exist_ok=True)
+            part_path = os.path.join(paths[name], f"part-{chunk:05d}.{file_format}")
+            if file_format == "parquet":
+                table.to_parquet(part_path, index=False)
+            else:
+                table.to_csv(part_path, index=False)
+        del tables
+
+    return paths
@@ -12,8 +12,12 @@ IMPORTANT INSTRUCTIONS:
 
 # Imports - Do not modify
 import pandas as pd
+from src.imputation import grouped_ffill
+from src.dtype_policy import compact_dtypes
+from src.instrumentation import instrumented
 
 
+@instrumented
 def summarize_sepsis(dev_sirs: pd.DataFrame, all_infections: pd.DataFrame):
     """
     Returns a merged dataframe containing all of the columns from the <dev_sirs> and
@@ -63,6 +67,7 @@ def summarize_sepsis(dev_sirs: pd.DataFrame, all_infections: pd.DataFrame):
     sepsis_summary = pd.merge(dev_sirs, all_infections, how='outer', on=['subject_id', 'hadm_id'])
     sepsis_summary.dropna(subset='charttime', inplace=True)
     get_sepsis_status(sepsis_summary)
+    sepsis_summary = compact_dtypes(sepsis_summary)
     # ==================== YOUR CODE HERE ====================
     
 
@@ -99,13 +104,14 @@ def get_sepsis_status(sepsis_summary: pd.DataFrame) -> None:
 
 
     # ==================== YOUR CODE HERE ====================
-    sepsis_summary['sepsis_status'] = sepsis_summary["criteria_1"]+sepsis_summary["criteria_2"]+sepsis_summary["criteria_3"]+sepsis_summary["criteria_4"]
+    ## cast to int before summing, adding boolean columns is a logical OR
+    sepsis_summary['sepsis_status'] = sepsis_summary[["criteria_1", "criteria_2", "criteria_3", "criteria_4"]].astype(int).sum(axis=1)
     sepsis_summary['sepsis_status'] = ((sepsis_summary['sepsis_status']>=2) & ((sepsis_summary["has_icd9_infection"]==1) | (sepsis_summary["has_note_infection"]==1)))
     
     # ==================== YOUR CODE HERE ====================
-    
 
 
+@instrumented
 def summarize_severe_sepsis(dev_sepsis: pd.DataFrame, organ_dys: pd.DataFrame):
     """
     Returns a merged dataframe containing all of the columns from the <dev_sepsis> and
@@ -160,12 +166,14 @@ def summarize_severe_sepsis(dev_sepsis: pd.DataFrame, organ_dys: pd.DataFrame):
     severe_sepsis_summary = pd.merge(dev_sepsis, organ_dys, how='outer', on=['subject_id','hadm_id'])
     severe_sepsis_summary['severe_sepsis_status'] = ((severe_sepsis_summary['has_organ_dysfunction']) & (severe_sepsis_summary['sepsis_status']))
     severe_sepsis_summary.dropna(subset='charttime', inplace=True)
+    severe_sepsis_summary = compact_dtypes(severe_sepsis_summary)
     # ==================== YOUR CODE HERE ====================
     
 
     return severe_sepsis_summary
 
 
+@instrumented
 def summarize_septic_shock(
     dev_severe_sepsis: pd.DataFrame,
     hypotension_labels: pd.DataFrame,
@@ -243,6 +251,7 @@ def summarize_septic_shock(
 
     ## check septic_shock
     septic_shock_summary['septic_shock'] = ((septic_shock_summary['severe_sepsis_status']) & (septic_shock_summary['adequate_fluid']) & (septic_shock_summary['hypotension']))
+    septic_shock_summary = compact_dtypes(septic_shock_summary)
     # ==================== YOUR CODE HERE ====================
     
 
@@ -254,8 +263,6 @@ def summarize_septic_shock(
 def impute_missing(dataframe: pd.DataFrame): ## same function from features.py 
 
     # ==================== YOUR CODE HERE ====================
-    imputed_df = dataframe.sort_values(['charttime'])
-    
-    imputed_df = imputed_df.groupby(["subject_id","hadm_id","icustay_id"], axis=0, as_index=False).apply(lambda x: x.fillna(method="ffill"))
-    ## https://stackoverflow.com/questions/67347586/pandas-groupby-fill-disappear-the-column 
+    ## sort once by stay and charttime, then forward fill every column per stay segment
+    imputed_df = grouped_ffill(dataframe, ["subject_id","hadm_id","icustay_id"], "charttime")
     return imputed_df
\ No newline at end of file
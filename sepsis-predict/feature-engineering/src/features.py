@@ -14,6 +14,8 @@ IMPORTANT INSTRUCTIONS:
 import pandas as pd
 import numpy as np
 import datetime
+from src.ic_store import create_ic_store, add_patients, ic_table, lookup_ic
+from src.sparse_features import SparseFeatures, from_grouped_counts, to_dense_frame
 
 
 def get_diagnoses(
@@ -56,14 +58,26 @@ def get_diagnoses(
     diagnosis_merge = diagnoses[['subject_id', 'hadm_id', 'icd9_code']]
 
     joined_table = admissions_merge.merge(diagnosis_merge, how='inner', on=['subject_id', 'hadm_id'], suffixes=['', '_'])
-    joined_table = joined_table[['subject_id', 'hadm_id', 'icd9_code', 'dischtime', 'admittime']]
-    shock_labels_merge = shock_labels[['hadm_id', 'subject_id', 'index_time']]
-    merged = pd.merge(joined_table, shock_labels_merge, on=['subject_id'], how='inner', suffixes=['', '_'])
-
-    # return merged
-    dx = merged[(merged['dischtime'] < merged['index_time']) & (merged['dischtime'] >= merged['admittime'])]
-    dx = dx[['subject_id', 'hadm_id', 'icd9_code', 'dischtime', 'index_time']]
-    dx.rename(columns={'dischtime': 'diagnosis_time'}, inplace=True)
+    ## the subjects in order of first appearance, counted before the admittime filter
+    joined_table['subject_rank'] = pd.factorize(joined_table['subject_id'])[0]
+    joined_table = joined_table[joined_table['dischtime'] >= joined_table['admittime']]
+
+    ## only emit the (diagnosis, index_time) pairs with dischtime < index_time of the same
+    ## subject, instead of the subject-level cross product
+    dx_positions, shock_positions = interval_join_pairs(
+        joined_table['subject_id'], joined_table['dischtime'],
+        shock_labels['subject_id'], shock_labels['index_time'],
+    )
+    ## in the row order of the inner merge on subject_id: grouped by subject in
+    ## order of first appearance, then by diagnosis row and index_time row
+    subject_rank = joined_table['subject_rank'].to_numpy()
+    order = np.lexsort((shock_positions, dx_positions, subject_rank[dx_positions]))
+    dx_positions = dx_positions[order]
+    shock_positions = shock_positions[order]
+
+    dx = joined_table.iloc[dx_positions][['subject_id', 'hadm_id', 'icd9_code', 'dischtime']]
+    dx = dx.rename(columns={'dischtime': 'diagnosis_time'}).reset_index(drop=True)
+    dx['index_time'] = shock_labels['index_time'].iloc[shock_positions].array
     
     
     # ==================== YOUR CODE HERE ====================
@@ -108,14 +122,10 @@ def calc_ic(dx_features: pd.DataFrame, all_patients_count: int) -> pd.DataFrame:
 
 
     # ==================== YOUR CODE HERE ====================
-    subject_counts = dx_features.groupby(by='icd9_code', as_index=False)['subject_id'].unique()
-    subject_counts['unique_patient_id_count'] = [len(x) for x in subject_counts['subject_id']]
-
-    subject_counts['icd9_ic'] = -1*np.log2(subject_counts['unique_patient_id_count']/all_patients_count)
-
-    icd9_ic = pd.merge(dx_features, subject_counts, on='icd9_code', how='inner')
-    icd9_ic.drop_duplicates(subset=['icd9_code'], inplace=True)
-    icd9_ic = icd9_ic[['icd9_code', 'icd9_ic']]
+    ## distinct patients per code from an IC store (one pass, no merge back onto dx_features)
+    store = create_ic_store(all_patients_count=all_patients_count)
+    add_patients(store, dx_features)
+    icd9_ic = ic_table(store)
 
     # ==================== YOUR CODE HERE ====================
     
@@ -137,7 +147,8 @@ def filter_ic(dx_features: pd.DataFrame, icd9_ic: pd.DataFrame) -> pd.DataFrame:
         dx_features (pd.DataFrame): a dataframe containing the valid diagnosis
             features for each patient in the cohort
         icd9_ic (pd.DataFrame): a dataframe containing the IC score for each
-            diagnosis icd9 code in the dx_features dataframe
+            diagnosis icd9 code in the dx_features dataframe (or an IC store,
+            see ic_store.py, created with the cohort's all_patients_count)
 
     Returns:
         dx_filtered (pd.DataFrame): a dataframe containing the filtered diagnosis
@@ -149,11 +160,21 @@ def filter_ic(dx_features: pd.DataFrame, icd9_ic: pd.DataFrame) -> pd.DataFrame:
 
 
     # ==================== YOUR CODE HERE ====================
-    dx_filtered = pd.merge(dx_features, icd9_ic, on='icd9_code', how='inner')
-
-    dx_filtered = dx_filtered[(dx_filtered['icd9_ic']>=4) & (dx_filtered['icd9_ic']<=9)]
-    
-    dx_filtered.drop(columns='icd9_ic', inplace=True)
+    ## <icd9_ic> can also be an IC store (see ic_store.py), read directly
+    if isinstance(icd9_ic, dict):
+        ic_values = lookup_ic(icd9_ic, dx_features['icd9_code'])
+    else:
+        code_ic = icd9_ic.drop_duplicates('icd9_code').set_index('icd9_code')['icd9_ic']
+        code_ic.index = code_ic.index.astype(str)
+        ic_values = dx_features['icd9_code'].astype(str).map(code_ic).to_numpy()
+
+    ## Same row order and index as the inner merge: grouped by code in order of
+    ## first appearance
+    code_ids = pd.factorize(dx_features['icd9_code'])[0]
+    matched = np.flatnonzero(~np.isnan(ic_values))
+    order = matched[np.argsort(code_ids[matched], kind='stable')]
+    dx_filtered = dx_features.iloc[order].reset_index(drop=True)
+    dx_filtered = dx_filtered[(ic_values[order]>=4) & (ic_values[order]<=9)]
     # ==================== YOUR CODE HERE ====================
     
 
@@ -217,7 +238,7 @@ def get_diagnosis_features(dx_selected: pd.DataFrame) -> pd.DataFrame:
                                                 index='subject_id', 
                                                 values = ['RECENT', 'PRIOR'], 
                                                 columns = 'icd9_code', 
-                                                aggfunc="count"
+                                                aggfunc="sum"
                                                 )
     
     patient_diagnosis_features.columns = ["_".join(x) for x in patient_diagnosis_features.columns]
@@ -231,6 +252,229 @@ def get_diagnosis_features(dx_selected: pd.DataFrame) -> pd.DataFrame:
 
 # NOTE: Feel free to add additional helper functions if you wish!
 
+def get_diagnosis_features_sparse(dx_selected: pd.DataFrame) -> SparseFeatures:
+    """
+    Sparse version of get_diagnosis_features(): the same patient-feature matrix
+    as a scipy.sparse CSR matrix with `subject_id` and column vocabularies (see
+    sparse_features.py), built from the grouped RECENT/PRIOR sums without
+    pivot_table.
+
+    The rows, columns (`PRIOR_<icd9_code>` then `RECENT_<icd9_code>`, sorted)
+    and values are those of get_diagnosis_features(), with 0 where the dense
+    matrix has NaN. Zero counts are not stored.
+
+    Parameters:
+        dx_selected (pd.DataFrame): a dataframe containing the filtered diagnosis
+            features for each patient in the cohort
+
+    Returns:
+        patient_diagnosis_features (SparseFeatures): the sparse patient-feature
+            matrix for diagnoses
+    """
+
+    days_6months = 30.44*6
+    age = dx_selected['index_time'] - dx_selected['diagnosis_time']
+    dx = pd.DataFrame({
+        'subject_id': dx_selected['subject_id'],
+        'icd9_code': dx_selected['icd9_code'].astype(str).where(dx_selected['icd9_code'].notna()),
+        'RECENT': (age <= datetime.timedelta(days=days_6months)).astype(int),
+        'PRIOR': (age > datetime.timedelta(days=days_6months)).astype(int),
+    })
+
+    ## One grouped row per (patient, code), with one value in each bin
+    sums = dx.groupby(['subject_id', 'icd9_code'], sort=False)[['PRIOR', 'RECENT']].sum()
+    subject_ids = sums.index.get_level_values('subject_id').to_series(index=None)
+    codes = sums.index.get_level_values('icd9_code').to_series(index=None)
+    patient_diagnosis_features = from_grouped_counts(
+        pd.concat([subject_ids, subject_ids], ignore_index=True),
+        pd.concat(['PRIOR_' + codes, 'RECENT_' + codes], ignore_index=True),
+        pd.concat([sums['PRIOR'], sums['RECENT']], ignore_index=True),
+    )
+    patient_diagnosis_features.matrix.eliminate_zeros()
+
+    return patient_diagnosis_features
+
+
+def datetime_to_ns(times: pd.Series) -> np.ndarray:
+    """
+    Returns the datetimes in <times> as int64 nanoseconds since the epoch (in UTC
+    for timezone-aware datetimes). Missing values become the smallest int64.
+    """
+
+    return pd.DatetimeIndex(times).asi8
+
+
+def interval_join_pairs(
+    left_keys: pd.Series,
+    left_times: pd.Series,
+    right_keys: pd.Series,
+    right_times: pd.Series,
+):
+    """
+    Returns the positions of all (left row, right row) pairs with the same key
+    where the right time is strictly after the left time, e.g. all (diagnosis,
+    index_time) pairs of a subject with dischtime < index_time.
+
+    The right rows are sorted by key and time, so that the matches of a left row
+    are one contiguous run of right rows. The start of the run is found by
+    sorting the left and right times together per key, and the pairs are
+    gathered without ever building the key-level cross product: memory is
+    proportional to the inputs plus the output. Rows with a missing key or time
+    never match.
+
+    Parameters:
+        left_keys (pd.Series): The join key of each left row (e.g. subject_id).
+        left_times (pd.Series): The time of each left row.
+        right_keys (pd.Series): The join key of each right row.
+        right_times (pd.Series): The time of each right row.
+
+    Returns:
+        left_positions (np.ndarray): The position of the left row of each pair.
+        right_positions (np.ndarray): The position of the right row of each pair.
+            Pairs are ordered by left row, then by right time.
+    """
+
+    left_valid = (left_keys.notna() & left_times.notna()).to_numpy()
+    right_valid = (right_keys.notna() & right_times.notna()).to_numpy()
+    left_rows = np.flatnonzero(left_valid)
+    right_rows = np.flatnonzero(right_valid)
+
+    # Shared integer codes for the keys of both sides
+    key_codes, _ = pd.factorize(
+        np.concatenate([left_keys.to_numpy()[left_rows], right_keys.to_numpy()[right_rows]])
+    )
+    left_codes = key_codes[:len(left_rows)]
+    right_codes = key_codes[len(left_rows):]
+    left_ns = datetime_to_ns(left_times)[left_rows]
+    right_ns = datetime_to_ns(right_times)[right_rows]
+
+    # Right rows sorted by key and time, with the run of rows of each key
+    right_order = np.lexsort([right_ns, right_codes])
+    right_rows = right_rows[right_order]
+    right_codes = right_codes[right_order]
+    run_end = np.searchsorted(right_codes, left_codes, side="right")
+
+    # Sort the left and right times together per key (a right time equal to a
+    # left time sorts first, since it does not match); the number of right rows
+    # of the same key at or before each left row ends the non-matching prefix
+    is_left = np.concatenate(
+        [np.zeros(len(right_rows), dtype=np.int8), np.ones(len(left_rows), dtype=np.int8)]
+    )
+    all_codes = np.concatenate([right_codes, left_codes])
+    all_ns = np.concatenate([right_ns[right_order], left_ns])
+    order = np.lexsort([is_left, all_ns, all_codes])
+    right_seen = np.cumsum(is_left[order] == 0)
+    first_match = np.empty(len(left_rows), dtype=np.int64)
+    first_match[order[is_left[order] == 1] - len(right_rows)] = right_seen[is_left[order] == 1]
+
+    # Gather the runs [first_match, run_end) of every left row
+    lengths = np.maximum(run_end - first_match, 0)
+    offsets = np.cumsum(lengths) - lengths
+    left_positions = np.repeat(left_rows, lengths)
+    right_positions = right_rows[
+        np.repeat(first_match - offsets, lengths) + np.arange(lengths.sum())
+    ]
+
+    return left_positions, right_positions
+
+
+## Lookback windows of the windowed diagnosis features (1 month == 30.44 days);
+## None counts all diagnoses
+DIAGNOSIS_WINDOWS = {
+    '30D': datetime.timedelta(days=30),
+    '90D': datetime.timedelta(days=90),
+    '6M': datetime.timedelta(days=30.44*6),
+    '1Y': datetime.timedelta(days=30.44*12),
+    'EVER': None,
+}
+
+
+def get_windowed_diagnosis_features(
+    dx_selected: pd.DataFrame,
+    windows: dict = None,
+    sparse: bool = True,
+):
+    """
+    Returns the number of diagnoses of each code per patient within each lookback
+    window before the index time, with one column `<window>_<icd9_code>` per
+    window and code. A diagnosis is within a window if index_time -
+    diagnosis_time <= the window (as for RECENT in get_diagnosis_features()).
+
+    All windows are counted in one pass: the diagnoses are sorted once by
+    (patient, code) group and age (index_time - diagnosis_time), and the end of
+    each window in every group is found with one vectorized searchsorted per
+    window. Diagnoses without a time are only counted in the None window.
+
+    Parameters:
+        dx_selected (pd.DataFrame): a dataframe containing the filtered diagnosis
+            features for each patient in the cohort
+        windows (dict): The window name and timedelta (None for all diagnoses) of
+            each window. Defaults to DIAGNOSIS_WINDOWS.
+        sparse (bool): Whether to return a SparseFeatures (see
+            sparse_features.py) instead of a dense dataframe.
+
+    Returns:
+        windowed_features (SparseFeatures or pd.DataFrame): the patient-feature
+            matrix, with sorted columns, one row per patient with a diagnosis in
+            any window, and 0 for codes without diagnoses in a window
+    """
+
+    if windows is None:
+        windows = DIAGNOSIS_WINDOWS
+
+    dx = dx_selected[dx_selected['subject_id'].notna() & dx_selected['icd9_code'].notna()]
+    subject_codes, subject_ids = pd.factorize(dx['subject_id'])
+    code_codes, codes = pd.factorize(dx['icd9_code'].astype(str))
+    group_ids, groups = pd.factorize(subject_codes.astype(np.int64) * len(codes) + code_codes)
+
+    ## Ages as dense ranks, so that (group, age) fits in one sorted int64 key
+    age = datetime_to_ns(dx['index_time']) - datetime_to_ns(dx['diagnosis_time'])
+    no_time = (dx['index_time'].isna() | dx['diagnosis_time'].isna()).to_numpy()
+    age[no_time] = np.iinfo(np.int64).max
+    age_values, age_ranks = np.unique(age, return_inverse=True)
+    keys = np.sort(group_ids.astype(np.int64) * (len(age_values) + 1) + age_ranks)
+
+    group_codes = np.arange(len(groups), dtype=np.int64)
+    group_start = np.searchsorted(keys, group_codes * (len(age_values) + 1))
+    group_end = np.searchsorted(keys, (group_codes + 1) * (len(age_values) + 1))
+
+    names = []
+    counts = []
+    for name, window in windows.items():
+        if window is None:
+            window_end = group_end
+        else:
+            ## Number of distinct ages within the window, then the end of the
+            ## window in every group at once
+            window_ns = pd.Timedelta(window).value
+            window_rank = np.searchsorted(age_values, window_ns, side='right')
+            window_end = np.searchsorted(keys, group_codes * (len(age_values) + 1) + window_rank)
+        names.append(name)
+        counts.append(window_end - group_start)
+
+    ## Long format with the non-zero counts only; the column names are built
+    ## once per (window, code) as the categories of a categorical
+    counts = np.concatenate(counts) if counts else np.array([], dtype=np.int64)
+    non_zero = counts > 0
+    group_positions = np.tile(group_codes, len(names))[non_zero]
+    window_positions = np.repeat(np.arange(len(names)), len(groups))[non_zero]
+    column_ids, column_keys = pd.factorize(
+        window_positions * len(codes) + groups[group_positions] % len(codes)
+    )
+    column_names = [
+        names[key // len(codes)] + '_' + codes[key % len(codes)] for key in column_keys
+    ]
+    windowed_features = from_grouped_counts(
+        pd.Series(subject_ids[groups[group_positions] // len(codes)]),
+        pd.Series(pd.Categorical.from_codes(column_ids, categories=column_names)),
+        pd.Series(counts[non_zero]),
+    )
+
+    if not sparse:
+        return to_dense_frame(windowed_features)
+
+    return windowed_features
+
 
 
 # NOTE: For any helper functions you choose to implement, please include a docstring 
@@ -0,0 +1,358 @@
+"""
+ic_store.py
+
+This file contains a persisted, incrementally updatable store of the number of
+distinct patients with each ICD-9 code, for the information content (IC) of the
+diagnosis codes (see calc_ic() and filter_ic() in features.py).
+
+The store is a dictionary of NumPy arrays:
+    - `codes`: the ICD-9 codes, in order of first appearance
+    - `counts`: the exact number of distinct patients per code
+    - `pairs`: the sorted, distinct (code, patient) pairs, encoded as
+        code position * 2^32 + subject_id, so that a patient who is added again
+        is not counted twice
+    - `subjects`: the sorted, distinct patients
+    - `pending_pairs`, `pending_subjects`: lists of smaller sorted runs of pairs
+        and patients that were added since the last merge (see _add_sorted())
+    - `all_patients_count`: optional number of patients in the cohort, the IC
+        denominator (defaults to the number of distinct patients in the store)
+    - `hll`: optional HyperLogLog registers (one row per code), for approximate
+        distinct counts of huge cohorts without keeping the pairs
+
+A new batch of patients is added with add_patients(), which only sorts the
+batch, finds the values that are not stored yet with binary searches and keeps
+them as a new sorted run. Runs are merged when they reach the size of the run
+before them, so a batch never copies the whole store and every value is copied
+O(log n) times in total.
+
+EXAMPLE:
+    store = create_ic_store(all_patients_count=len(shock_labels))
+    add_patients(store, dx_features)
+    add_patients(store, dx_features_new_batch)
+    save_ic_store(store, "ic_store.npz")
+    dx_selected = filter_ic(dx_features, store)
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Optional
+
+ICStore = Dict[str, Any]
+
+# Patients are encoded in the low 32 bits of a (code, patient) pair
+_PAIR_SHIFT = np.int64(2**32)
+
+
+def create_ic_store(
+    exact: bool = True,
+    hll_precision: Optional[int] = None,
+    all_patients_count: Optional[int] = None,
+) -> ICStore:
+    """
+    Creates an empty IC store.
+
+    Parameters:
+        exact (bool): Whether to keep the (code, patient) pairs for exact
+            distinct counts.
+        hll_precision (int): If given, also keep a HyperLogLog sketch per code
+            with 2^<hll_precision> registers (e.g. 10 for a relative error of
+            about 3%). Required if <exact> is False.
+        all_patients_count (int): The number of patients in the cohort, used as
+            the IC denominator by ic_table() and lookup_ic(). Defaults to the
+            number of distinct patients in the store.
+
+    Returns:
+        store (ICStore): The empty store.
+    """
+
+    if not exact and hll_precision is None:
+        raise ValueError("An IC store needs exact counts, a HyperLogLog sketch or both.")
+    if hll_precision is not None and not 4 <= hll_precision <= 16:
+        raise ValueError("hll_precision must be between 4 and 16.")
+
+    store = {
+        "codes": np.array([], dtype=str),
+        "counts": np.array([], dtype=np.int64),
+        "pairs": np.array([], dtype=np.int64) if exact else None,
+        "subjects": np.array([], dtype=np.int64),
+        "pending_pairs": [],
+        "pending_subjects": [],
+        "hll_precision": hll_precision,
+        "hll": None,
+        "all_patients_count": all_patients_count,
+    }
+    if hll_precision is not None:
+        store["hll"] = np.zeros((0, 2**hll_precision), dtype=np.uint8)
+
+    return store
+
+
+def _hash64(values: np.ndarray) -> np.ndarray:
+    """
+    Returns the splitmix64 hash of each integer in <values> as uint64.
+    """
+
+    with np.errstate(over="ignore"):
+        x = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+
+    return x
+
+
+def _code_positions(store: ICStore, codes: np.ndarray) -> np.ndarray:
+    """
+    Returns the position of each of <codes> in the store, appending the codes
+    that are not in the store yet.
+    """
+
+    index = pd.Index(store["codes"])
+    positions = index.get_indexer(codes)
+
+    is_new = positions == -1
+    if is_new.any():
+        new_codes = pd.unique(codes[is_new])
+        store["codes"] = np.concatenate([store["codes"], new_codes.astype(str)])
+        store["counts"] = np.concatenate(
+            [store["counts"], np.zeros(len(new_codes), dtype=np.int64)]
+        )
+        if store["hll"] is not None:
+            store["hll"] = np.vstack(
+                [store["hll"], np.zeros((len(new_codes), store["hll"].shape[1]), np.uint8)]
+            )
+        positions[is_new] = len(index) + pd.Index(new_codes).get_indexer(codes[is_new])
+
+    return positions
+
+
+def _is_stored(sorted_values: np.ndarray, batch: np.ndarray) -> np.ndarray:
+    """
+    Returns whether each value of <batch> is in the sorted <sorted_values>.
+    """
+
+    positions = np.searchsorted(sorted_values, batch)
+    is_seen = positions < len(sorted_values)
+    is_seen[is_seen] = sorted_values[positions[is_seen]] == batch[is_seen]
+
+    return is_seen
+
+
+def _merge_runs(runs: list) -> np.ndarray:
+    """
+    Returns the sorted, distinct values of the sorted, disjoint <runs>. The
+    stable sort (a timsort for int64) detects the runs and merges them in
+    linear time.
+    """
+
+    if len(runs) == 1:
+        return runs[0]
+
+    return np.sort(np.concatenate(runs), kind="stable")
+
+
+def _add_sorted(store: ICStore, name: str, batch: np.ndarray) -> np.ndarray:
+    """
+    Adds the sorted, distinct <batch> to the values <name> of the store (e.g.
+    "pairs"), without re-sorting or copying the stored values for every batch.
+
+    The values are kept as the stored array plus a list of smaller sorted,
+    disjoint runs (`pending_<name>`), largest first. The values of the batch
+    that are not stored yet become a new run, and the last two runs are merged
+    while the last one is at least as large as the one before it, like the
+    carries of a binary counter. So there are O(log n) runs to search, and a
+    value is copied O(log n) times over all batches, instead of the whole store
+    once per batch.
+
+    Returns:
+        new_values (np.ndarray): The values of <batch> that were not stored yet.
+    """
+
+    runs = [store[name]] + store[f"pending_{name}"]
+    is_seen = np.zeros(len(batch), dtype=bool)
+    for run in runs:
+        is_seen |= _is_stored(run, batch)
+    new_values = batch[~is_seen]
+
+    if len(new_values):
+        runs.append(new_values)
+        while len(runs) > 1 and len(runs[-1]) >= len(runs[-2]):
+            last = runs.pop()
+            runs[-1] = _merge_runs([runs[-1], last])
+        store[name] = runs[0]
+        store[f"pending_{name}"] = runs[1:]
+
+    return new_values
+
+
+def _compact(store: ICStore) -> None:
+    """
+    Merges the pending runs of the store into its stored arrays. This is an
+    inplace operation on <store>.
+    """
+
+    for name in ["pairs", "subjects"]:
+        if store[name] is not None and store[f"pending_{name}"]:
+            store[name] = _merge_runs([store[name]] + store[f"pending_{name}"])
+            store[f"pending_{name}"] = []
+
+
+def add_patients(store: ICStore, dx_features: pd.DataFrame) -> None:
+    """
+    Adds a batch of diagnoses to the store. This is an inplace operation on
+    <store>. Patients that are already in the store can appear again: a
+    (code, patient) pair is only counted once.
+
+    Parameters:
+        store (ICStore): The IC store.
+        dx_features (pd.DataFrame): The diagnoses, with the columns `subject_id`
+            and `icd9_code`.
+    """
+
+    dx = dx_features[["subject_id", "icd9_code"]].dropna()
+    subject_ids = dx["subject_id"].to_numpy().astype(np.int64)
+    if len(subject_ids) and (subject_ids.min() < 0 or subject_ids.max() >= _PAIR_SHIFT):
+        raise ValueError("subject_id values must be between 0 and 2^32 - 1.")
+
+    positions = _code_positions(store, dx["icd9_code"].to_numpy().astype(str))
+    _add_sorted(store, "subjects", np.unique(subject_ids))
+
+    if store["pairs"] is not None:
+        batch_pairs = np.unique(positions.astype(np.int64) * _PAIR_SHIFT + subject_ids)
+        new_pairs = _add_sorted(store, "pairs", batch_pairs)
+        store["counts"] += np.bincount(
+            new_pairs // _PAIR_SHIFT, minlength=len(store["codes"])
+        )
+
+    if store["hll"] is not None:
+        precision = store["hll_precision"]
+        hashes = _hash64(subject_ids)
+        registers = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        # The rank is the position of the first set bit in the next 32 bits
+        rest = ((hashes << np.uint64(precision)) >> np.uint64(32)).astype(np.float64)
+        rank = np.where(rest > 0, 32 - np.floor(np.log2(np.maximum(rest, 1))), 33)
+        np.maximum.at(store["hll"], (positions, registers), rank.astype(np.uint8))
+
+
+def hll_estimate(registers: np.ndarray) -> np.ndarray:
+    """
+    Returns the HyperLogLog distinct count estimate of each row of <registers>
+    (with the linear counting correction for small counts).
+    """
+
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)), axis=1)
+
+    zeros = np.sum(registers == 0, axis=1)
+    small = (estimate <= 2.5 * m) & (zeros > 0)
+    estimate[small] = m * np.log(m / zeros[small])
+
+    return estimate
+
+
+def code_counts(store: ICStore) -> pd.Series:
+    """
+    Returns the number of distinct patients per ICD-9 code: the exact counts if
+    the store keeps them, otherwise the HyperLogLog estimates.
+    """
+
+    if store["pairs"] is not None:
+        counts = store["counts"]
+    else:
+        counts = hll_estimate(store["hll"])
+
+    return pd.Series(counts, index=pd.Index(store["codes"], name="icd9_code"))
+
+
+def ic_table(store: ICStore, all_patients_count: Optional[int] = None) -> pd.DataFrame:
+    """
+    Returns the IC of every code in the store, -log2(patients with the code /
+    all patients).
+
+    Parameters:
+        store (ICStore): The IC store.
+        all_patients_count (int): The number of patients in the cohort. Defaults
+            to the store's `all_patients_count`, or else the number of distinct
+            patients in the store.
+
+    Returns:
+        icd9_ic (pd.DataFrame): The columns `icd9_code` and `icd9_ic`, with one row
+            per code in order of first appearance.
+    """
+
+    if all_patients_count is None:
+        all_patients_count = store.get("all_patients_count")
+    if all_patients_count is None:
+        all_patients_count = len(store["subjects"]) + sum(
+            len(run) for run in store["pending_subjects"]
+        )
+
+    counts = code_counts(store)
+    icd9_ic = pd.DataFrame(
+        {
+            "icd9_code": counts.index.to_numpy(dtype=object),
+            "icd9_ic": -1 * np.log2(counts.to_numpy() / all_patients_count),
+        }
+    )
+
+    return icd9_ic
+
+
+def lookup_ic(
+    store: ICStore, icd9_codes: pd.Series, all_patients_count: Optional[int] = None
+) -> np.ndarray:
+    """
+    Returns the IC of each code in <icd9_codes> (NaN for codes that are not in the
+    store), with the same <all_patients_count> default as ic_table().
+    """
+
+    icd9_ic = ic_table(store, all_patients_count)["icd9_ic"].to_numpy()
+    positions = pd.Index(store["codes"]).get_indexer(icd9_codes.to_numpy().astype(str))
+
+    return np.where(positions >= 0, icd9_ic[positions], np.nan)
+
+
+def save_ic_store(store: ICStore, path: str) -> None:
+    """
+    Persists the store to a NumPy .npz file, after merging its pending runs.
+    """
+
+    _compact(store)
+    arrays = {
+        "codes": store["codes"],
+        "counts": store["counts"],
+        "subjects": store["subjects"],
+    }
+    if store["pairs"] is not None:
+        arrays["pairs"] = store["pairs"]
+    if store["hll"] is not None:
+        arrays["hll"] = store["hll"]
+    if store.get("all_patients_count") is not None:
+        arrays["all_patients_count"] = np.int64(store["all_patients_count"])
+
+    np.savez_compressed(path, **arrays)
+
+
+def load_ic_store(path: str) -> ICStore:
+    """
+    Loads a store persisted with save_ic_store().
+    """
+
+    with np.load(path) as arrays:
+        hll = arrays["hll"] if "hll" in arrays else None
+        store = {
+            "codes": arrays["codes"],
+            "counts": arrays["counts"],
+            "pairs": arrays["pairs"] if "pairs" in arrays else None,
+            "subjects": arrays["subjects"],
+            "pending_pairs": [],
+            "pending_subjects": [],
+            "hll_precision": int(np.log2(hll.shape[1])) if hll is not None else None,
+            "hll": hll,
+            "all_patients_count": (
+                int(arrays["all_patients_count"]) if "all_patients_count" in arrays else None
+            ),
+        }
+
+    return store
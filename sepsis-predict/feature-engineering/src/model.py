@@ -16,6 +16,35 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import roc_auc_score
 from tqdm import tqdm
 import numpy as np
+from src.sparse_features import SparseFeatures, align_rows
+
+
+def get_feature_matrix(joined: pd.DataFrame, label_df: pd.DataFrame):
+    """
+    Returns the feature matrix and label vector of fit_model(), with one row per
+    row of <label_df>. Patients without features are missing (NaN) in every
+    column, for the imputer, for both a dense <joined> (after the left merge)
+    and a SparseFeatures (stored explicitly).
+
+    Parameters:
+        joined (pd.DataFrame): The joined feature matrix (or a SparseFeatures, see
+            sparse_features.py)
+        label_df (pd.DataFrame): The dataframe containing the labels
+
+    Returns:
+        X (pd.DataFrame or scipy.sparse.csr_matrix): The feature matrix
+        y (pd.Series): The labels
+    """
+
+    if isinstance(joined, SparseFeatures):
+        X = align_rows(joined, label_df["subject_id"].to_numpy(), fill_value=np.nan)
+        y = label_df["label"].astype(int).reset_index(drop=True)
+    else:
+        df = pd.merge(label_df, joined, how="left")
+        X = df.drop(columns=label_df.columns)
+        y = df["label"].astype(int)
+
+    return X, y
 
 
 def fit_model(joined: pd.DataFrame, label_df: pd.DataFrame):
@@ -26,23 +55,21 @@ def fit_model(joined: pd.DataFrame, label_df: pd.DataFrame):
     defined in this function.
 
     Parameters:
-        joined (pd.DataFrame): The joined feature matrix
+        joined (pd.DataFrame): The joined feature matrix (or a SparseFeatures, see
+            sparse_features.py)
         label_df (pd.DataFrame): The dataframe containing the labels
     """
 
     # Determine final feature matrix and label vector
-    df = pd.merge(label_df, joined, how="left")
-
-    # Extract features and labels
-    X = df.drop(columns=label_df.columns)
-    y = df["label"].astype(int)
+    X, y = get_feature_matrix(joined, label_df)
 
     # Set up a training control configuration for cross-validation
     cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
 
     # Preprocessing steps
     imputer = SimpleImputer(strategy="median")
-    scaler = StandardScaler()
+    # A sparse matrix cannot be centered without densifying it, so it is only scaled
+    scaler = StandardScaler(with_mean=not isinstance(joined, SparseFeatures))
 
     # Create an elastic net
     logistic_elastic_net = LogisticRegression(
@@ -66,7 +93,10 @@ def fit_model(joined: pd.DataFrame, label_df: pd.DataFrame):
         cv.split(X, y), unit="fold", total=cv.get_n_splits()
     ):
         # Split the data
-        X_train, X_test = X.iloc[train_index], X.iloc[test_index]
+        if isinstance(joined, SparseFeatures):
+            X_train, X_test = X[train_index], X[test_index]
+        else:
+            X_train, X_test = X.iloc[train_index], X.iloc[test_index]
         y_train, y_test = y.iloc[train_index], y.iloc[test_index]
 
         # Fit and evaluate the pipeline
@@ -46,18 +46,132 @@ def filter_by_chartdate(
 
 
     # ==================== YOUR CODE HERE ====================
-    shock_labels_test = shock_labels[['subject_id', 'index_time']]
-    merged = pd.merge(notes, shock_labels_test, on=['subject_id'], how='outer')
-    merged['index_date'] =  [x.date() for x in merged['index_time']]
-    merged['chart_date'] =  [x.date() for x in merged['chartdate']]
-    notes_filtered = merged[merged['chart_date'] < merged['index_date']]
-
-    notes_filtered = notes_filtered[notes.columns]
+    ## Only the note row numbers and day numbers are semi-joined (an inner merge,
+    ## not the note text), and the dates are compared as int64 days in NumPy. The
+    ## kept notes are taken by row number, so they keep the index of <notes>
+    note_days = pd.DataFrame({
+        'subject_id': notes['subject_id'].to_numpy(),
+        '_note_row': np.arange(len(notes)),
+        '_chart_day': day_numbers(notes['chartdate']),
+    })
+    merged = pd.merge(note_days, index_days(shock_labels), on=['subject_id'], how='inner')
+
+    before = before_index_day(merged['_chart_day'], merged['_index_day'])
+    notes_filtered = notes.iloc[merged['_note_row'].to_numpy()[before]]
     # ==================== YOUR CODE HERE ====================
     
     return notes_filtered
 
 
+## Sentinel day number of missing dates (never before another day)
+_NO_DAY = np.iinfo(np.int64).min
+
+_NS_PER_DAY = 24 * 60 * 60 * 10**9
+
+
+def day_numbers(times: pd.Series) -> np.ndarray:
+    """
+    Returns the day of each datetime in <times> as int64 days since the epoch,
+    the same day as datetime.date() (in UTC for timezone-aware datetimes).
+    Missing values become _NO_DAY.
+    """
+
+    ns = pd.DatetimeIndex(times).asi8
+    days = np.floor_divide(ns, _NS_PER_DAY)
+    days[pd.isna(times).to_numpy()] = _NO_DAY
+
+    return days
+
+
+def index_days(shock_labels: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the `subject_id` and day number of the index_time (`_index_day`) of
+    each row of <shock_labels>.
+    """
+
+    return pd.DataFrame({
+        'subject_id': shock_labels['subject_id'].to_numpy(),
+        '_index_day': day_numbers(shock_labels['index_time']),
+    })
+
+
+def before_index_day(chart_days: pd.Series, index_days: pd.Series) -> np.ndarray:
+    """
+    Returns whether each chart day is before its index day. Missing days (NaN
+    or _NO_DAY) are never before.
+    """
+
+    chart_days = chart_days.to_numpy(dtype=np.float64, na_value=np.nan)
+    index_days = index_days.to_numpy(dtype=np.float64, na_value=np.nan)
+    chart_days[chart_days == _NO_DAY] = np.nan
+    index_days[index_days == _NO_DAY] = np.nan
+
+    return chart_days < index_days
+
+
+def filter_by_chartdate_chunked(
+    shock_labels: pd.DataFrame,
+    notes_path: str,
+    chartdate_format: str = "%Y-%m-%d",
+    chunksize: int = 100_000,
+) -> pd.DataFrame:
+    """
+    Streaming version of filter_by_chartdate() that reads the notes CSV file in
+    chunks instead of loading the whole notes table into memory.
+
+    Each chunk is prepared as in the notebook (lower case column names, UTC
+    `chartdate`), semi-joined with the index days on `subject_id` (an inner
+    merge of the row numbers only), and only its matching notes are kept, so
+    peak memory depends on the chunk size and the number of notes kept.
+
+    Parameters:
+        shock_labels (pd.DataFrame): dataframe containing the index_time for each
+            patient
+        notes_path (str): Path to the notes CSV file.
+        chartdate_format (str): The format of the `chartdate` column.
+        chunksize (int): The number of notes to read per chunk.
+
+    Returns:
+        notes_filtered (pd.DataFrame): the notes that have a chartdate prior to
+            the day of the index_time for the patient, in file order (with a new
+            index)
+    """
+
+    labels = index_days(shock_labels)
+
+    filtered_chunks = []
+    for chunk in pd.read_csv(notes_path, chunksize=chunksize):
+        chunk = _prepare_notes(chunk, chartdate_format)
+
+        note_days = pd.DataFrame({
+            'subject_id': chunk['subject_id'].to_numpy(),
+            '_note_row': np.arange(len(chunk)),
+            '_chart_day': day_numbers(chunk['chartdate']),
+        })
+        matched = pd.merge(note_days, labels, on=['subject_id'], how='inner')
+        before = before_index_day(matched['_chart_day'], matched['_index_day'])
+        filtered_chunks.append(chunk.iloc[np.sort(matched['_note_row'].to_numpy()[before])])
+        del chunk
+
+    if not filtered_chunks:
+        # No notes at all: an empty frame with the columns of the notes file
+        return _prepare_notes(pd.read_csv(notes_path, nrows=0), chartdate_format)
+
+    return pd.concat(filtered_chunks, ignore_index=True)
+
+
+def _prepare_notes(notes: pd.DataFrame, chartdate_format: str) -> pd.DataFrame:
+    """
+    Prepares notes read from the CSV file as in the notebook: lower case column
+    names and a UTC `chartdate`. This is an inplace operation on <notes>.
+    """
+
+    notes.columns = [x.lower() for x in notes.columns]
+    notes['chartdate'] = pd.to_datetime(notes['chartdate'], format=chartdate_format, utc=True)
+
+    return notes
+
+
 def merge_snomed(
     snomed_ct_isaclosure: pd.DataFrame, snomed_ct_str_cui: pd.DataFrame
 ) -> pd.DataFrame:
@@ -0,0 +1,142 @@
+"""
+sparse_features.py
+
+This file contains a sparse patient-feature matrix for the high-dimensional
+features (e.g. one column per time-binned ICD-9 code, see
+get_diagnosis_features_sparse() in features.py), which are almost all zeros.
+
+A SparseFeatures is a tuple of:
+    - `matrix`: a scipy.sparse CSR matrix with one row per patient and one column
+        per feature
+    - `subject_ids`: the row vocabulary, the sorted `subject_id` of each row
+    - `columns`: the column vocabulary, the sorted name of each column
+
+Missing entries are 0 (where the dense pivot would have NaN).
+
+EXAMPLE:
+    diagnosis_features = get_diagnosis_features_sparse(dx_selected)
+    joined = join_and_clean_data(diagnosis_features, note_concept_features,
+        heart_rate_features)
+    fit_model(joined, shock_labels)
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from typing import NamedTuple
+
+
+class SparseFeatures(NamedTuple):
+    matrix: sp.csr_matrix
+    subject_ids: np.ndarray
+    columns: pd.Index
+
+
+def _sorted_codes(values: pd.Series):
+    """
+    Returns the sorted distinct values of <values> and the position of each value
+    in them. The values are hashed rather than sorted; only the distinct values
+    (or the categories of a categorical) are sorted.
+    """
+
+    if values.dtype == "category":
+        codes = values.cat.codes.to_numpy()
+        uniques = values.cat.categories.to_numpy()
+    else:
+        codes, uniques = pd.factorize(values.to_numpy())
+
+    order = np.argsort(uniques, kind="stable")
+    ranks = np.empty(len(uniques), dtype=np.int64)
+    ranks[order] = np.arange(len(uniques))
+
+    return uniques[order], ranks[codes]
+
+
+def from_grouped_counts(
+    subject_ids: pd.Series, feature_names: pd.Series, counts: pd.Series
+) -> SparseFeatures:
+    """
+    Builds a SparseFeatures from grouped counts in long format (one value per
+    patient and feature), without pivoting. Duplicate (patient, feature) values
+    are summed.
+
+    Parameters:
+        subject_ids (pd.Series): The `subject_id` of each value.
+        feature_names (pd.Series): The feature (column) name of each value (can
+            be a categorical).
+        counts (pd.Series): The values.
+
+    Returns:
+        features (SparseFeatures): The sparse patient-feature matrix, with rows
+            and columns in sorted order.
+    """
+
+    if feature_names.dtype != "category":
+        feature_names = feature_names.astype(str)
+    row_vocab, rows = _sorted_codes(subject_ids)
+    column_vocab, cols = _sorted_codes(feature_names)
+
+    matrix = sp.csr_matrix(
+        (counts.to_numpy(dtype=np.float64), (rows, cols)),
+        shape=(len(row_vocab), len(column_vocab)),
+    )
+    matrix.sum_duplicates()
+
+    return SparseFeatures(matrix, row_vocab, pd.Index(column_vocab))
+
+
+def align_rows(
+    features: SparseFeatures, subject_ids: np.ndarray, fill_value: float = 0.0
+) -> sp.csr_matrix:
+    """
+    Returns the rows of <features> for <subject_ids>, in that order. Patients
+    without a row get <fill_value> in every column (stored explicitly unless it
+    is 0, e.g. NaN for the imputer, as after a left merge of a dense matrix).
+    """
+
+    positions = pd.Index(features.subject_ids).get_indexer(subject_ids)
+
+    # Missing patients point at an extra row at the end
+    if fill_value == 0:
+        fill_row = sp.csr_matrix((1, features.matrix.shape[1]))
+    else:
+        fill_row = sp.csr_matrix(np.full((1, features.matrix.shape[1]), fill_value))
+    padded = sp.vstack([features.matrix, fill_row]).tocsr()
+    positions[positions == -1] = features.matrix.shape[0]
+
+    return padded[positions]
+
+
+def hstack_dense(features: SparseFeatures, dense_df: pd.DataFrame) -> SparseFeatures:
+    """
+    Appends the columns of <dense_df> (one row per `subject_id`) to <features>.
+    The rows are the rows of <dense_df>; patients of <features> that are not in
+    <dense_df> are dropped, and patients of <dense_df> that are not in
+    <features> get zeros in the sparse columns.
+    """
+
+    subject_ids = dense_df["subject_id"].to_numpy()
+    dense_values = dense_df.drop(columns="subject_id")
+
+    matrix = sp.hstack(
+        [
+            align_rows(features, subject_ids),
+            sp.csr_matrix(dense_values.to_numpy(dtype=np.float64)),
+        ],
+        format="csr",
+    )
+    columns = features.columns.append(pd.Index(dense_values.columns.astype(str)))
+
+    return SparseFeatures(matrix, subject_ids, columns)
+
+
+def to_dense_frame(features: SparseFeatures) -> pd.DataFrame:
+    """
+    Returns <features> as a dense DataFrame with a `subject_id` column (missing
+    entries are 0). Only for small matrices.
+    """
+
+    dense_df = pd.DataFrame(features.matrix.toarray(), columns=features.columns)
+    dense_df.insert(0, "subject_id", features.subject_ids)
+
+    return dense_df
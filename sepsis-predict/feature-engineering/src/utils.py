@@ -14,6 +14,7 @@ IMPORTANT INSTRUCTIONS:
 
 import pandas as pd
 from typing import Union, List
+from src.sparse_features import SparseFeatures, hstack_dense
 
 
 def preprocess_dates(
@@ -80,13 +81,15 @@ def join_and_clean_data(diagnosis_features, note_concept_features, heart_rate_fe
         - The returned dataframe should be sorted by `subject_id` in ascending order.
 
     Parameters:
-        diagnosis_features (pd.DataFrame): The patient diagnosis features dataframe.
+        diagnosis_features (pd.DataFrame): The patient diagnosis features dataframe
+            (or a SparseFeatures, see sparse_features.py).
         note_concept_features (pd.DataFrame): The patient note concept features
             dataframe.
         heart_rate_features (pd.DataFrame): The patient heart rate features dataframe.
 
     Returns:
-        X (pd.DataFrame): The joined and cleaned dataframe of all features.
+        X (pd.DataFrame): The joined and cleaned dataframe of all features (a
+            SparseFeatures if <diagnosis_features> is one).
     """
 
     # Overwrite this variable with the return value for your implementation
@@ -94,6 +97,16 @@ def join_and_clean_data(diagnosis_features, note_concept_features, heart_rate_fe
 
 
     # ==================== YOUR CODE HERE ====================
+    ## Sparse diagnosis features (see get_diagnosis_features_sparse()): clean the
+    ## dense features for all patients, then append them to the sparse matrix
+    if isinstance(diagnosis_features, SparseFeatures):
+        dense_X = join_and_clean_data(
+            pd.DataFrame({'subject_id': diagnosis_features.subject_ids}),
+            note_concept_features,
+            heart_rate_features,
+        )
+        return hstack_dense(diagnosis_features, dense_X)
+
     X = pd.merge(diagnosis_features, note_concept_features, on='subject_id', how='outer') 
     X = X.fillna(0)    
     X = X.merge(heart_rate_features, on='subject_id', how='outer')
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import the assignment modules as `src.<module>`, as the notebook does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
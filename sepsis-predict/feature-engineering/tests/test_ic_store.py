@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from src.features import calc_ic, filter_ic
+from src.ic_store import add_patients, create_ic_store, ic_table, load_ic_store, save_ic_store
+
+
+def make_dx_features(seed=0, n=5000):
+    rng = np.random.default_rng(seed)
+    codes = np.array([f"{i:04d}" for i in range(300)] + ["V1582", "E8497"])
+    return pd.DataFrame(
+        {
+            "subject_id": rng.integers(1, 800, n),
+            "hadm_id": 1,
+            "icd9_code": codes[np.minimum(rng.zipf(1.3, n) - 1, len(codes) - 1)],
+        }
+    )
+
+
+def test_filter_ic_store_matches_table():
+    dx_features = make_dx_features()
+    # The cohort is larger than the number of patients with a diagnosis
+    all_patients_count = 974
+
+    store = create_ic_store(all_patients_count=all_patients_count)
+    add_patients(store, dx_features)
+
+    from_table = filter_ic(dx_features, calc_ic(dx_features, all_patients_count))
+    from_store = filter_ic(dx_features, store)
+
+    pd.testing.assert_frame_equal(from_store, from_table)
+
+
+def test_incremental_batches_match_single_build(tmp_path):
+    dx_features = make_dx_features()
+
+    single = create_ic_store(all_patients_count=974)
+    add_patients(single, dx_features)
+
+    incremental = create_ic_store(all_patients_count=974)
+    for batch in np.array_split(dx_features.sample(frac=1, random_state=1), 5):
+        add_patients(incremental, batch)
+    # Patients that are added again are not counted twice
+    add_patients(incremental, dx_features.iloc[:500])
+
+    path = str(tmp_path / "ic_store.npz")
+    save_ic_store(incremental, path)
+    loaded = load_ic_store(path)
+
+    assert loaded["all_patients_count"] == 974
+    assert np.all(np.diff(loaded["pairs"]) > 0)
+    pd.testing.assert_frame_equal(
+        ic_table(loaded).sort_values("icd9_code").reset_index(drop=True),
+        ic_table(single).sort_values("icd9_code").reset_index(drop=True),
+    )
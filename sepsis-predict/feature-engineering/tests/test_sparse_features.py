@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from sklearn.impute import SimpleImputer
+
+from src.features import get_diagnosis_features, get_diagnosis_features_sparse
+from src.model import get_feature_matrix
+from src.sparse_features import to_dense_frame
+from src.utils import join_and_clean_data
+
+
+def make_inputs(seed=0):
+    rng = np.random.default_rng(seed)
+    n = 2000
+    index_time = pd.Timestamp("2150-01-01", tz="UTC")
+    dx_selected = pd.DataFrame(
+        {
+            "subject_id": rng.integers(1, 150, n),
+            "hadm_id": 1,
+            "icd9_code": rng.choice(["4019", "25000", "V1582", "5849", "0389"], n),
+            "index_time": index_time,
+            "diagnosis_time": index_time - pd.to_timedelta(rng.integers(1, 600, n), unit="D"),
+        }
+    )
+    note_concept_features = pd.DataFrame(
+        {"subject_id": np.arange(100, 200), "C0001": rng.integers(0, 3, 100)}
+    )
+    heart_rate_features = pd.DataFrame(
+        {
+            "subject_id": np.arange(1, 220, 2),
+            "latest_heart_rate": rng.normal(85, 10, 110),
+            "time_wt_avg": rng.normal(85, 10, 110),
+        }
+    )
+    # Patients 250-299 have no features at all
+    label_df = pd.DataFrame(
+        {"subject_id": np.arange(1, 300), "label": rng.integers(0, 2, 299)}
+    )
+
+    return dx_selected, note_concept_features, heart_rate_features, label_df
+
+
+def test_sparse_diagnosis_features_match_dense():
+    dx_selected, _, _, _ = make_inputs()
+
+    dense = get_diagnosis_features(dx_selected.copy())
+    sparse = get_diagnosis_features_sparse(dx_selected)
+
+    pd.testing.assert_frame_equal(to_dense_frame(sparse), dense.fillna(0), check_dtype=False)
+
+
+def test_diagnosis_features_count_each_bin():
+    index_time = pd.Timestamp("2150-01-01", tz="UTC")
+    dx_selected = pd.DataFrame(
+        {
+            "subject_id": [1, 1, 1, 2],
+            "icd9_code": ["4019", "4019", "4019", "5849"],
+            "index_time": index_time,
+            "diagnosis_time": index_time - pd.to_timedelta([10, 20, 400, 30], unit="D"),
+        }
+    )
+
+    sparse = to_dense_frame(get_diagnosis_features_sparse(dx_selected)).set_index("subject_id")
+
+    assert sparse.loc[1, "RECENT_4019"] == 2
+    assert sparse.loc[1, "PRIOR_4019"] == 1
+    assert sparse.loc[2, "RECENT_5849"] == 1
+    assert sparse.loc[2, "PRIOR_5849"] == 0
+    pd.testing.assert_frame_equal(
+        sparse.reset_index(), get_diagnosis_features(dx_selected.copy()).fillna(0), check_dtype=False
+    )
+
+
+def test_sparse_and_dense_feature_matrix_match_after_imputation():
+    dx_selected, notes, heart_rate, label_df = make_inputs()
+
+    dense_joined = join_and_clean_data(get_diagnosis_features(dx_selected.copy()), notes, heart_rate)
+    sparse_joined = join_and_clean_data(get_diagnosis_features_sparse(dx_selected), notes, heart_rate)
+
+    dense_X, dense_y = get_feature_matrix(dense_joined, label_df)
+    sparse_X, sparse_y = get_feature_matrix(sparse_joined, label_df)
+
+    assert list(dense_X.columns) == list(sparse_joined.columns)
+    # Patients without features are imputed, not zero (e.g. no 0 bpm heart rates)
+    imputed_dense = SimpleImputer(strategy="median").fit_transform(dense_X)
+    imputed_sparse = SimpleImputer(strategy="median").fit_transform(sparse_X)
+    np.testing.assert_allclose(imputed_sparse.toarray(), imputed_dense)
+    assert (imputed_sparse[:, list(sparse_joined.columns).index("latest_heart_rate")].toarray() > 0).all()
+    pd.testing.assert_series_equal(sparse_y, dense_y)